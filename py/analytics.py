@@ -0,0 +1,96 @@
+"""Отчёт /stats: время ответа специалистов, длительность сессий, запросы по дням.
+
+Счётчики копятся в таблицах stats_hourly и stats_daily (db.py) в момент
+событий: создание, принятие и отклонение запроса, первый ответ
+специалиста в сессии, завершение сессии. Отчёт читает только эти таблицы —
+не больше 24 + 30 строк, — поэтому время его построения не зависит от
+объёма истории. Периоды считаются по UTC, как и время в базе.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from async_db import get_stats
+from db import FIRST_REPLY_BOUNDS
+
+# Сколько дней показывать в строке «запросы по дням»
+DAILY_REQUESTS_DAYS = 7
+
+def sum_stats(rows: List[Dict]) -> Dict[str, float]:
+    """Складывает строки статистики; поля *_max — наибольшее значение"""
+    totals: Dict[str, float] = {}
+    for row in rows:
+        for column, value in row.items():
+            if column == 'bucket':
+                continue
+            if column.endswith('_max'):
+                totals[column] = max(totals.get(column, 0), value)
+            else:
+                totals[column] = totals.get(column, 0) + value
+    return totals
+
+def format_duration(seconds: float) -> str:
+    """Длительность вида «45 с», «12 мин», «1 ч», «3 ч 05 мин»"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} с"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} мин"
+    if minutes % 60 == 0:
+        return f"{minutes // 60} ч"
+    return f"{minutes // 60} ч {minutes % 60:02d} мин"
+
+def _average(totals: Dict[str, float], total: str, count: str) -> str:
+    if not totals.get(count):
+        return "—"
+    return format_duration(totals[total] / totals[count])
+
+def render_period(title: str, totals: Dict[str, float]) -> List[str]:
+    """Строки отчёта за один период"""
+    lines = [
+        f"<b>{title}</b>",
+        f"Запросов: {int(totals.get('requests', 0))}, принято: {int(totals.get('accepted', 0))}, "
+        f"отклонено: {int(totals.get('rejected', 0))}",
+        f"Ожидание принятия: в среднем {_average(totals, 'wait_seconds', 'accepted')}, "
+        f"максимум {format_duration(totals.get('wait_max', 0))}",
+    ]
+    first_replies = int(totals.get('first_replies', 0))
+    if first_replies:
+        within = ", ".join(
+            f"до {format_duration(bound)} — {totals.get(column, 0) * 100 / first_replies:.0f}%"
+            for bound, column in FIRST_REPLY_BOUNDS
+        )
+        lines.append(
+            f"Первый ответ: в среднем {_average(totals, 'first_reply_seconds', 'first_replies')}, "
+            f"максимум {format_duration(totals.get('first_reply_max', 0))}; {within}"
+        )
+    else:
+        lines.append("Первый ответ: —")
+    lines.append(
+        f"Сессий завершено: {int(totals.get('sessions_ended', 0))}, средняя длительность "
+        f"{_average(totals, 'session_seconds', 'sessions_ended')}"
+    )
+    return lines
+
+def render_stats(hourly: List[Dict], daily: List[Dict], today: datetime) -> str:
+    """Текст отчёта /stats (HTML) по строкам stats_hourly за сутки и stats_daily за 30 дней"""
+    week_start = (today - timedelta(days=6)).strftime("%Y-%m-%d")
+    lines = ["📊 <b>Статистика</b> (время UTC)", ""]
+    lines += render_period("За 24 часа", sum_stats(hourly)) + [""]
+    lines += render_period("За 7 дней", sum_stats([row for row in daily if row['bucket'] >= week_start])) + [""]
+    lines += render_period("За 30 дней", sum_stats(daily)) + [""]
+
+    by_day = {row['bucket']: int(row['requests']) for row in daily}
+    days = [today - timedelta(days=i) for i in range(DAILY_REQUESTS_DAYS - 1, -1, -1)]
+    lines.append("<b>Запросы по дням</b>")
+    lines.append(", ".join(f"{day:%d.%m} — {by_day.get(day.strftime('%Y-%m-%d'), 0)}" for day in days))
+    return "\n".join(lines)
+
+async def build_stats_report(now: datetime = None) -> str:
+    """Читает сводную статистику за 30 дней и возвращает текст отчёта"""
+    now = now or datetime.utcnow()
+    stats = await get_stats(
+        hourly_since=(now - timedelta(hours=23)).strftime("%Y-%m-%d %H:00"),
+        daily_since=(now - timedelta(days=29)).strftime("%Y-%m-%d"),
+    )
+    return render_stats(stats['hourly'], stats['daily'], now)
@@ -0,0 +1,310 @@
+"""Асинхронный доступ к базе данных.
+
+Все функции db.py выполняются в одном выделенном потоке, поэтому
+обработчики не блокируют цикл событий, а единственное соединение
+SQLite используется строго последовательно.
+"""
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import db
+from config import WRITE_BEHIND_FLUSH_SECONDS
+from state_cache import user_state
+from metrics import db_duration, db_errors
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+# Суммарное число вызовов и время работы в потоке БД
+db_stats = {'calls': 0, 'seconds': 0.0}
+
+def _timed(func, args, kwargs):
+    # Составные функции async_db (_accept_request и т.п.) учитываются под именем операции
+    name = func.__name__.lstrip('_')
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        db_errors.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        db_stats['calls'] += 1
+        db_stats['seconds'] += elapsed
+        db_duration.observe(elapsed, name)
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в потоке базы данных"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _timed, func, args, kwargs)
+
+def _to_async(func):
+    """Создаёт асинхронную обёртку над функцией db.py"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+class MessageWriteBuffer:
+    """Буфер отложенной записи сообщений.
+
+    Сообщения копятся в памяти и сохраняются одной транзакцией через
+    flush_interval секунд после первого сообщения пачки или сразу при
+    достижении max_batch. Если запись не удалась, пачка остаётся в буфере
+    и повторяется через retry_interval секунд.
+    """
+
+    def __init__(self, flush_interval: float = WRITE_BEHIND_FLUSH_SECONDS, max_batch: int = 200,
+                 retry_interval: float = 1.0):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self._rows: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def add(self, session_id: Optional[int], request_id: int, sender_id: int,
+            message_text: str = None, media_type: str = None, media_id: str = None):
+        """Ставит сообщение в очередь на сохранение"""
+        self._rows.append((session_id, request_id, sender_id, message_text, media_type, media_id))
+        if len(self._rows) >= self.max_batch:
+            asyncio.get_running_loop().create_task(self._flush_in_background())
+        else:
+            self._schedule(self.flush_interval)
+
+    def _schedule(self, delay: float):
+        if self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(delay, lambda: loop.create_task(self._flush_in_background()))
+
+    async def flush(self, raise_errors: bool = False) -> bool:
+        """Сохраняет накопленные сообщения; False, если запись не удалась.
+
+        Ошибка записи только попадает в лог: пачку повторит таймер, а
+        вызывающий код (чтения и записи через _after_flush) эти строки не
+        писал и работает дальше. raise_errors=True — ошибка передаётся
+        вызывающему (при закрытии базы).
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._rows:
+            return True
+        rows, self._rows = self._rows, []
+        try:
+            await run_db(db.add_messages, rows)
+        except Exception as e:
+            # Возвращаем пачку в начало буфера, чтобы не потерять сообщения
+            self._rows[:0] = rows
+            # Без таймера пачка ждала бы следующего сообщения
+            self._schedule(self.retry_interval)
+            if raise_errors:
+                raise
+            logger.error(f"Ошибка сохранения сообщений, повтор через {self.retry_interval} с: {e}")
+            return False
+        return True
+
+    async def _flush_in_background(self):
+        await self.flush()
+
+message_buffer = MessageWriteBuffer()
+
+def _after_flush(func):
+    """Обёртка, сохраняющая буфер сообщений перед вызовом функции db.py.
+
+    Поток БД выполняет задачи по очереди, поэтому чтение или пакетная
+    запись увидят все сообщения, поставленные в буфер раньше.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        await message_buffer.flush()
+        return await run_db(func, *args, **kwargs)
+    return wrapper
+
+async def close_db():
+    """Сохраняет буфер и закрывает соединение в потоке базы данных"""
+    await message_buffer.flush(raise_errors=True)
+    await run_db(db.close_db)
+
+async def iter_export_rows(request_id: Optional[int] = None, since: Optional[str] = None,
+                           until: Optional[str] = None, chunk_size: int = 500):
+    """Асинхронно перебирает сообщения для выгрузки порциями по chunk_size.
+
+    Каждая порция — отдельный короткий запрос, поэтому длинная выгрузка
+    не занимает поток БД и в памяти держится не больше одной порции.
+    """
+    await message_buffer.flush()
+    after = None
+    while True:
+        rows = await run_db(db.get_export_page, after, request_id, since, until, chunk_size)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]['sent_at'], rows[-1]['message_id'])
+
+async def iter_messages_for_request(request_id: int, chunk_size: int = 200):
+    """Асинхронно перебирает сообщения запроса порциями по chunk_size,
+    не загружая всю историю в память"""
+    await message_buffer.flush()
+    after = None
+    while True:
+        rows = await run_db(db.get_messages_page, request_id, after, chunk_size)
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]['sent_at'], rows[-1]['message_id'])
+
+def _state_snapshot():
+    return db.get_pending_requests(), db.get_active_sessions()
+
+async def warm_state_cache():
+    """Загружает в кэш все ожидающие запросы и активные сессии"""
+    user_state.warm(*await run_db(_state_snapshot))
+
+async def get_user_active_request(user_id: int) -> Optional[Dict]:
+    """Возвращает активный запрос пользователя (через кэш состояния)"""
+    found, request = user_state.get_request(user_id)
+    if not found:
+        request = await run_db(db.get_user_active_request, user_id)
+        user_state.set_request(user_id, request)
+    return request
+
+async def get_active_session_by_user(user_id: int) -> Optional[Dict]:
+    """Возвращает активную сессию пользователя (через кэш состояния)"""
+    found, session = user_state.get_session(user_id)
+    if not found:
+        session = await run_db(db.get_active_session_by_user, user_id)
+        user_state.set_session(user_id, session)
+    return session
+
+def _user_state(user_id: int):
+    return db.get_user_active_request(user_id), db.get_active_session_by_user(user_id)
+
+def _store_user_state(user_id: int, state):
+    request, session = state
+    user_state.set_request(user_id, request)
+    user_state.set_session(user_id, session)
+
+def _add_user_request(user_id: int, user_name: str, username: str, request_text: str,
+                      specialist_id: Optional[int] = None):
+    request_id = db.add_user_request(user_id, user_name, username, request_text, specialist_id)
+    return request_id, _user_state(user_id)
+
+async def add_user_request(user_id: int, user_name: str, username: str, request_text: str,
+                           specialist_id: Optional[int] = None) -> int:
+    """Добавляет новый запрос пользователя и обновляет кэш"""
+    request_id, state = await run_db(
+        _add_user_request, user_id, user_name, username, request_text, specialist_id
+    )
+    _store_user_state(user_id, state)
+    return request_id
+
+def _accept_request(request_id: int, admin_id: int):
+    accepted = db.accept_request(request_id, admin_id)
+    if accepted is None:
+        return None, None
+    return accepted, _user_state(accepted[0]['user_id'])
+
+async def accept_request(request_id: int, admin_id: int) -> Optional[tuple]:
+    """Принимает ожидающий запрос и начинает по нему сессию: (запрос, session_id)
+    или None, если запрос уже приняли или удалили.
+
+    Смена статуса и создание сессии — одна транзакция в db.accept_request,
+    её видят целиком все процессы. Локальный кэш обновляется после неё
+    один раз, поэтому в нём у пользователя тоже не бывает момента без
+    запроса и без сессии.
+    """
+    accepted, state = await run_db(_accept_request, request_id, admin_id)
+    if accepted is not None:
+        _store_user_state(accepted[0]['user_id'], state)
+    return accepted
+
+def _end_session(session_id: int):
+    session = db.get_session_info(session_id)
+    # Повторное нажатие «Завершить» приходит, когда сессии уже нет
+    if not session:
+        return None, None
+    db.end_session(session_id)
+    return session['user_id'], _user_state(session['user_id'])
+
+async def end_session(session_id: int):
+    """Завершает сессию и обновляет кэш"""
+    await message_buffer.flush()
+    user_id, state = await run_db(_end_session, session_id)
+    if user_id is not None:
+        _store_user_state(user_id, state)
+
+def _delete_request(request_id: int):
+    request = db.get_request(request_id)
+    if not request or not db.delete_request(request_id):
+        return None, None
+    return request['user_id'], _user_state(request['user_id'])
+
+async def delete_request(request_id: int) -> bool:
+    """Удаляет (отклоняет) ожидающий запрос и обновляет кэш; False, если запрос
+    уже приняли или удалили"""
+    user_id, state = await run_db(_delete_request, request_id)
+    if user_id is None:
+        return False
+    _store_user_state(user_id, state)
+    return True
+
+def _reset_active_sessions():
+    db.reset_active_sessions()
+    return _state_snapshot()
+
+async def reset_active_sessions():
+    """Завершает все сессии и заново заполняет кэш"""
+    user_state.warm(*await run_db(_reset_active_sessions))
+
+def _clear_all_requests():
+    db.clear_all_requests()
+    return _state_snapshot()
+
+async def clear_all_requests():
+    """Удаляет все данные и заново заполняет кэш"""
+    await message_buffer.flush()
+    user_state.warm(*await run_db(_clear_all_requests))
+
+init_db = _to_async(db.init_db)
+ping = _to_async(db.ping)
+get_pending_requests = _to_async(db.get_pending_requests)
+get_pending_requests_page = _to_async(db.get_pending_requests_page)
+get_active_sessions = _to_async(db.get_active_sessions)
+get_current_session = _to_async(db.get_current_session)
+set_current_session = _to_async(db.set_current_session)
+get_specialist_sessions = _to_async(db.get_specialist_sessions)
+get_specialist_loads = _to_async(db.get_specialist_loads)
+add_relayed_messages = _to_async(db.add_relayed_messages)
+get_session_by_reply = _to_async(db.get_session_by_reply)
+add_message_to_request = _to_async(db.add_message_to_request)
+add_session_message = _to_async(db.add_session_message)
+get_messages_for_request = _after_flush(db.get_messages_for_request)
+add_messages = _after_flush(db.add_messages)
+journal_media_item = _to_async(db.journal_media_item)
+get_media_group_items = _to_async(db.get_media_group_items)
+get_media_stats = _to_async(db.get_media_stats)
+get_unmirrored_media = _to_async(db.get_unmirrored_media)
+store_media_blob = _to_async(db.store_media_blob)
+fail_media_mirror = _to_async(db.fail_media_mirror)
+touch_media_blob = _to_async(db.touch_media_blob)
+evict_media_blobs = _to_async(db.evict_media_blobs)
+# Первые ответы специалистов учитываются при записи сообщений из буфера
+get_stats = _after_flush(db.get_stats)
+mark_media_group_sent = _to_async(db.mark_media_group_sent)
+complete_media_group = _after_flush(db.complete_media_group)
+get_unfinished_media_groups = _to_async(db.get_unfinished_media_groups)
+purge_media_journal = _to_async(db.purge_media_journal)
+get_request = _to_async(db.get_request)
+get_requests = _to_async(db.get_requests)
+search_messages = _after_flush(db.search_messages)
+get_session_info = _to_async(db.get_session_info)
+archive_completed_requests = _to_async(db.archive_completed_requests)
+get_archived_request = _to_async(db.get_archived_request)
+incremental_vacuum = _to_async(db.incremental_vacuum)
@@ -0,0 +1 @@
+"""Нагрузочные тесты и бенчмарки. Запуск из папки py: python -m bench.<модуль>"""
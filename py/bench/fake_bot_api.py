@@ -0,0 +1,291 @@
+"""Локальная замена Telegram Bot API для бенчмарков.
+
+HTTP-сервер принимает вызовы бота по адресу /bot<token>/<method>, отдаёт
+обновления через getUpdates (long polling) или отправляет их на webhook,
+а все исходящие сообщения бота записывает вместе со временем получения.
+Файлы из files отдаются через getFile и /file/bot<token>/<путь> порциями,
+как большой ответ настоящего сервера.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Callable, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+class ApiError(Exception):
+    """Ошибка Bot API: ответ {"ok": false} с кодом и описанием"""
+
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Everest", "username": "everest_test_bot"}
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.updates: List[Dict] = []
+        self.sent: List[Dict] = []
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        # Вызывается для каждого исходящего вызова бота: listener(method, params, result)
+        self.listeners: List[Callable] = []
+        # Искусственная задержка ответа по методам Bot API, секунды
+        self.delays: Dict[str, float] = {}
+        # Содержимое файлов по file_id для getFile и скачивания
+        self.files: Dict[str, bytes] = {}
+        self.downloads = 0
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._waiters: List[tuple] = []
+        self._runner: Optional[web.AppRunner] = None
+        self._client: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def base_url(self) -> str:
+        """Значение для Application.builder().base_url(...)"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        """Значение для Application.builder().base_file_url(...)"""
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/file/bot{token}/{path:.+}", self._download)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self._client = aiohttp.ClientSession()
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- Обновления -----------------------------------------------------
+
+    def next_message_id(self) -> int:
+        return next(self._message_ids)
+
+    async def push_update(self, update: Dict) -> Dict:
+        """Доставляет обновление боту: через webhook, если он задан, иначе в getUpdates"""
+        update = dict(update, update_id=next(self._update_ids))
+        if self.webhook_url:
+            headers = {}
+            if self.webhook_secret:
+                headers["X-Telegram-Bot-Api-Secret-Token"] = self.webhook_secret
+            # Как и Telegram, повторяем доставку, пока бот отвечает 503
+            while True:
+                async with self._client.post(self.webhook_url, json=update, headers=headers) as response:
+                    if response.status != 503:
+                        break
+                await asyncio.sleep(0.05)
+        else:
+            self.updates.append(update)
+            self._new_updates.set()
+        return update
+
+    @staticmethod
+    def user(user_id: int, first_name: str = None) -> Dict:
+        return {"id": user_id, "is_bot": False, "first_name": first_name or f"User{user_id}",
+                "username": f"user{user_id}"}
+
+    def message_update(self, user_id: int, text: str = None, **fields) -> Dict:
+        """Обновление с сообщением пользователя в личном чате"""
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+        }
+        if text is not None:
+            message["text"] = text
+            if text.startswith("/"):
+                command = text.split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        message.update(fields)
+        return {"message": message}
+
+    def callback_update(self, user_id: int, data: str, message: Dict = None) -> Dict:
+        """Обновление с нажатием inline-кнопки"""
+        if message is None:
+            message = {"message_id": self.next_message_id(), "date": int(time.time()),
+                       "chat": {"id": user_id, "type": "private"}, "from": BOT_USER, "text": "…"}
+        return {"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": message,
+        }}
+
+    def wait_for(self, predicate: Callable, timeout: float = 30):
+        """Ждёт вызова бота, для которого predicate(method, params, result) истинно;
+        возвращает (method, params, result).
+
+        Ожидание регистрируется сразу при вызове, а не при первом await:
+        ответ на обновление, отправленное после wait_for, не будет пропущен.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, future))
+        return self._wait(future, timeout)
+
+    async def _wait(self, future: asyncio.Future, timeout: float):
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters = [w for w in self._waiters if w[1] is not future]
+
+    # --- Методы Bot API -------------------------------------------------
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._read_params(request)
+        if method in self.delays:
+            await asyncio.sleep(self.delays[method])
+        handler = getattr(self, f"api_{method}", None)
+        try:
+            result = await handler(params) if handler else True
+        except ApiError as e:
+            return web.json_response({"ok": False, "error_code": e.code, "description": e.description},
+                                     status=e.code)
+        for listener in self.listeners:
+            listener(method, params, result)
+        # Одно сообщение (например, сводка запросов) может дождаться несколько ожидающих
+        for predicate, future in self._waiters:
+            if not future.done() and predicate(method, params, result):
+                future.set_result((method, params, result))
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    async def _read_params(request: web.Request) -> Dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def _message(self, params: Dict, **fields) -> Dict:
+        message = {
+            "message_id": self.next_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(fields)
+        self.sent.append({"time": time.perf_counter(), "chat_id": int(params["chat_id"]), "message": message,
+                          "params": params})
+        return message
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params.get("url") or None
+        self.webhook_secret = params.get("secret_token")
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def api_sendMessage(self, params):
+        fields = {"text": str(params.get("text", ""))}
+        if params.get("reply_markup"):
+            fields["reply_markup"] = params["reply_markup"]
+        return self._message(params, **fields)
+
+    async def api_editMessageText(self, params):
+        fields = {"text": str(params.get("text", "")), "edit_date": int(time.time())}
+        if params.get("reply_markup"):
+            fields["reply_markup"] = params["reply_markup"]
+        message = self._message(params, **fields)
+        message["message_id"] = int(params["message_id"])
+        return message
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+    async def api_getFile(self, params):
+        file_id = str(params.get("file_id"))
+        if file_id not in self.files:
+            raise ApiError(400, "Bad Request: invalid file_id")
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": len(self.files[file_id]),
+                "file_path": f"documents/{file_id}"}
+
+    async def _download(self, request: web.Request) -> web.StreamResponse:
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        if file_id not in self.files:
+            raise web.HTTPNotFound()
+        self.downloads += 1
+        data = self.files[file_id]
+        response = web.StreamResponse(headers={"Content-Length": str(len(data))})
+        await response.prepare(request)
+        for offset in range(0, len(data), 64 * 1024):
+            await response.write(data[offset:offset + 64 * 1024])
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _media_fields(media_type: str, file_id: str) -> Dict:
+        if media_type == "photo":
+            return {"photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 960}]}
+        if media_type == "video":
+            return {"video": {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720,
+                              "duration": 1}}
+        return {"document": {"file_id": file_id, "file_unique_id": file_id}}
+
+    async def _send_media(self, params, media_type):
+        fields = self._media_fields(media_type, str(params[media_type]))
+        if params.get("caption"):
+            fields["caption"] = params["caption"]
+        return self._message(params, **fields)
+
+    async def api_sendPhoto(self, params):
+        return await self._send_media(params, "photo")
+
+    async def api_sendVideo(self, params):
+        return await self._send_media(params, "video")
+
+    async def api_sendDocument(self, params):
+        return await self._send_media(params, "document")
+
+    async def api_sendMediaGroup(self, params):
+        group_id = str(self.next_message_id())
+        messages = []
+        for item in params["media"]:
+            fields = self._media_fields(item["type"], str(item["media"]))
+            if item.get("caption"):
+                fields["caption"] = item["caption"]
+            messages.append(self._message(params, media_group_id=group_id, **fields))
+        return messages
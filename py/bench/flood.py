@@ -0,0 +1,189 @@
+"""Проверка ограничения частоты входящих сообщений (flood.py).
+
+Бот запускается против локальной замены Bot API. У всех виртуальных
+пользователей уже идёт сессия со специалистом. Один пользователь без
+пауз отправляет --flood сообщений, остальные в это же время пишут по
+--messages сообщений с паузой --interval. Проверяется, что:
+- ни одно сообщение не потеряно: специалист получил, а история сохранила
+  все тексты в исходном порядке;
+- на сообщения флудера специалисту ушло не больше FLOOD_BURST + время ×
+  FLOOD_RATE пересылок (плюс части длинных пачек), а сам флудер получил
+  одно предупреждение;
+- остальные пользователи предупреждений не получили, печатается p99
+  задержки пересылки их сообщений.
+
+При нарушении скрипт завершается с кодом 1.
+Запуск: python -m bench.flood --flood 200 --users 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "123:flood")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from bench.loadtest import configure_limits, percentile
+
+FLOODER = 400_000
+
+def seed(user_ids, admin_id: int):
+    """Создаёт по принятому запросу и сессии на каждого пользователя"""
+    import db
+
+    for user_id in user_ids:
+        request_id = db.add_user_request(user_id, f"User{user_id}", f"user{user_id}", "Запрос")
+        db.start_request_processing(request_id)
+        db.create_session(request_id, user_id, admin_id)
+
+async def run(args) -> dict:
+    from bench.fake_bot_api import FakeBotAPI
+    from bot import build_application
+    from config import ADMIN_ID
+    from flood import NOTICE_TEXT
+
+    normal_ids = [FLOODER + 1 + i for i in range(args.users)]
+    seed([FLOODER] + normal_ids, ADMIN_ID)
+
+    api = FakeBotAPI()
+    await api.start()
+    application = build_application(token=os.environ["BOT_TOKEN"], base_url=api.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    expected = {FLOODER: [f"{FLOODER}:{i}" for i in range(args.flood)]}
+    for user_id in normal_ids:
+        expected[user_id] = [f"{user_id}:{i}" for i in range(args.messages)]
+    forwarded = defaultdict(list)
+    forwards = defaultdict(int)
+    notices = defaultdict(int)
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def listener(method, params, result):
+        chat_id = int(params.get("chat_id") or 0)
+        text = str(params.get("text", ""))
+        if method != "sendMessage":
+            return
+        if text == NOTICE_TEXT:
+            notices[chat_id] += 1
+        elif chat_id == ADMIN_ID and text.startswith("👤 User"):
+            name, body = text[len("👤 "):].split(":\n", 1)
+            user_id = int(name[len("User"):])
+            forwards[user_id] += 1
+            now = time.perf_counter()
+            for line in body.split("\n"):
+                forwarded[user_id].append(line)
+                if user_id != FLOODER and line in sent_at:
+                    latencies.append(now - sent_at.pop(line))
+            if all(len(forwarded[u]) >= len(texts) for u, texts in expected.items()):
+                done.set()
+
+    api.listeners.append(listener)
+
+    async def flooder():
+        for text in expected[FLOODER]:
+            await api.push_update(api.message_update(FLOODER, text))
+
+    async def normal(user_id: int):
+        for text in expected[user_id]:
+            sent_at[text] = time.perf_counter()
+            await api.push_update(api.message_update(user_id, text))
+            await asyncio.sleep(args.interval)
+
+    began = time.perf_counter()
+    await asyncio.gather(flooder(), *(normal(user_id) for user_id in normal_ids))
+    try:
+        await asyncio.wait_for(done.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - began
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+    return {
+        "expected": expected,
+        "forwarded": forwarded,
+        "forwards": forwards,
+        "notices": notices,
+        "latencies": latencies,
+        "elapsed": elapsed,
+    }
+
+def check(result: dict) -> list:
+    """Список нарушений: потерянные и переставленные сообщения, лишние пересылки"""
+    import db
+    from config import FLOOD_RATE, FLOOD_BURST, COALESCE_MAX_CHARS
+
+    problems = []
+    with db.get_db_connection() as conn:
+        stored = defaultdict(list)
+        for user_id, text in conn.execute(
+            """SELECT r.user_id, m.message_text FROM session_messages m
+               JOIN user_requests r ON r.request_id = m.request_id
+               WHERE m.sender_id = r.user_id AND m.message_text IS NOT NULL
+               ORDER BY m.message_id"""
+        ):
+            stored[user_id].extend(text.split("\n"))
+
+    for user_id, texts in result["expected"].items():
+        if result["forwarded"][user_id] != texts:
+            problems.append(f"user {user_id}: специалист получил {len(result['forwarded'][user_id])} "
+                            f"из {len(texts)} сообщений или не по порядку")
+        if stored[user_id] != texts:
+            problems.append(f"user {user_id}: в истории {len(stored[user_id])} из {len(texts)} "
+                            f"сообщений или не по порядку")
+        if user_id != FLOODER and result["notices"][user_id]:
+            problems.append(f"user {user_id}: получил предупреждение о флуде")
+
+    flood_chars = sum(len(text) + 1 for text in result["expected"][FLOODER])
+    allowed = FLOOD_BURST + FLOOD_RATE * result["elapsed"] + flood_chars // COALESCE_MAX_CHARS + 1
+    if result["forwards"][FLOODER] > allowed:
+        problems.append(f"флудер: {result['forwards'][FLOODER]} пересылок специалисту, "
+                        f"ожидалось не больше {allowed:.0f}")
+    if result["notices"][FLOODER] != 1:
+        problems.append(f"флудер: предупреждений {result['notices'][FLOODER]}, ожидалось 1")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--flood", type=int, default=200, help="сообщений от флудера")
+    parser.add_argument("--users", type=int, default=20, help="обычных пользователей")
+    parser.add_argument("--messages", type=int, default=5, help="сообщений на обычного пользователя")
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="пауза между сообщениями обычного пользователя, секунды")
+    parser.add_argument("--timeout", type=float, default=30, help="ожидание всех пересылок, секунды")
+    args = parser.parse_args()
+    configure_limits(real_limits=False)
+
+    import db
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "flood.db")
+        db.init_db()
+        result = asyncio.run(run(args))
+        problems = check(result)
+        db.close_db()
+
+    print(f"flooder: {args.flood} messages -> {result['forwards'][FLOODER]} forwards to the specialist, "
+          f"{result['notices'][FLOODER]} notice(s)")
+    print(f"{args.users} other users x {args.messages} messages: forward latency "
+          f"p50 {percentile(result['latencies'], 0.5) * 1000:.0f} ms, "
+          f"p99 {percentile(result['latencies'], 0.99) * 1000:.0f} ms")
+    for problem in problems[:20]:
+        print(problem)
+    if problems:
+        print(f"FAILED: {len(problems)} problems")
+        sys.exit(1)
+    print("OK: nothing lost, order preserved, flooder batched")
+
+if __name__ == '__main__':
+    main()
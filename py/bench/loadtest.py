@@ -0,0 +1,248 @@
+"""Сквозной нагрузочный тест бота.
+
+Бот запускается против локальной замены Bot API. Виртуальные
+пользователи проходят полный сценарий:
+- /start и кнопка «Связаться со специалистом»;
+- текст и альбом из фотографий, одна из которых прислана дважды —
+  специалист должен получить её один раз;
+- специалист принимает запрос;
+- обмен сообщениями в сессии, ответ специалиста через reply;
+- завершение сессии.
+
+В конце печатаются число обработанных обновлений в секунду, p50/p99
+времени обработки обновления и время работы с БД на одно обновление.
+Запуск: python -m bench.loadtest --users 1000 --rate 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "123:loadtest")
+os.environ.setdefault("ADMIN_ID", "1")
+
+# config.py здесь не импортируется: лимиты отправки задаются до его загрузки
+from callbacks import decode, encode
+
+def configure_limits(real_limits: bool):
+    # По умолчанию меряем сам бот, а не ограничения скорости Telegram
+    if not real_limits:
+        os.environ.setdefault("SEND_GLOBAL_RATE", "100000")
+        os.environ.setdefault("SEND_CHAT_RATE", "1000")
+        os.environ.setdefault("SEND_CHAT_BURST", "1000")
+        os.environ.setdefault("SEND_MAX_CONCURRENCY", "64")
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def update_kind(update) -> str:
+    if update.callback_query:
+        decoded = decode(update.callback_query.data)
+        return "callback:" + (decoded[0] if decoded else "unknown")
+    message = update.effective_message
+    if message is None:
+        return "other"
+    if message.text and message.text.startswith("/"):
+        return "command"
+    if message.photo or message.video or message.document:
+        return "media"
+    return "text"
+
+def find_button(markup: dict, action: str) -> str:
+    """callback_data кнопки с действием action из reply_markup сообщения"""
+    for row in markup["inline_keyboard"]:
+        for button in row:
+            decoded = decode(button.get("callback_data", ""))
+            if decoded and decoded[0] == action:
+                return button["callback_data"]
+    raise LookupError(f"В клавиатуре нет кнопки {action}")
+
+def find_accept_button(markup: dict, name: str) -> str:
+    """callback_data кнопки принятия запроса пользователя name из уведомления или сводки"""
+    buttons = [
+        button for row in markup["inline_keyboard"] for button in row
+        if (decode(button.get("callback_data", "")) or ("",))[0] in ("accept_request", "digest_accept")
+    ]
+    for button in buttons:
+        if name in button["text"]:
+            return button["callback_data"]
+    if len(buttons) == 1:
+        return buttons[0]["callback_data"]
+    raise LookupError(f"В клавиатуре нет кнопки принятия запроса {name}")
+
+class LoadTest:
+    def __init__(self, api, admin_id: int):
+        self.api = api
+        self.admin_id = admin_id
+        self.handler_times = defaultdict(list)
+        self.started = {}
+        self.completed = 0
+        self.failed = 0
+
+    def instrument(self, application):
+        """Добавляет замер времени обработки каждого обновления"""
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        async def begin(update, context):
+            self.started[update.update_id] = time.perf_counter()
+
+        async def end(update, context):
+            began = self.started.pop(update.update_id, None)
+            if began is not None:
+                self.handler_times[update_kind(update)].append(time.perf_counter() - began)
+
+        # Группы обрабатываются по порядку: -1 до основных обработчиков, 99 после
+        application.add_handler(TypeHandler(Update, begin), group=-1)
+        application.add_handler(TypeHandler(Update, end), group=99)
+
+    def _to_chat(self, chat_id: int, method=None, text: str = None):
+        methods = (method,) if isinstance(method, str) else method
+        def predicate(m, params, result):
+            if int(params.get("chat_id", 0)) != chat_id:
+                return False
+            if methods and m not in methods:
+                return False
+            return text is None or text in str(params.get("text", ""))
+        return predicate
+
+    async def user_flow(self, user_id: int):
+        api = self.api
+        name = f"User{user_id}"
+
+        waiting = api.wait_for(self._to_chat(user_id, "sendMessage"))
+        await api.push_update(api.message_update(user_id, "/start"))
+        _, _, menu = await waiting
+
+        # Уведомление приходит новым сообщением или обновлением сводки запросов
+        notification = api.wait_for(self._to_chat(self.admin_id, ("sendMessage", "editMessageText"), name))
+        await api.push_update(api.callback_update(user_id, encode("contact_specialist"), menu))
+        _, params, notice = await notification
+        accept = find_accept_button(params["reply_markup"], name)
+
+        await api.push_update(api.message_update(user_id, "Нужны шины 12.00R20, 8 штук"))
+        album = api.wait_for(lambda m, params, result: m == "sendMediaGroup" and f"p{user_id}_0" in str(params))
+        # Четвёртая фотография — повтор первой с другим file_id
+        for i in (0, 1, 2, 0):
+            await api.push_update(api.message_update(
+                user_id, media_group_id=f"album{user_id}", caption="Фото" if i == 0 else None,
+                photo=[{"file_id": f"p{user_id}_{i}_{api.next_message_id()}", "file_unique_id": f"u{user_id}_{i}",
+                        "width": 800, "height": 600, "file_size": 100_000}],
+            ))
+        _, params, _ = await album
+        if len(params["media"]) != 3:
+            raise AssertionError(f"В альбоме {len(params['media'])} фото вместо 3")
+
+        ready = api.wait_for(self._to_chat(user_id, "sendMessage", "Специалист готов"))
+        await api.push_update(api.callback_update(self.admin_id, accept, notice))
+        await ready
+
+        forwarded = api.wait_for(self._to_chat(self.admin_id, "sendMessage", f"{name}:\nЕсть в наличии?"))
+        await api.push_update(api.message_update(user_id, "Есть в наличии?"))
+        _, params, relayed = await forwarded
+        end_session = find_button(params["reply_markup"], "end_session")
+
+        answer = api.wait_for(self._to_chat(user_id, "sendMessage", "Да, на складе"))
+        await api.push_update(api.message_update(
+            self.admin_id, f"Да, на складе ({user_id})", reply_to_message=relayed
+        ))
+        await answer
+
+        closed = api.wait_for(self._to_chat(user_id, "sendMessage", "Сессия со специалистом завершена"))
+        await api.push_update(api.callback_update(self.admin_id, end_session, relayed))
+        await closed
+
+    async def run_user(self, user_id: int):
+        try:
+            await self.user_flow(user_id)
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            if self.failed <= 3:
+                print(f"flow {user_id} failed: {type(e).__name__}: {e}")
+
+async def run(args) -> dict:
+    import async_db
+    from bench.fake_bot_api import FakeBotAPI
+    from bot import build_application
+    from config import ADMIN_ID
+
+    api = FakeBotAPI()
+    await api.start()
+    application = build_application(token=os.environ["BOT_TOKEN"], base_url=api.base_url)
+    test = LoadTest(api, ADMIN_ID)
+    test.instrument(application)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    db_before = dict(async_db.db_stats)
+    began = time.perf_counter()
+    tasks = []
+    for i in range(args.users):
+        tasks.append(asyncio.create_task(test.run_user(100_000 + i)))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    all_times = [t for times in test.handler_times.values() for t in times]
+    processed = len(all_times)
+    db_seconds = async_db.db_stats['seconds'] - db_before['seconds']
+    db_calls = async_db.db_stats['calls'] - db_before['calls']
+    return {
+        "elapsed": elapsed,
+        "completed": test.completed,
+        "failed": test.failed,
+        "updates": processed,
+        "outbound": len(api.sent),
+        "handler_times": test.handler_times,
+        "all_times": all_times,
+        "db_ms_per_update": db_seconds / max(processed, 1) * 1000,
+        "db_calls_per_update": db_calls / max(processed, 1),
+    }
+
+def report(result: dict):
+    elapsed = result["elapsed"]
+    print(f"flows: {result['completed']} completed, {result['failed']} failed in {elapsed:.1f}s")
+    print(f"updates: {result['updates']} ({result['updates'] / elapsed:.1f}/s), "
+          f"outbound calls: {result['outbound']} ({result['outbound'] / elapsed:.1f}/s)")
+    print(f"db: {result['db_ms_per_update']:.3f} ms and {result['db_calls_per_update']:.2f} calls per update")
+    print(f"{'update':<28}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    rows = sorted(result["handler_times"].items()) + [("all", result["all_times"])]
+    for kind, times in rows:
+        print(f"{kind:<28}{len(times):>8}{statistics.mean(times) * 1000:>10.2f}"
+              f"{percentile(times, 0.5) * 1000:>10.2f}{percentile(times, 0.99) * 1000:>10.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=50, help="новых пользователей в секунду")
+    parser.add_argument("--real-limits", action="store_true",
+                        help="соблюдать ограничения скорости Telegram из config.py")
+    args = parser.parse_args()
+    configure_limits(args.real_limits)
+
+    import db
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "loadtest.db")
+        db.init_db()
+        result = asyncio.run(run(args))
+        db.close_db()
+    report(result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""Проверка локальной копии медиафайлов (media_mirror.py).
+
+Реестр media_files заполняется файлами локальной замены Bot API: --files
+файлов по --size байт, ещё --duplicates файлов с тем же содержимым под
+другими file_unique_id и один файл с недействительным file_id. Проверяется:
+- все файлы скачаны, содержимое на диске совпадает с sha256 в реестре,
+  одинаковое содержимое хранится один раз, недействительный файл отмечен
+  'failed';
+- пиковый объём памяти Python при скачивании (tracemalloc) меньше, чем
+  заняли бы одновременно скачиваемые файлы целиком (при --size от 1 МБ);
+- при уменьшении предела хранилища вдвое объём на диске не превышает
+  предел, а файлы, к которым недавно обращались через locate(), остались.
+
+Печатается скорость скачивания. При нарушении скрипт завершается с кодом 1.
+Запуск: python -m bench.media_mirror --files 40 --size 2000000
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("BOT_TOKEN", "123:mirror")
+os.environ.setdefault("ADMIN_ID", "1")
+
+def seed(api, args) -> dict:
+    """Добавляет файлы в замену Bot API и в реестр; возвращает file_unique_id -> ожидаемый sha256"""
+    import db
+
+    expected = {}
+    rows = []
+    for i in range(args.files):
+        file_id = f"file{i}"
+        api.files[file_id] = os.urandom(args.size)
+        expected[file_id] = hashlib.sha256(api.files[file_id]).hexdigest()
+        rows.append((file_id, file_id, args.size))
+    for i in range(args.duplicates):
+        file_id = f"copy{i}"
+        api.files[file_id] = api.files[f"file{i % args.files}"]
+        expected[file_id] = expected[f"file{i % args.files}"]
+        rows.append((file_id, file_id, args.size))
+    rows.append(("missing", "missing", None))
+    with db.get_db_connection() as conn:
+        for file_unique_id, file_id, size in rows:
+            conn.execute(
+                """INSERT INTO media_files (file_unique_id, media_type, file_id, file_size, received)
+                   VALUES (?, 'document', ?, ?, 1)""",
+                (file_unique_id, file_id, size)
+            )
+            # Разное время получения задаёт порядок скачивания
+            time.sleep(0.001)
+        conn.commit()
+    return expected
+
+def stored_files(root: str) -> dict:
+    """Файлы хранилища: имя -> размер (без временного каталога)"""
+    found = {}
+    for directory, _, names in os.walk(root):
+        if os.path.basename(directory) == "tmp":
+            continue
+        for name in names:
+            found[name] = os.path.getsize(os.path.join(directory, name))
+    return found
+
+async def run(args, root: str) -> dict:
+    import db
+    from telegram import Bot
+    from bench.fake_bot_api import FakeBotAPI
+    from media_mirror import MediaMirror
+
+    api = FakeBotAPI()
+    await api.start()
+    bot = Bot(os.environ["BOT_TOKEN"], base_url=api.base_url, base_file_url=api.base_file_url)
+    await bot.initialize()
+    expected = seed(api, args)
+    total_bytes = args.files * args.size
+    problems = []
+
+    # Этап 1: скачивание всего реестра
+    mirror = MediaMirror(root=root, max_bytes=total_bytes, concurrency=args.concurrency, max_attempts=2)
+    tracemalloc.start()
+    began = time.perf_counter()
+    stored = await mirror.run_once(bot)
+    elapsed = time.perf_counter() - began
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    with db.get_db_connection() as conn:
+        registry = {row['file_unique_id']: dict(row) for row in conn.execute("SELECT * FROM media_files")}
+    on_disk = stored_files(root)
+    for file_unique_id, sha256 in expected.items():
+        row = registry[file_unique_id]
+        if row['mirror_status'] != 'stored' or row['sha256'] != sha256:
+            problems.append(f"{file_unique_id}: {row['mirror_status']}, sha256 {row['sha256']}")
+        elif on_disk.get(sha256) != args.size:
+            problems.append(f"{file_unique_id}: в хранилище нет файла {sha256}")
+    for sha256 in on_disk:
+        digest = hashlib.sha256()
+        with open(mirror.blob_path(sha256), "rb") as stored_file:
+            while chunk := stored_file.read(1024 * 1024):
+                digest.update(chunk)
+        if digest.hexdigest() != sha256:
+            problems.append(f"{sha256}: содержимое не совпадает с именем")
+    if len(on_disk) != args.files:
+        problems.append(f"в хранилище {len(on_disk)} файлов, ожидалось {args.files}")
+    if registry["missing"]['mirror_status'] != 'failed':
+        problems.append(f"недействительный file_id: {registry['missing']['mirror_status']}")
+    if os.listdir(os.path.join(root, "tmp")):
+        problems.append("во временном каталоге остались файлы")
+    if peak >= args.concurrency * args.size:
+        problems.append(f"пик памяти {peak} байт: файлы читаются в память целиком")
+
+    # Этап 2: предел вдвое меньше; первые скачанные файлы недавно открывали
+    await asyncio.sleep(0.01)
+    kept = [f"file{i}" for i in range(args.files // 4)]
+    for file_unique_id in kept:
+        if await mirror.locate(file_unique_id) is None:
+            problems.append(f"{file_unique_id}: locate() не нашёл файл")
+    mirror.max_bytes = total_bytes // 2
+    await mirror.evict()
+    on_disk = stored_files(root)
+    if sum(on_disk.values()) > mirror.max_bytes:
+        problems.append(f"после вытеснения в хранилище {sum(on_disk.values())} байт, предел {mirror.max_bytes}")
+    if mirror.stored_bytes != sum(on_disk.values()):
+        problems.append(f"объём по реестру {mirror.stored_bytes}, на диске {sum(on_disk.values())}")
+    for file_unique_id in kept:
+        if expected[file_unique_id] not in on_disk:
+            problems.append(f"{file_unique_id}: вытеснен, хотя к нему недавно обращались")
+    with db.get_db_connection() as conn:
+        evicted = conn.execute("SELECT COUNT(*) FROM media_files WHERE mirror_status = 'evicted'").fetchone()[0]
+
+    await mirror.stop()
+    await bot.shutdown()
+    await api.stop()
+    return {
+        "problems": problems,
+        "stored": stored,
+        "downloads": api.downloads,
+        "elapsed": elapsed,
+        "peak": peak,
+        "total_bytes": total_bytes,
+        "evicted": evicted,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=40, help="файлов с разным содержимым")
+    parser.add_argument("--duplicates", type=int, default=10, help="файлов, повторяющих чужое содержимое")
+    parser.add_argument("--size", type=int, default=2_000_000, help="размер файла, байты; от 1 МБ, чтобы сетевые буферы не влияли на проверку памяти")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных скачиваний")
+    args = parser.parse_args()
+
+    import db
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "mirror.db")
+        db.init_db()
+        result = asyncio.run(run(args, os.path.join(tmp, "media")))
+        db.close_db()
+
+    print(f"{result['stored']} files ({result['downloads']} downloads) mirrored in {result['elapsed']:.2f}s, "
+          f"{result['total_bytes'] / result['elapsed'] / 1024 ** 2:.0f} MB/s, "
+          f"peak Python memory {result['peak'] / 1024:.0f} KB")
+    print(f"evicted at half the size limit: {result['evicted']} registry entries")
+    for problem in result["problems"][:20]:
+        print(problem)
+    if result["problems"]:
+        print(f"FAILED: {len(result['problems'])} problems")
+        sys.exit(1)
+    print("OK: content-addressed, deduplicated, streamed, evicted least recently used")
+
+if __name__ == '__main__':
+    main()
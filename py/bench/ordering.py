@@ -0,0 +1,199 @@
+"""Проверка порядка и отсутствия дублей при параллельной обработке обновлений.
+
+Бот запускается против локальной замены Bot API, и для каждого
+виртуального пользователя одновременно отправляются:
+- несколько нажатий «Связаться со специалистом» подряд — должен появиться
+  ровно один запрос, и специалист должен увидеть его ровно один раз
+  (отдельным уведомлением или строкой сводки);
+- после начала сессии — серия сообщений без ожидания ответов — специалист
+  должен получить их (по одному или объединёнными), а история сохранить
+  их в исходном порядке.
+
+Задержка ответов Bot API (--api-delay) показывает, как медленный вызов
+одного пользователя влияет на остальных при UPDATE_CONCURRENCY=1 и > 1.
+При нарушении порядка или дублях скрипт завершается с кодом 1.
+Запуск: python -m bench.ordering --users 50 --clicks 5 --messages 10
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+os.environ.setdefault("BOT_TOKEN", "123:ordering")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from bench.loadtest import configure_limits, find_accept_button
+
+USERNAME = re.compile(r"\(@user(\d+)\)")
+READY = "Специалист готов"
+
+async def settle(event: asyncio.Event, timeout: float = 30):
+    """Ждёт события; по таймауту продолжает, а нарушения покажет check()"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+async def run(args) -> dict:
+    from bench.fake_bot_api import FakeBotAPI
+    from bot import build_application
+    from config import ADMIN_ID, UPDATE_CONCURRENCY
+
+    api = FakeBotAPI()
+    api.delays = {"answerCallbackQuery": args.api_delay, "editMessageText": args.api_delay}
+    await api.start()
+    application = build_application(token=os.environ["BOT_TOKEN"], base_url=api.base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    user_ids = [200_000 + i for i in range(args.users)]
+    edits = defaultdict(int)
+    # Последнее состояние уведомлений в чате специалиста: message_id -> сообщение
+    notices = {}
+    ready = set()
+    forwarded = defaultdict(list)
+    forwarded_messages = 0
+    all_edited = asyncio.Event()
+    all_ready = asyncio.Event()
+    all_forwarded = asyncio.Event()
+
+    def listener(method, params, result):
+        nonlocal forwarded_messages
+        chat_id = int(params.get("chat_id") or 0)
+        text = str(params.get("text", ""))
+        if chat_id == ADMIN_ID and method in ("sendMessage", "editMessageText") and USERNAME.search(text):
+            notices[result["message_id"]] = result
+        elif method == "editMessageText":
+            edits[chat_id] += 1
+            if all(edits[u] >= args.clicks for u in user_ids):
+                all_edited.set()
+        elif method == "sendMessage" and READY in text:
+            ready.add(chat_id)
+            if ready.issuperset(user_ids):
+                all_ready.set()
+        elif method == "sendMessage" and chat_id == ADMIN_ID and text.startswith("👤 User"):
+            name, body = text[len("👤 "):].split(":\n", 1)
+            forwarded[int(name[len("User"):])].extend(body.split("\n"))
+            forwarded_messages += 1
+            if all(len(forwarded[u]) >= args.messages for u in user_ids):
+                all_forwarded.set()
+
+    api.listeners.append(listener)
+
+    # Этап 1: повторные нажатия одной кнопки
+    began = time.perf_counter()
+    for user_id in user_ids:
+        for _ in range(args.clicks):
+            await api.push_update(api.callback_update(user_id, "1|cs"))
+    await settle(all_edited)
+    clicks_elapsed = time.perf_counter() - began
+    # Даём дойти уведомлениям и обновлениям сводки
+    await asyncio.sleep(args.settle)
+    admin_messages = len(notices)
+    mentions = defaultdict(list)
+    for message in notices.values():
+        for user_id in USERNAME.findall(message["text"]):
+            mentions[int(user_id)].append(message)
+
+    # Этап 2: специалист принимает каждый запрос
+    for user_id in user_ids:
+        if mentions[user_id]:
+            message = mentions[user_id][0]
+            accept = find_accept_button(message["reply_markup"], f"User{user_id}")
+            await api.push_update(api.callback_update(ADMIN_ID, accept, message))
+    await settle(all_ready)
+
+    # Этап 3: серии сообщений без ожидания ответа
+    began = time.perf_counter()
+    for i in range(args.messages):
+        for user_id in user_ids:
+            await api.push_update(api.message_update(user_id, f"{user_id}:{i}"))
+    await settle(all_forwarded)
+    messages_elapsed = time.perf_counter() - began
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+    return {
+        "concurrency": UPDATE_CONCURRENCY,
+        "user_ids": user_ids,
+        "mentions": mentions,
+        "admin_messages": admin_messages,
+        "forwarded_messages": forwarded_messages,
+        "forwarded": forwarded,
+        "clicks_elapsed": clicks_elapsed,
+        "messages_elapsed": messages_elapsed,
+    }
+
+def check(result: dict, args) -> list:
+    """Список нарушений: дубли запросов и уведомлений, перестановки сообщений"""
+    import db
+
+    problems = []
+    with db.get_db_connection() as conn:
+        requests = dict(conn.execute(
+            "SELECT user_id, COUNT(*) FROM user_requests GROUP BY user_id"
+        ).fetchall())
+        stored = defaultdict(list)
+        for user_id, text in conn.execute(
+            """SELECT r.user_id, m.message_text FROM session_messages m
+               JOIN user_requests r ON r.request_id = m.request_id
+               WHERE m.sender_id = r.user_id AND m.message_text IS NOT NULL
+               ORDER BY m.message_id"""
+        ):
+            stored[user_id].extend(text.split("\n"))
+
+    for user_id in result["user_ids"]:
+        expected = [f"{user_id}:{i}" for i in range(args.messages)]
+        if requests.get(user_id) != 1:
+            problems.append(f"user {user_id}: запросов {requests.get(user_id, 0)}")
+        if len(result["mentions"][user_id]) != 1:
+            problems.append(f"user {user_id}: упоминаний в уведомлениях {len(result['mentions'][user_id])}")
+        if result["forwarded"][user_id] != expected:
+            problems.append(f"user {user_id}: специалист получил {result['forwarded'][user_id]}")
+        if stored[user_id] != expected:
+            problems.append(f"user {user_id}: в истории {stored[user_id]}")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--clicks", type=int, default=5, help="нажатий кнопки на пользователя")
+    parser.add_argument("--messages", type=int, default=10, help="сообщений на пользователя")
+    parser.add_argument("--api-delay", type=float, default=0.02,
+                        help="задержка ответа на answerCallbackQuery и editMessageText, секунды")
+    parser.add_argument("--settle", type=float, default=4.0,
+                        help="пауза после нажатий, чтобы сводка запросов успела обновиться, секунды")
+    args = parser.parse_args()
+    configure_limits(real_limits=False)
+
+    import db
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "ordering.db")
+        db.init_db()
+        result = asyncio.run(run(args))
+        problems = check(result, args)
+        db.close_db()
+
+    print(f"notification messages to the specialist: {result['admin_messages']}, "
+          f"forwarded messages: {result['forwarded_messages']}")
+    print(f"UPDATE_CONCURRENCY={result['concurrency']}: "
+          f"{args.users} users x {args.clicks} clicks in {result['clicks_elapsed']:.2f}s, "
+          f"{args.users} users x {args.messages} messages in {result['messages_elapsed']:.2f}s")
+    for problem in problems[:20]:
+        print(problem)
+    if problems:
+        print(f"FAILED: {len(problems)} problems")
+        sys.exit(1)
+    print("OK: no duplicates, order preserved")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Микробенчмарк разбора нажатий inline-кнопок.
+
+Меряет стоимость одного callback без сети и БД:
+- разбор callback_data (новый формат и старый "accept_request_42");
+- полный проход CallbackRouter.dispatch до обработчика-заглушки;
+- для сравнения — цепочку if/elif по префиксам, как было в button_handler;
+- сборку клавиатур: заново, из кэша и готовую.
+Запуск: python -m bench.router --iterations 200000
+"""
+import argparse
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+
+import keyboards
+from callbacks import CALLBACK_ACTIONS, CallbackRouter, decode, encode
+
+SAMPLE_ARGS = {int: 4242, str: "2026-10-17 12:00:00", float: -1.6541353383458646e-06}
+
+def sample_data():
+    """По одной кнопке каждого действия в новом и старом формате"""
+    new, legacy = [], []
+    for action in CALLBACK_ACTIONS:
+        args = [SAMPLE_ARGS[kind] for kind in action.args]
+        new.append(encode(action.name, *args))
+        legacy.append("_".join([action.name] + [str(arg) for arg in args]))
+    return new, legacy
+
+def legacy_chain(data: str):
+    """Разбор в стиле прежнего button_handler: цепочка сравнений и split"""
+    if data == 'contact_specialist':
+        return 'contact_specialist', ()
+    elif data.startswith('accept_request_'):
+        return 'accept_request', (int(data.split('_')[2]),)
+    elif data.startswith('select_session_'):
+        return 'select_session', (int(data.split('_')[2]),)
+    elif data.startswith('reject_request_'):
+        return 'reject_request', (int(data.split('_')[2]),)
+    elif data == 'show_all_requests':
+        return 'show_all_requests', ()
+    elif data.startswith('requests_after_'):
+        created_at, request_id = data[len('requests_after_'):].rsplit('_', 1)
+        return 'requests_after', (created_at, int(request_id))
+    elif data.startswith('requests_before_'):
+        created_at, request_id = data[len('requests_before_'):].rsplit('_', 1)
+        return 'requests_before', (created_at, int(request_id))
+    elif data.startswith('search_page_'):
+        return 'search_page', (int(data.split('_')[2]),)
+    elif data == 'admin_menu':
+        return 'admin_menu', ()
+    elif data == 'end_all_sessions':
+        return 'end_all_sessions', ()
+    elif data == 'clear_all_requests':
+        return 'clear_all_requests', ()
+    elif data.startswith('end_session_'):
+        return 'end_session', (int(data.split('_')[2]),)
+    return None
+
+def measure(func, items, iterations: int) -> float:
+    """Среднее время одного вызова func(item) в микросекундах"""
+    count = len(items)
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(items[i % count])
+    return (time.perf_counter() - started) / iterations * 1e6
+
+async def measure_dispatch(data: list, iterations: int) -> float:
+    router = CallbackRouter()
+
+    async def noop(update, context, *args):
+        pass
+
+    for action in CALLBACK_ACTIONS:
+        router.action(action.name, access=lambda user_id: True)(noop)
+
+    async def answer(*args, **kwargs):
+        pass
+
+    updates = [
+        SimpleNamespace(callback_query=SimpleNamespace(data=item, from_user=SimpleNamespace(id=1), answer=answer))
+        for item in data
+    ]
+    count = len(updates)
+    started = time.perf_counter()
+    for i in range(iterations):
+        await router.dispatch(updates[i % count], None)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    new, legacy = sample_data()
+    # Оба формата разбираются одинаково и так же, как прежний button_handler
+    # (действий, появившихся позже, в нём нет)
+    for new_data, legacy_data in zip(new, legacy):
+        assert decode(new_data) == decode(legacy_data), legacy_data
+        assert legacy_chain(legacy_data) in (None, decode(legacy_data)), legacy_data
+
+    rows = [
+        ("if/elif chain (old)", measure(legacy_chain, legacy, n)),
+        ("decode, new format, uncached", measure(decode.__wrapped__, new, n)),
+        ("decode, old format, uncached", measure(decode.__wrapped__, legacy, n)),
+        ("decode, cached", measure(decode, new, n)),
+        ("router.dispatch", asyncio.run(measure_dispatch(new, n))),
+        ("request keyboard, built", measure(keyboards.get_admin_request_keyboard.__wrapped__, [42], n // 10)),
+        ("request keyboard, cached", measure(keyboards.get_admin_request_keyboard, [42], n)),
+        ("admin keyboard, prebuilt", measure(lambda _: keyboards.get_admin_main_keyboard(), [None], n)),
+    ]
+    print(f"{'operation':<32}{'us/call':>10}")
+    for name, cost in rows:
+        print(f"{name:<32}{cost:>10.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Пропускная способность бота в зависимости от числа процессов-обработчиков.
+
+Для каждого значения --workers бот запускается через shards.run_sharded
+против локальной замены Bot API, и виртуальные пользователи проходят тот
+же сценарий, что и в bench.loadtest. Печатается число завершённых
+сценариев и обработанных обновлений в секунду. Прирост заметен только на
+машине с несколькими ядрами; все действия специалиста (один user_id)
+обрабатывает один процесс, и при большом числе обработчиков он становится
+узким местом.
+Запуск: python -m bench.shards --users 300 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123:shards")
+os.environ.setdefault("ADMIN_ID", "1")
+
+from bench.loadtest import LoadTest, configure_limits
+
+async def wait_ready(api, workers: int):
+    """Ждёт, пока каждый обработчик ответит на /start своего пользователя"""
+    for user_id in range(10, 10 + workers):
+        waiting = api.wait_for(lambda m, params, result, chat=user_id: int(params.get("chat_id", 0)) == chat,
+                               timeout=120)
+        await api.push_update(api.message_update(user_id, "/start"))
+        await waiting
+
+async def run(workers: int, users: int, rate: float) -> dict:
+    from bench.fake_bot_api import FakeBotAPI
+    from config import ADMIN_ID
+    from shards import run_sharded
+
+    api = FakeBotAPI()
+    await api.start()
+    stop_event = asyncio.Event()
+    bot = asyncio.create_task(run_sharded(
+        workers, token=os.environ["BOT_TOKEN"], base_url=api.base_url, stop_event=stop_event
+    ))
+    await wait_ready(api, workers)
+
+    test = LoadTest(api, ADMIN_ID)
+    sent_before = len(api.sent)
+    began = time.perf_counter()
+    tasks = []
+    for i in range(users):
+        tasks.append(asyncio.create_task(test.run_user(100_000 + i)))
+        if rate:
+            await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    stop_event.set()
+    await bot
+    await api.stop()
+    return {
+        "workers": workers,
+        "elapsed": elapsed,
+        "completed": test.completed,
+        "failed": test.failed,
+        "outbound": len(api.sent) - sent_before,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=0, help="новых пользователей в секунду; 0 — все сразу")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    configure_limits(real_limits=False)
+
+    import db
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Обработчики открывают ту же базу по пути из окружения
+            db.DB_FILE = os.environ["DB_FILE"] = os.path.join(tmp, "shards.db")
+            db.init_db()
+            db.close_db()
+            results.append(asyncio.run(run(workers, args.users, args.rate)))
+
+    print(f"{'workers':>8}{'flows':>8}{'failed':>8}{'seconds':>10}{'flows/s':>10}{'calls/s':>10}")
+    for result in results:
+        elapsed = result["elapsed"]
+        print(f"{result['workers']:>8}{result['completed']:>8}{result['failed']:>8}{elapsed:>10.2f}"
+              f"{result['completed'] / elapsed:>10.1f}{result['outbound'] / elapsed:>10.1f}")
+
+if __name__ == '__main__':
+    main()
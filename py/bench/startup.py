@@ -0,0 +1,131 @@
+"""Время запуска бота до готовности.
+
+Бот запускается отдельным процессом (python bot.py) против локальной
+замены Bot API с включённым сервером метрик. Скрипт опрашивает /ready,
+пока тот не ответит 200, сразу отправляет боту /start и ждёт ответа —
+готовый бот должен уже принимать обновления. Печатаются время до ответа
+/ready, длительность этапов запуска из bot_startup_phase_seconds и время
+ответа на первое обновление.
+
+Сценарии: новая база (применяются все миграции) и уже созданная база с
+--requests ожидающими запросами и активными сессиями. Если бот не стал
+готов или не ответил на первое обновление, скрипт завершается с кодом 1.
+Запуск: python -m bench.startup --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123:startup")
+os.environ.setdefault("ADMIN_ID", "1")
+
+import aiohttp
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASE = re.compile(r'^bot_startup_phase_seconds\{phase="([^"]+)"\} (\S+)$', re.MULTILINE)
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def seed(db_file: str, requests: int):
+    """Заполняет базу ожидающими запросами и сессиями (каждый десятый запрос принят)"""
+    import db
+
+    db.DB_FILE = db_file
+    db.init_db()
+    for i in range(requests):
+        user_id = 300_000 + i
+        request_id = db.add_user_request(user_id, f"User{user_id}", None, "Запрос")
+        db.add_message_to_request(request_id, user_id, message_text="Нужны шины")
+        if i % 10 == 0:
+            db.start_request_processing(request_id)
+            db.create_session(request_id, user_id, int(os.environ["ADMIN_ID"]))
+    db.close_db()
+
+async def run(db_file: str, timeout: float) -> dict:
+    from bench.fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    await api.start()
+    port = free_port()
+    env = dict(os.environ, BOT_API_URL=api.base_url, METRICS_PORT=str(port), DB_FILE=db_file, BOT_WORKERS="1")
+
+    began = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "bot.py", cwd=BOT_DIR, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    result = {"listening": None, "ready": None, "first_reply": None, "phases": {}}
+    try:
+        async with aiohttp.ClientSession() as client:
+            while time.perf_counter() - began < timeout and process.returncode is None:
+                try:
+                    async with client.get(f"http://127.0.0.1:{port}/ready") as response:
+                        if result["listening"] is None:
+                            result["listening"] = time.perf_counter() - began
+                        if response.status == 200:
+                            result["ready"] = time.perf_counter() - began
+                            break
+                except aiohttp.ClientConnectionError:
+                    pass
+                await asyncio.sleep(0.01)
+            if result["ready"] is None:
+                return result
+
+            # Готовый бот отвечает на первое же обновление
+            sent = time.perf_counter()
+            reply = api.wait_for(lambda m, params, r: int(params.get("chat_id", 0)) == 10, timeout=timeout)
+            await api.push_update(api.message_update(10, "/start"))
+            await reply
+            result["first_reply"] = time.perf_counter() - sent
+
+            async with client.get(f"http://127.0.0.1:{port}/metrics") as response:
+                text = await response.text()
+            result["phases"] = {phase: float(seconds) for phase, seconds in PHASE.findall(text)}
+        return result
+    finally:
+        if process.returncode is None:
+            process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(process.wait(), 30)
+            except asyncio.TimeoutError:
+                process.kill()
+        await api.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="запросов в уже созданной базе")
+    parser.add_argument("--timeout", type=float, default=60, help="ожидание готовности, секунды")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        fresh = os.path.join(tmp, "fresh.db")
+        results.append(("new database", asyncio.run(run(fresh, args.timeout))))
+        existing = os.path.join(tmp, "existing.db")
+        seed(existing, args.requests)
+        results.append((f"{args.requests} requests", asyncio.run(run(existing, args.timeout))))
+
+    failed = False
+    for name, result in results:
+        if result["ready"] is None:
+            print(f"{name}: not ready within {args.timeout:.0f}s")
+            failed = True
+            continue
+        print(f"{name}: /ready after {result['ready']:.3f}s (listening after {result['listening']:.3f}s), "
+              f"first update answered in {result['first_reply'] * 1000:.1f} ms")
+        for phase, seconds in result["phases"].items():
+            print(f"    {phase:<20}{seconds:>8.3f}s")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
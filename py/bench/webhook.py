@@ -0,0 +1,111 @@
+"""Сравнение задержки обработки обновлений в режимах polling и webhook.
+
+Бот запускается против локальной замены Bot API. Для каждого обновления
+/start измеряется время от его появления в «Telegram» до получения
+ответа бота. Запуск: python -m bench.webhook --updates 500 --rate 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123:bench")
+os.environ.setdefault("ADMIN_ID", "1")
+# Бенчмарк меряет транспорт, а не лимиты Telegram
+os.environ.setdefault("SEND_GLOBAL_RATE", "100000")
+os.environ.setdefault("SEND_CHAT_BURST", "100")
+os.environ.setdefault("SEND_MAX_CONCURRENCY", "64")
+
+import db
+from bench.fake_bot_api import FakeBotAPI
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+async def run_mode(mode: str, updates: int, rate: float) -> dict:
+    from bot import build_application
+    from webhook import WebhookServer
+
+    api = FakeBotAPI()
+    await api.start()
+    application = build_application(token=os.environ["BOT_TOKEN"], base_url=api.base_url)
+
+    # Ответ бота на /start уходит в чат пользователя: ждём его по chat_id
+    waiting = {}
+    def on_send(method, params, result):
+        future = waiting.pop(int(params.get("chat_id", 0)), None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+    api.listeners.append(on_send)
+
+    await application.initialize()
+    await application.post_init(application)
+    server = None
+    if mode == "webhook":
+        server = WebhookServer(application, listen="127.0.0.1", port=0, path="/telegram")
+        await server.start()
+        await application.bot.set_webhook(
+            url=f"http://127.0.0.1:{server.port}/telegram", secret_token=server.secret
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+
+    latencies = []
+
+    async def one(user_id: int):
+        future = asyncio.get_running_loop().create_future()
+        waiting[user_id] = future
+        started = time.perf_counter()
+        await api.push_update(api.message_update(user_id, "/start"))
+        latencies.append(await asyncio.wait_for(future, 30) - started)
+
+    began = time.perf_counter()
+    tasks = []
+    for i in range(updates):
+        tasks.append(asyncio.create_task(one(10_000 + i)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+
+    if server is not None:
+        await server.stop()
+    else:
+        await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    return {
+        "mode": mode,
+        "updates": updates,
+        "throughput": updates / elapsed,
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50, help="обновлений в секунду")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "bench.db")
+        db.init_db()
+        results = []
+        for mode in ("polling", "webhook"):
+            results.append(await run_mode(mode, args.updates, args.rate))
+        db.close_db()
+
+    print(f"{'mode':<10}{'upd/s':>10}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['throughput']:>10.1f}{r['mean_ms']:>10.2f}{r['p50_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+"""Проверка буфера отложенной записи сообщений (async_db.MessageWriteBuffer).
+
+Первая запись пачки сообщений (db.add_messages) завершается ошибкой.
+Проверяется, что:
+- end_session, который сохраняет буфер перед своей работой, всё равно
+  завершает сессию — ошибка чужой записи до него не доходит;
+- сообщения не потеряны: таймер повтора записывает их в базу;
+- close_db, наоборот, сообщает об ошибке, если записать буфер не удалось.
+
+При нарушении скрипт завершается с кодом 1.
+Запуск: python -m bench.write_buffer
+"""
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("BOT_TOKEN", "123:buffer")
+os.environ.setdefault("ADMIN_ID", "1")
+
+RETRY_SECONDS = 0.2
+
+def failing(func, failures: int):
+    """Обёртка над функцией db.py, первые failures вызовов которой падают"""
+    calls = {"count": 0}
+
+    def wrapper(*args, **kwargs):
+        calls["count"] += 1
+        if calls["count"] <= failures:
+            raise RuntimeError("database is locked")
+        return func(*args, **kwargs)
+    return wrapper, calls
+
+async def run() -> list:
+    import db
+    import async_db
+
+    problems = []
+    request_id = db.add_user_request(1, "User1", "user1", "Запрос")
+    db.start_request_processing(request_id)
+    session_id = db.create_session(request_id, 1, 1)
+
+    add_messages = db.add_messages
+    db.add_messages, calls = failing(add_messages, failures=1)
+    buffer = async_db.message_buffer
+    buffer.retry_interval = RETRY_SECONDS
+    for i in range(3):
+        buffer.add(session_id, request_id, 1, message_text=f"текст {i}")
+
+    try:
+        await async_db.end_session(session_id)
+    except Exception as e:
+        problems.append(f"end_session упал из-за записи буфера: {e}")
+    if db.get_session_info(session_id) is not None:
+        problems.append("сессия не завершена")
+    if calls["count"] != 1:
+        problems.append(f"попыток записи до повтора: {calls['count']}, ожидалась 1")
+
+    await asyncio.sleep(RETRY_SECONDS * 3)
+    stored = [row['message_text'] for row in db.get_messages_for_request(request_id)]
+    if stored != [f"текст {i}" for i in range(3)]:
+        problems.append(f"после повтора в базе {stored}")
+
+    # При закрытии базы ошибка записи не должна теряться молча
+    db.add_messages, _ = failing(add_messages, failures=10)
+    buffer.add(session_id, request_id, 1, message_text="последний")
+    try:
+        await async_db.close_db()
+        problems.append("close_db не сообщил об ошибке записи")
+    except RuntimeError:
+        pass
+    db.add_messages = add_messages
+    await async_db.close_db()
+    return problems
+
+def main():
+    import db
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "buffer.db")
+        db.init_db()
+        problems = asyncio.run(run())
+        db.close_db()
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        print(f"FAILED: {len(problems)} problems")
+        sys.exit(1)
+    print("OK: failed flush retried, callers unaffected")
+
+if __name__ == '__main__':
+    main()
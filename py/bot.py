@@ -1,4 +1,7 @@
+import asyncio
 import logging
+# Первым импортом: отсчёт этапов запуска начинается с загрузки startup
+from startup import startup
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -6,16 +9,31 @@ from telegram.ext import (
     MessageHandler,
     filters
 )
-from db import init_db
-from config import TOKEN, ADMIN_ID
+from db import init_db, assign_orphan_sessions
+from async_db import close_db, warm_state_cache, ping
+from state_cache import user_state
+from sender import outbound
+from retention import retention
+from media_mirror import media_mirror
+from metrics import MetricsServer, instrument_application
+from config import (
+    TOKEN, ADMIN_ID, SPECIALIST_IDS, BOT_MODE, BOT_API_URL, BOT_FILE_URL, UPDATE_QUEUE_SIZE,
+    METRICS_HOST, METRICS_PORT, BOT_WORKERS, SHARD_INDEX, UPDATE_CONCURRENCY
+)
+from concurrency import update_processor
 from handlers import (
+    recover_media_groups,
+    text_bundles,
+    flood_control,
     start,
-    button_handler,
+    router,
     handle_user_message,
     handle_admin_message,
-    check_media_groups,
     admin_panel,
-    end_session_handler
+    search_command,
+    export_command,
+    media_stats_command,
+    stats_command
 )
 from keyboards import get_admin_main_keyboard
 
@@ -25,24 +43,78 @@ logging.basicConfig(
     level=logging.INFO
 )
 logger = logging.getLogger(__name__)
+startup.mark("imports")
 
-def main():
-    # Инициализация БД
-    init_db()
-    
-    # Создание приложения
-    application = Application.builder().token(TOKEN).build()
+# У каждого процесса-обработчика свой порт метрик: METRICS_PORT + номер процесса
+metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT + SHARD_INDEX if METRICS_PORT else 0,
+                               failing=startup.failing)
+
+async def on_startup(application: Application):
+    """Прогревает кэш состояния пользователей и запускает фоновые задачи"""
+    startup.mark("initialize")
+    startup.add_check("database", ping)
+    # Приложение запускается последним, когда приём обновлений уже работает
+    startup.add_check("updates", lambda: application.running)
+    outbound.start(application.bot)
+    # Кэш состояния и журнал медиа-групп загружаются в потоке БД, пока
+    # в цикле событий импортируется aiohttp и поднимается сервер метрик
+    warm_up = [warm_state_cache(), recover_media_groups()]
+    if METRICS_PORT:
+        warm_up.append(metrics_server.start())
+    else:
+        logger.info("METRICS_PORT не задан: /metrics и проверка готовности /ready выключены")
+    await asyncio.gather(*warm_up)
+    startup.mark("warm_up")
+    # Архивация и копирование медиа общие для всей базы, поэтому работают в одном процессе
+    if SHARD_INDEX == 0:
+        retention.start()
+        media_mirror.start(application.bot)
+    startup.watch()
+
+async def on_shutdown(application: Application):
+    """Закрывает соединение с БД при остановке бота"""
+    await retention.stop()
+    await media_mirror.stop()
+    # Задержанные и накопленные тексты отправляются до остановки очереди исходящих
+    await flood_control.flush_all()
+    text_bundles.flush_all()
+    await outbound.stop()
+    await metrics_server.stop()
+    logger.info(f"Кэш состояния: {user_state.stats()}")
+    logger.info(f"Исходящие сообщения: {outbound.stats()}")
+    await close_db()
+
+def build_application(token: str = TOKEN, base_url: str = BOT_API_URL,
+                      base_file_url: str = BOT_FILE_URL) -> Application:
+    """Создаёт приложение и регистрирует обработчики"""
+    # Ограниченная очередь: при всплеске webhook отвечает 503, а polling ждёт
+    builder = (
+        Application.builder()
+        .token(token)
+        .base_url(base_url)
+        .base_file_url(base_file_url)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    # Разные пользователи обрабатываются параллельно, один пользователь — по порядку
+    if UPDATE_CONCURRENCY > 1:
+        builder.concurrent_updates(update_processor)
+    application = builder.build()
     
     # Основные команды
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("mediastats", media_stats_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     
-    # Обработчики callback-кнопок
-    application.add_handler(CallbackQueryHandler(button_handler, pattern="^(?!end_session_).*"))
-    application.add_handler(CallbackQueryHandler(end_session_handler, pattern="^end_session_"))
+    # Все inline-кнопки разбирает маршрутизатор из handlers.py
+    application.add_handler(CallbackQueryHandler(router.dispatch))
     
-    # Обработчики сообщений для администратора
-    admin_filters = filters.User(ADMIN_ID)
+    # Обработчики сообщений для специалистов
+    admin_filters = filters.User(SPECIALIST_IDS)
     admin_message_filters = (
         filters.TEXT | 
         filters.PHOTO | 
@@ -53,7 +125,7 @@ def main():
     application.add_handler(MessageHandler(admin_message_filters, handle_admin_message))
     
     # Обработчики сообщений для пользователей
-    user_filters = ~filters.User(ADMIN_ID)
+    user_filters = ~filters.User(SPECIALIST_IDS)
     user_message_filters = (
         filters.TEXT | 
         filters.PHOTO | 
@@ -63,11 +135,33 @@ def main():
     
     application.add_handler(MessageHandler(user_message_filters, handle_user_message))
     
-    # Периодическая проверка медиа-групп
-    application.job_queue.run_repeating(check_media_groups, interval=1.0)
+    # Замер времени и ошибок всех обработчиков
+    instrument_application(application)
+    
+    return application
+
+def main():
+    # Инициализация БД: при актуальной схеме только читается её версия
+    if init_db():
+        logger.info("Схема базы данных обновлена")
+    if orphans := assign_orphan_sessions(ADMIN_ID):
+        logger.info(f"Сессиям без специалиста назначен {ADMIN_ID}: {orphans}")
+    startup.mark("init_db")
+    
+    if BOT_WORKERS > 1:
+        from shards import run_sharded
+        asyncio.run(run_sharded(BOT_WORKERS, mode=BOT_MODE))
+        return
+    
+    application = build_application()
+    startup.mark("build_application")
     
     # Запуск бота
-    application.run_polling()
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
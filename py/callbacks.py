@@ -0,0 +1,142 @@
+"""Маршрутизация нажатий inline-кнопок.
+
+callback_data кодируется как "<версия>|<код действия>|<аргумент>|...",
+например "1|ar|42" — принять запрос 42. Типы аргументов каждого действия
+описаны в CALLBACK_ACTIONS; строки старого формата ("accept_request_42")
+с уже отправленных кнопок по-прежнему разбираются.
+
+CallbackRouter по действию за O(1) находит обработчик, проверяет права
+пользователя и отвечает на callback-запрос до вызова обработчика.
+"""
+import functools
+import logging
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from metrics import instrument
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_VERSION = "1"
+SEPARATOR = "|"
+# Ограничение Bot API на длину callback_data в байтах
+MAX_CALLBACK_DATA = 64
+
+class CallbackAction(NamedTuple):
+    name: str
+    code: str
+    args: Tuple[type, ...]
+
+CALLBACK_ACTIONS = [
+    CallbackAction("contact_specialist", "cs", ()),
+    CallbackAction("accept_request", "ar", (int,)),
+    CallbackAction("reject_request", "rr", (int,)),
+    # Те же действия из сводки новых запросов: сообщение не заменяется, а обновляется
+    CallbackAction("digest_accept", "da", (int,)),
+    CallbackAction("digest_reject", "dr", (int,)),
+    CallbackAction("select_session", "ss", (int,)),
+    CallbackAction("end_session", "es", (int,)),
+    CallbackAction("show_all_requests", "lr", ()),
+    # Ключ (created_at, request_id) крайней строки страницы ожидающих запросов
+    CallbackAction("requests_after", "ra", (str, int)),
+    CallbackAction("requests_before", "rb", (str, int)),
+    # Номер страницы и ключ (rank, message_id) крайней строки страницы /search
+    CallbackAction("search_after", "sa", (int, float, int)),
+    CallbackAction("search_before", "sb", (int, float, int)),
+    # Кнопки листания /search по номеру страницы (прежний формат) открывают первую страницу
+    CallbackAction("search_page", "sp", (int,)),
+    CallbackAction("admin_menu", "am", ()),
+    CallbackAction("end_all_sessions", "ea", ()),
+    CallbackAction("clear_all_requests", "ca", ()),
+]
+
+_by_name: Dict[str, CallbackAction] = {action.name: action for action in CALLBACK_ACTIONS}
+_by_code: Dict[str, CallbackAction] = {action.code: action for action in CALLBACK_ACTIONS}
+
+def encode(name: str, *args) -> str:
+    """Собирает callback_data для действия name"""
+    action = _by_name[name]
+    if len(args) != len(action.args):
+        raise ValueError(f"Действию {name} нужно аргументов: {len(action.args)}")
+    data = SEPARATOR.join((CALLBACK_VERSION, action.code) + tuple(str(arg) for arg in args))
+    if len(data.encode("utf-8")) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {data}")
+    return data
+
+def _convert(action: CallbackAction, raw: list) -> Optional[Tuple[str, tuple]]:
+    if len(raw) != len(action.args):
+        return None
+    try:
+        return action.name, tuple(kind(value) for kind, value in zip(action.args, raw))
+    except ValueError:
+        return None
+
+def _decode_legacy(data: str) -> Optional[Tuple[str, tuple]]:
+    """Разбирает callback_data старого формата: "<действие>" или "<действие>_<аргументы>".
+
+    У всех действий с аргументами имя из двух слов, поэтому имя отделяется
+    по второму подчёркиванию, а аргументы — с конца строки.
+    """
+    action = _by_name.get(data)
+    if action is not None:
+        return _convert(action, [])
+    parts = data.split("_", 2)
+    if len(parts) < 3:
+        return None
+    action = _by_name.get(f"{parts[0]}_{parts[1]}")
+    if action is None or not action.args:
+        return None
+    return _convert(action, parts[2].rsplit("_", len(action.args) - 1))
+
+@functools.lru_cache(maxsize=4096)
+def decode(data: str) -> Optional[Tuple[str, tuple]]:
+    """Возвращает (имя действия, аргументы) или None для неизвестных данных"""
+    if not data:
+        return None
+    parts = data.split(SEPARATOR)
+    if len(parts) == 1:
+        return _decode_legacy(data)
+    if parts[0] != CALLBACK_VERSION:
+        return None
+    action = _by_code.get(parts[1])
+    if action is None:
+        return None
+    return _convert(action, parts[2:])
+
+class CallbackRouter:
+    def __init__(self, denied_text: str = "Недостаточно прав"):
+        self.denied_text = denied_text
+        # имя действия -> (обработчик, проверка прав по user_id)
+        self._routes: Dict[str, Tuple[Callable, Optional[Callable[[int], bool]]]] = {}
+
+    def action(self, name: str, access: Optional[Callable[[int], bool]] = None):
+        """Декоратор: регистрирует обработчик handler(update, context, *args) для действия.
+
+        access — проверка прав по user_id; без неё действие доступно всем.
+        """
+        if name not in _by_name:
+            raise KeyError(f"Неизвестное действие: {name}")
+
+        def decorator(handler):
+            self._routes[name] = (instrument(handler, f"callback_{name}"), access)
+            return handler
+        return decorator
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Единый обработчик CallbackQuery"""
+        query = update.callback_query
+        decoded = decode(query.data)
+        route = self._routes.get(decoded[0]) if decoded else None
+        if route is None:
+            logger.warning(f"Неизвестная кнопка: {query.data!r}")
+            await query.answer()
+            return
+
+        handler, access = route
+        if access is not None and not access(query.from_user.id):
+            await query.answer(self.denied_text)
+            return
+        await query.answer()
+        await handler(update, context, *decoded[1])
@@ -0,0 +1,136 @@
+"""Проверка планов запросов db.py.
+
+Выполняет функции db.py на временной базе, перехватывает все SQL-запросы
+и через EXPLAIN QUERY PLAN убеждается, что горячие запросы используют
+индексы, а не полный просмотр таблиц. Запуск: python check_query_plans.py
+"""
+import os
+import sys
+import tempfile
+
+import db
+
+# Функции, для которых полный просмотр ожидаем: массовые операции администратора
+ALLOWED_SCANS = {
+    "get_active_sessions",
+    "reset_active_sessions",
+    "clear_all_requests",
+    "get_media_stats",
+    # Объём хранилища медиа считается по всей таблице media_blobs
+    "evict_media_blobs",
+}
+
+def exercise():
+    """Вызывает функции db.py и возвращает список (функция, запрос)"""
+    request_id = db.add_user_request(1, "Имя", "user", "Запрос")
+    db.add_message_to_request(request_id, 1, message_text="текст")
+    calls = [
+        ("add_user_request", (2, "Имя", "user2", "Запрос")),
+        ("add_user_request", (3, "Имя", "user3", "Запрос")),
+        ("get_pending_requests", ()),
+        ("get_pending_requests_page", ()),
+        ("get_pending_requests_page", (("2000-01-01 00:00:00", 0),)),
+        ("get_pending_requests_page", (None, ("2100-01-01 00:00:00", 0))),
+        ("get_user_active_request", (1,)),
+        ("get_request", (request_id,)),
+        ("get_requests", ([request_id, request_id + 1],)),
+        ("start_request_processing", (request_id,)),
+        ("assign_orphan_sessions", (100,)),
+        ("create_session", (request_id, 1, 100)),
+        ("accept_request", (request_id + 1, 100)),
+        ("get_active_session_by_user", (1,)),
+        ("get_current_session", (100,)),
+        ("set_current_session", (100, 1)),
+        ("get_specialist_sessions", (100,)),
+        ("get_specialist_loads", ()),
+        ("add_relayed_messages", (100, [10, 11], 1)),
+        ("get_session_by_reply", (100, 10)),
+        ("get_active_sessions", ()),
+        ("get_session_info", (1,)),
+        ("add_session_message", (1, 1, "текст")),
+        ("add_session_message", (1, 100, "ответ")),
+        ("add_messages", ([(1, request_id, 1, "текст", None, None), (1, request_id, 100, "ответ", None, None)],)),
+        ("get_messages_for_request", (request_id,)),
+        ("get_messages_page", (request_id,)),
+        ("search_messages", ("текст",)),
+        ("search_messages", ("текст", 10, (-1.0, 1))),
+        ("search_messages", ("текст", 10, None, (-1.0, 1))),
+        ("get_export_page", (None, request_id)),
+        ("get_export_page", (("2000-01-01 00:00:00", 0), request_id)),
+        ("get_export_page", (None, None, "2000-01-01", "2100-01-01")),
+        ("get_export_page", (("2000-01-01 00:00:00", 0), None, "2000-01-01", "2100-01-01")),
+        ("get_messages_page", (request_id, ("2000-01-01 00:00:00", 0))),
+        ("journal_media_item", ({"journal_id": "j1", "media_group_id": "g1", "request_id": request_id,
+                                 "session_id": 1, "user_id": 1, "user_name": "Имя", "username": "user"},
+                                1, 10, "photo", "file", "подпись", "u1", 1024)),
+        ("journal_media_item", ({"journal_id": "j1", "media_group_id": "g1", "request_id": request_id,
+                                 "session_id": 1, "user_id": 1, "user_name": "Имя", "username": "user"},
+                                1, 10, "photo", "file")),
+        ("journal_media_item", ({"journal_id": "j1", "media_group_id": "g1", "request_id": request_id,
+                                 "session_id": 1, "user_id": 1, "user_name": "Имя", "username": "user"},
+                                1, 11, "photo", "file", None, "u1", 1024)),
+        ("get_media_group_items", ("j1",)),
+        ("get_media_stats", ()),
+        ("get_unmirrored_media", ()),
+        ("store_media_blob", ("u1", "ab" * 32, 1024)),
+        ("touch_media_blob", ("u1",)),
+        ("fail_media_mirror", ("u1", 5)),
+        ("evict_media_blobs", (0,)),
+        ("get_stats", ("2000-01-01 00:00", "2000-01-01")),
+        ("get_unfinished_media_groups", ()),
+        ("mark_media_group_sent", ("j1",)),
+        ("complete_media_group", ("j1", [(1, request_id, 1, None, "photo", "file", "u1")])),
+        ("purge_media_journal", ("2100-01-01 00:00:00",)),
+        ("end_session", (1,)),
+        ("archive_completed_requests", ("2100-01-01 00:00:00",)),
+        ("get_archived_request", (request_id,)),
+        ("delete_request", (request_id + 2,)),
+        ("reset_active_sessions", ()),
+        ("clear_all_requests", ()),
+    ]
+    statements = []
+    for name, args in calls:
+        traced = []
+        with db.get_db_connection() as conn:
+            conn.set_trace_callback(traced.append)
+        try:
+            getattr(db, name)(*args)
+        finally:
+            with db.get_db_connection() as conn:
+                conn.set_trace_callback(None)
+        statements.extend((name, sql) for sql in traced)
+    return statements
+
+def find_scans(statements):
+    """Возвращает запросы, план которых содержит полный просмотр таблицы"""
+    problems = []
+    with db.get_db_connection() as conn:
+        for name, sql in statements:
+            if name in ALLOWED_SCANS or not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            for row in plan:
+                detail = row["detail"]
+                # SCAN ... VIRTUAL TABLE INDEX — поиск по индексу FTS5
+                if detail.startswith("SCAN") and "USING" not in detail and "VIRTUAL TABLE INDEX" not in detail:
+                    problems.append((name, sql.strip(), detail))
+    return problems
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_FILE = os.path.join(tmp, "check.db")
+        db.init_db()
+        try:
+            problems = find_scans(exercise())
+        finally:
+            db.close_db()
+
+    for name, sql, detail in problems:
+        print(f"{name}: {detail}\n    {sql}")
+    if problems:
+        return 1
+    print("All hot queries use indexes")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
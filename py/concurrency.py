@@ -0,0 +1,168 @@
+"""Параллельная обработка обновлений с сохранением порядка.
+
+Приложение обрабатывает обновления разных пользователей одновременно, но
+обновления с общим ключом — по одному и в порядке поступления. Ключи
+обновления:
+- пользователь и чат, от которых оно пришло;
+- запрос или сессия, с которыми работает нажатая кнопка, чтобы два
+  специалиста не приняли или не завершили одно и то же одновременно.
+
+Для каждого ключа заводится asyncio.Lock; блокировки нескольких ключей
+берутся в отсортированном порядке, поэтому взаимных блокировок нет.
+Ключ, который становится известен только из БД (пользователь принимаемого
+запроса), обработчик берёт сам через update_processor.hold(). Такой ключ
+берётся не по порядку, поэтому его ожидание ограничено HOLD_TIMEOUT.
+Задачи обновлений создаются и встают в очередь блокировок в порядке
+поступления, а asyncio.Lock пропускает ожидающих по очереди.
+
+Ограничений два: UPDATE_QUEUE_SIZE — сколько обновлений приложение
+принимает в работу (через BaseUpdateProcessor), UPDATE_CONCURRENCY —
+сколько из них одновременно выполняют обработчики. Второй лимит берётся
+уже после блокировок ключей, чтобы обновления, ждущие своей очереди, не
+занимали места.
+"""
+import asyncio
+import contextlib
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, FrozenSet, List, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from callbacks import decode
+from config import UPDATE_CONCURRENCY, UPDATE_QUEUE_SIZE
+from metrics import Gauge, register
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать ключа, взятого внутри обработчика, секунды
+HOLD_TIMEOUT = 10.0
+
+# Ключи, которые держит обновление, выполняемое в текущей задаче
+_held_keys: ContextVar[FrozenSet[Tuple[str, int]]] = ContextVar("held_update_keys", default=frozenset())
+
+# Кнопки, которые меняют запрос или сессию, и ключ, по которому они упорядочиваются
+CALLBACK_KEYS = {
+    'accept_request': 'request',
+    'reject_request': 'request',
+    'digest_accept': 'request',
+    'digest_reject': 'request',
+    'select_session': 'session',
+    'end_session': 'session',
+}
+
+def update_keys(update: object) -> List[Tuple[str, int]]:
+    """Ключи, по которым обновление упорядочивается с другими"""
+    if not isinstance(update, Update):
+        return []
+    keys = set()
+    if update.effective_user:
+        keys.add(('user', update.effective_user.id))
+    if update.effective_chat:
+        keys.add(('chat', update.effective_chat.id))
+    if update.callback_query:
+        decoded = decode(update.callback_query.data)
+        if decoded and decoded[0] in CALLBACK_KEYS:
+            keys.add((CALLBACK_KEYS[decoded[0]], decoded[1][0]))
+    return sorted(keys)
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка с последовательным выполнением по ключам"""
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_pending: int = UPDATE_QUEUE_SIZE):
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self._running = asyncio.BoundedSemaphore(concurrency)
+        # ключ -> [блокировка, число обновлений, которые её держат или ждут]
+        self._locks: Dict[Tuple[str, int], list] = {}
+        self.waiting = 0
+        self.active = 0
+
+    def _acquire_entry(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def _release_entry(self, key):
+        entry = self._locks[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        keys = update_keys(update)
+        # Записи блокировок создаются до первого await, чтобы их не удалили
+        locks = [self._acquire_entry(key) for key in keys]
+        acquired = []
+        started = False
+        self.waiting += 1
+        try:
+            for lock in locks:
+                await lock.acquire()
+                acquired.append(lock)
+            async with self._running:
+                self.waiting -= 1
+                self.active += 1
+                started = True
+                held = _held_keys.set(frozenset(keys))
+                try:
+                    await coroutine
+                finally:
+                    _held_keys.reset(held)
+                    self.active -= 1
+        finally:
+            if not started:
+                self.waiting -= 1
+                # Обновление отменено до запуска обработчика
+                coroutine.close()
+            for lock in acquired:
+                lock.release()
+            for key in keys:
+                self._release_entry(key)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, *keys: Tuple[str, int]):
+        """Дополнительно упорядочивает обработчик по ключам keys.
+
+        Ключи, которые обновление уже держит, пропускаются. Если ключ не
+        освободился за HOLD_TIMEOUT (два обработчика ждут ключи друг друга),
+        обработчик продолжает без него.
+        """
+        held = _held_keys.get()
+        keys = sorted(set(keys) - held)
+        locks = [self._acquire_entry(key) for key in keys]
+        acquired = []
+        token = _held_keys.set(held | frozenset(keys))
+        try:
+            for key, lock in zip(keys, locks):
+                try:
+                    await asyncio.wait_for(lock.acquire(), HOLD_TIMEOUT)
+                    acquired.append(lock)
+                except asyncio.TimeoutError:
+                    logger.warning(f"Ключ {key} не освободился за {HOLD_TIMEOUT} с, продолжаем без него")
+            yield
+        finally:
+            _held_keys.reset(token)
+            for lock in acquired:
+                lock.release()
+            for key in keys:
+                self._release_entry(key)
+
+    def lock_count(self) -> int:
+        return len(self._locks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+update_processor = KeyedUpdateProcessor()
+
+register(Gauge("bot_updates_waiting", "Обновления, ожидающие своей очереди",
+               lambda: update_processor.waiting))
+register(Gauge("bot_updates_active", "Обновления, которые обрабатываются сейчас",
+               lambda: update_processor.active))
@@ -6,8 +6,115 @@ if os.path.exists(".env"):
 
 TOKEN = os.getenv("BOT_TOKEN") or os.environ.get("BOT_TOKEN")  # Берёт из .env или GitHub Secrets
 ADMIN_ID = int(os.getenv("ADMIN_ID") or os.environ.get("ADMIN_ID"))  # Преобразует в число
+# Специалисты, принимающие запросы (через запятую); ADMIN_ID входит всегда
+SPECIALIST_IDS = [ADMIN_ID] + [
+    int(x) for x in (os.getenv("SPECIALIST_IDS") or "").split(",")
+    if x.strip() and int(x) != ADMIN_ID
+]
 
 WEBSITE_URL = "https://everest-tk.ru/obnovlenie-kataloga"
 CHANNEL_URL = "https://t.me/everesttkk"
 WORKING_HOURS_TEXT = "Ожидайте, в рабочее время с 9 до 18 по Хабаровску с вами свяжется специалист"
 ALBUM_THRESHOLD_SECONDS = 1.5
+# Сколько часов журнал медиа-групп помнит обработанные альбомы (защита от повторной доставки)
+MEDIA_JOURNAL_KEEP_HOURS = 24
+# Интервал группового сохранения текстовых сообщений в БД
+WRITE_BEHIND_FLUSH_SECONDS = 0.05
+# Архивация завершённых запросов: старше RETENTION_DAYS дней (0 — не архивировать)
+RETENTION_DAYS = float(os.getenv("RETENTION_DAYS") or 90)
+RETENTION_INTERVAL_SECONDS = 3600
+# Запросов за одну транзакцию и пауза между порциями, чтобы не держать блокировку записи
+RETENTION_BATCH_SIZE = 50
+RETENTION_BATCH_PAUSE_SECONDS = 0.1
+# Страниц, возвращаемых системе за один шаг incremental_vacuum
+RETENTION_VACUUM_PAGES = 500
+# Число запросов на одной странице списка ожидающих запросов
+PENDING_PAGE_SIZE = 10
+# Число результатов /search на одной странице
+SEARCH_PAGE_SIZE = 5
+# Выгрузка /export: до EXPORT_SPOOL_BYTES файл держится в памяти, дальше — на диске;
+# Bot API принимает документы не больше 50 МБ
+EXPORT_SPOOL_BYTES = 1024 * 1024
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+EXPORT_DEFAULT_DAYS = 30
+
+# Исходящие сообщения: лимиты Telegram — около 30 сообщений в секунду
+# на бота и около одного сообщения в секунду в один чат
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE") or 30)
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE") or 1.0)
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST") or 3)
+SEND_MAX_CONCURRENCY = int(os.getenv("SEND_MAX_CONCURRENCY") or 8)
+SEND_MAX_RETRIES = 5
+
+# Режим получения обновлений: polling (для разработки) или webhook
+BOT_MODE = os.getenv("BOT_MODE") or "polling"
+# Адрес Bot API; задаётся для локального Bot API сервера или тестового стенда
+BOT_API_URL = os.getenv("BOT_API_URL") or "https://api.telegram.org/bot"
+# Адрес скачивания файлов; по умолчанию выводится из BOT_API_URL (.../bot -> .../file/bot)
+BOT_FILE_URL = os.getenv("BOT_FILE_URL") or BOT_API_URL.rsplit("/bot", 1)[0] + "/file/bot"
+# Публичный адрес, на который Telegram будет отправлять обновления
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN") or "0.0.0.0"
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8443)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/telegram"
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Размер очереди входящих обновлений; при переполнении webhook отвечает 503
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE") or 1000)
+# Сколько обновлений обрабатывается одновременно (concurrency.py);
+# обновления одного пользователя, чата, запроса или сессии идут по порядку.
+# 1 — обработка строго по одному
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY") or 32)
+
+# Локальный HTTP-эндпоинт метрик Prometheus (/metrics) и проверки готовности
+# (/ready, см. startup.py); 0 — выключен. По умолчанию выключен: проверка
+# готовности (readiness probe) работает, только если задан METRICS_PORT
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+
+# Сводка новых запросов: запросы, пришедшие в течение окна, собираются в одно
+# сообщение специалисту, которое обновляется на месте; 0 — по сообщению на запрос
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS") or 60)
+# Не чаще одного обновления сводки за это время
+DIGEST_EDIT_INTERVAL_SECONDS = float(os.getenv("DIGEST_EDIT_INTERVAL_SECONDS") or 3)
+# Запросов в одной сводке (по две кнопки на запрос)
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS") or 20)
+# Первый текст пользователя пересылается специалисту сразу, а пришедшие за
+# ним в течение этого времени — одним сообщением; 0 — каждый текст отдельно
+COALESCE_TEXT_SECONDS = float(os.getenv("COALESCE_TEXT_SECONDS") or 1.5)
+# Предел длины объединённого сообщения (лимит Telegram — 4096 символов)
+COALESCE_MAX_CHARS = int(os.getenv("COALESCE_MAX_CHARS") or 3500)
+
+# Ограничение частоты текстов одного пользователя (flood.py): в среднем
+# FLOOD_RATE сообщений в секунду, подряд — до FLOOD_BURST. Сообщения сверх
+# лимита копятся и обрабатываются одним текстом; 0 — без ограничения
+FLOOD_RATE = float(os.getenv("FLOOD_RATE") or 1.0)
+FLOOD_BURST = float(os.getenv("FLOOD_BURST") or 10)
+# Не чаще одного предупреждения пользователю за это время, секунды
+FLOOD_NOTICE_SECONDS = float(os.getenv("FLOOD_NOTICE_SECONDS") or 30)
+# Сколько символов задержанных сообщений хранится на пользователя; сверх
+# этого сообщения отбрасываются, чтобы бот-спамер не занял память
+FLOOD_MAX_HELD_CHARS = int(os.getenv("FLOOD_MAX_HELD_CHARS") or 100_000)
+
+# Локальная копия медиафайлов (media_mirror.py): каталог хранилища; пусто — не копировать
+MEDIA_MIRROR_DIR = os.getenv("MEDIA_MIRROR_DIR") or ""
+# Предел объёма хранилища: сверх него удаляются файлы, к которым дольше всего не обращались
+MEDIA_MIRROR_MAX_BYTES = int(os.getenv("MEDIA_MIRROR_MAX_BYTES") or 10 * 1024 ** 3)
+# Сколько файлов скачивается одновременно
+MEDIA_MIRROR_CONCURRENCY = int(os.getenv("MEDIA_MIRROR_CONCURRENCY") or 4)
+# Файл читается и хешируется порциями такого размера, байты
+MEDIA_MIRROR_CHUNK_BYTES = 64 * 1024
+# Bot API отдаёт через getFile файлы не больше 20 МБ (локальный Bot API сервер — больше)
+MEDIA_MIRROR_MAX_FILE_BYTES = int(os.getenv("MEDIA_MIRROR_MAX_FILE_BYTES") or 20 * 1024 ** 2)
+MEDIA_MIRROR_INTERVAL_SECONDS = 300
+MEDIA_MIRROR_BATCH_SIZE = 50
+MEDIA_MIRROR_MAX_ATTEMPTS = 5
+
+# Число процессов-обработчиков; при BOT_WORKERS > 1 основной процесс только
+# принимает обновления и распределяет их по процессам по user_id (shards.py)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS") or 1)
+# Номер и число процессов задаются shards.py для каждого обработчика
+SHARD_INDEX = int(os.getenv("SHARD_INDEX") or 0)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT") or 1)
+# Хранилище состояния диалогов: local (память процесса) или shared (общая БД)
+STATE_BACKEND = os.getenv("STATE_BACKEND") or ("shared" if SHARD_COUNT > 1 else "local")
@@ -1,68 +1,465 @@
+import json
 import sqlite3
+import threading
+import zlib
 from contextlib import contextmanager
 from typing import Dict, List, Optional
 from datetime import datetime
 
 import os
-DB_FILE = os.path.join(os.path.dirname(__file__), "bot_database.db")
+# Процессы-обработчики (shards.py) получают путь к общей базе через окружение
+DB_FILE = os.getenv("DB_FILE") or os.path.join(os.path.dirname(__file__), "bot_database.db")
+# Архив завершённых запросов; по умолчанию рядом с основной базой
+ARCHIVE_DB_FILE: Optional[str] = None
+
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в WAL-режиме не делает fsync на каждый commit
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=67108864",
+    "PRAGMA busy_timeout=5000",
+)
+
+_connection: Optional[sqlite3.Connection] = None
+_connection_lock = threading.RLock()
+
+def _open_connection() -> sqlite3.Connection:
+    """Открывает соединение с базой данных и применяет настройки"""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 @contextmanager
 def get_db_connection():
-    """Контекстный менеджер для работы с базой данных"""
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    try:
-        yield conn
-    finally:
-        conn.close()
-
-def init_db():
-    """Инициализация структуры базы данных"""
-    with get_db_connection() as conn:
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS user_requests (
-            request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            user_name TEXT,
-            username TEXT,
-            request_text TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS active_sessions (
-            session_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            request_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (request_id) REFERENCES user_requests(request_id)
-        )""")
-        
-        conn.execute("""
-        CREATE TABLE IF NOT EXISTS session_messages (
-            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            session_id INTEGER,
-            request_id INTEGER,
-            sender_id INTEGER NOT NULL,
-            message_text TEXT,
-            media_type TEXT,  -- 'photo', 'video', 'document', 'forward'
-            media_id TEXT,
-            message_link TEXT,
-            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (session_id) REFERENCES active_sessions(session_id),
-            FOREIGN KEY (request_id) REFERENCES user_requests(request_id)
-        )""")
-        conn.commit()
-
-def add_user_request(user_id: int, user_name: str, username: str, request_text: str) -> int:
-    """Добавляет новый запрос пользователя"""
+    """Контекстный менеджер для работы с базой данных.
+
+    Возвращает единственное долгоживущее соединение. Незавершённая
+    транзакция откатывается при ошибке, чтобы не остаться открытой.
+    """
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = _open_connection()
+        try:
+            yield _connection
+        except Exception:
+            _connection.rollback()
+            raise
+
+def close_db():
+    """Закрывает соединение с базой данных"""
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+# Миграции схемы: элемент с индексом i переводит базу на версию i + 1.
+# Текущая версия хранится в PRAGMA user_version.
+MIGRATIONS = [
+    # 1: исходные таблицы
+    """
+    CREATE TABLE IF NOT EXISTS user_requests (
+        request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        user_name TEXT,
+        username TEXT,
+        request_text TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS active_sessions (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        request_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (request_id) REFERENCES user_requests(request_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS session_messages (
+        message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER,
+        request_id INTEGER,
+        sender_id INTEGER NOT NULL,
+        message_text TEXT,
+        media_type TEXT,  -- 'photo', 'video', 'document', 'forward'
+        media_id TEXT,
+        message_link TEXT,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (session_id) REFERENCES active_sessions(session_id),
+        FOREIGN KEY (request_id) REFERENCES user_requests(request_id)
+    );
+    """,
+    # 2: индексы для поиска запросов пользователя, очереди, сессий и истории
+    """
+    CREATE INDEX IF NOT EXISTS idx_user_requests_user_status
+        ON user_requests (user_id, status);
+    CREATE INDEX IF NOT EXISTS idx_user_requests_status_created
+        ON user_requests (status, created_at, request_id);
+    CREATE INDEX IF NOT EXISTS idx_active_sessions_request
+        ON active_sessions (request_id);
+    CREATE INDEX IF NOT EXISTS idx_session_messages_request_sent
+        ON session_messages (request_id, sent_at);
+    """,
+    # 3: несколько специалистов, у каждого несколько сессий
+    """
+    ALTER TABLE active_sessions ADD COLUMN admin_id INTEGER;
+    CREATE INDEX IF NOT EXISTS idx_active_sessions_admin
+        ON active_sessions (admin_id, session_id);
+
+    -- Текущий диалог специалиста: куда уходят его сообщения без reply
+    CREATE TABLE IF NOT EXISTS specialist_state (
+        admin_id INTEGER PRIMARY KEY,
+        current_session_id INTEGER
+    );
+
+    -- Сообщения, пересланные специалисту: ответ (reply) на них уходит в сессию
+    CREATE TABLE IF NOT EXISTS relayed_messages (
+        admin_id INTEGER NOT NULL,
+        chat_message_id INTEGER NOT NULL,
+        session_id INTEGER NOT NULL,
+        PRIMARY KEY (admin_id, chat_message_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_relayed_messages_session
+        ON relayed_messages (session_id);
+    """,
+    # 4: время завершения запроса для архивации старых диалогов
+    """
+    ALTER TABLE user_requests ADD COLUMN completed_at TIMESTAMP;
+    UPDATE user_requests SET completed_at = created_at WHERE status = 'completed';
+    CREATE INDEX IF NOT EXISTS idx_user_requests_status_completed
+        ON user_requests (status, completed_at, request_id);
+    """,
+    # 5: полнотекстовый поиск по тексту сообщений и подписям к медиа.
+    # Индекс хранит только токены (external content), текст берётся из
+    # session_messages; триггеры обновляют его при каждом изменении.
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS session_messages_fts USING fts5(
+        message_text,
+        content='session_messages',
+        content_rowid='message_id',
+        tokenize='unicode61 remove_diacritics 2'
+    );
+
+    CREATE TRIGGER IF NOT EXISTS session_messages_fts_insert
+    AFTER INSERT ON session_messages WHEN new.message_text IS NOT NULL BEGIN
+        INSERT INTO session_messages_fts (rowid, message_text) VALUES (new.message_id, new.message_text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS session_messages_fts_delete
+    AFTER DELETE ON session_messages WHEN old.message_text IS NOT NULL BEGIN
+        INSERT INTO session_messages_fts (session_messages_fts, rowid, message_text)
+        VALUES ('delete', old.message_id, old.message_text);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS session_messages_fts_update
+    AFTER UPDATE OF message_text ON session_messages BEGIN
+        INSERT INTO session_messages_fts (session_messages_fts, rowid, message_text)
+        SELECT 'delete', old.message_id, old.message_text WHERE old.message_text IS NOT NULL;
+        INSERT INTO session_messages_fts (rowid, message_text)
+        SELECT new.message_id, new.message_text WHERE new.message_text IS NOT NULL;
+    END;
+
+    INSERT INTO session_messages_fts (session_messages_fts) VALUES ('rebuild');
+    """,
+    # 6: выгрузка сообщений за период
+    """
+    CREATE INDEX IF NOT EXISTS idx_session_messages_sent
+        ON session_messages (sent_at, message_id);
+    """,
+    # 7: журнал медиа-групп, ожидающих отправки. Состояния группы:
+    # open — собирается или ждёт отправки, sent — отправлена, но ещё не
+    # сохранена в session_messages, done — обработана. Строки done остаются
+    # на время, чтобы повторно доставленные Telegram обновления не
+    # отправили альбом второй раз.
+    """
+    CREATE TABLE IF NOT EXISTS media_group_journal (
+        journal_id TEXT PRIMARY KEY,
+        media_group_id TEXT NOT NULL,
+        request_id INTEGER,
+        session_id INTEGER,
+        user_id INTEGER NOT NULL,
+        user_name TEXT,
+        username TEXT,
+        caption TEXT,
+        state TEXT NOT NULL DEFAULT 'open',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_media_group_journal_state
+        ON media_group_journal (state, created_at);
+
+    CREATE TABLE IF NOT EXISTS media_group_items (
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        journal_id TEXT NOT NULL,
+        media_type TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        PRIMARY KEY (chat_id, message_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_media_group_items_journal
+        ON media_group_items (journal_id);
+    """,
+    # 8: реестр медиафайлов по file_unique_id (он одинаков у всех копий
+    # файла, в отличие от file_id). Повторно присланный в рамках запроса
+    # файл не пересылается и не сохраняется второй раз.
+    """
+    CREATE TABLE IF NOT EXISTS media_files (
+        file_unique_id TEXT PRIMARY KEY,
+        media_type TEXT NOT NULL,
+        file_id TEXT NOT NULL,  -- file_id первой копии, им файл отправляется повторно
+        file_size INTEGER,
+        received INTEGER NOT NULL DEFAULT 0,    -- сколько раз файл присылали
+        duplicates INTEGER NOT NULL DEFAULT 0,  -- сколько копий отброшено как повторы
+        first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+
+    ALTER TABLE session_messages ADD COLUMN file_unique_id TEXT REFERENCES media_files (file_unique_id);
+    CREATE INDEX IF NOT EXISTS idx_session_messages_request_file
+        ON session_messages (request_id, file_unique_id) WHERE file_unique_id IS NOT NULL;
+
+    ALTER TABLE media_group_items ADD COLUMN file_unique_id TEXT;
+    CREATE INDEX IF NOT EXISTS idx_media_group_items_file
+        ON media_group_items (file_unique_id) WHERE file_unique_id IS NOT NULL;
+    """,
+    # 9: аналитика. session_history хранит сессии и после завершения
+    # (end_session удаляет строку active_sessions). stats_hourly и
+    # stats_daily — счётчики и суммы времени по часам и дням UTC; они
+    # обновляются в тех же транзакциях, что и сами события. Поля *_max —
+    # наибольшее значение за период, first_reply_* — сколько первых ответов
+    # пришло не позже 5 мин, 15 мин, 1 ч и 4 ч после запроса.
+    """
+    CREATE TABLE IF NOT EXISTS session_history (
+        session_id INTEGER PRIMARY KEY,
+        request_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        admin_id INTEGER,
+        request_created_at TIMESTAMP,
+        started_at TIMESTAMP NOT NULL,
+        first_reply_at TIMESTAMP,
+        ended_at TIMESTAMP,
+        outcome TEXT  -- 'completed' или 'reset'; NULL — сессия идёт
+    );
+    CREATE INDEX IF NOT EXISTS idx_session_history_open
+        ON session_history (session_id) WHERE ended_at IS NULL;
+
+    CREATE TABLE IF NOT EXISTS stats_hourly (
+        bucket TEXT PRIMARY KEY,  -- 'ГГГГ-ММ-ДД ЧЧ:00'
+        requests INTEGER NOT NULL DEFAULT 0,
+        rejected INTEGER NOT NULL DEFAULT 0,
+        accepted INTEGER NOT NULL DEFAULT 0,
+        wait_seconds REAL NOT NULL DEFAULT 0,
+        wait_max REAL NOT NULL DEFAULT 0,
+        first_replies INTEGER NOT NULL DEFAULT 0,
+        first_reply_seconds REAL NOT NULL DEFAULT 0,
+        first_reply_max REAL NOT NULL DEFAULT 0,
+        first_reply_5m INTEGER NOT NULL DEFAULT 0,
+        first_reply_15m INTEGER NOT NULL DEFAULT 0,
+        first_reply_1h INTEGER NOT NULL DEFAULT 0,
+        first_reply_4h INTEGER NOT NULL DEFAULT 0,
+        sessions_ended INTEGER NOT NULL DEFAULT 0,
+        session_seconds REAL NOT NULL DEFAULT 0,
+        session_max REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        bucket TEXT PRIMARY KEY,  -- 'ГГГГ-ММ-ДД'
+        requests INTEGER NOT NULL DEFAULT 0,
+        rejected INTEGER NOT NULL DEFAULT 0,
+        accepted INTEGER NOT NULL DEFAULT 0,
+        wait_seconds REAL NOT NULL DEFAULT 0,
+        wait_max REAL NOT NULL DEFAULT 0,
+        first_replies INTEGER NOT NULL DEFAULT 0,
+        first_reply_seconds REAL NOT NULL DEFAULT 0,
+        first_reply_max REAL NOT NULL DEFAULT 0,
+        first_reply_5m INTEGER NOT NULL DEFAULT 0,
+        first_reply_15m INTEGER NOT NULL DEFAULT 0,
+        first_reply_1h INTEGER NOT NULL DEFAULT 0,
+        first_reply_4h INTEGER NOT NULL DEFAULT 0,
+        sessions_ended INTEGER NOT NULL DEFAULT 0,
+        session_seconds REAL NOT NULL DEFAULT 0,
+        session_max REAL NOT NULL DEFAULT 0
+    ) WITHOUT ROWID;
+
+    -- Идущие сессии попадают в историю, чтобы учесть их завершение;
+    -- число запросов восстанавливается по запросам в рабочих таблицах
+    INSERT OR IGNORE INTO session_history (session_id, request_id, user_id, admin_id, request_created_at, started_at)
+    SELECT s.session_id, s.request_id, s.user_id, s.admin_id, r.created_at, s.started_at
+    FROM active_sessions s LEFT JOIN user_requests r ON r.request_id = s.request_id;
+    INSERT OR IGNORE INTO stats_hourly (bucket, requests)
+    SELECT strftime('%Y-%m-%d %H:00', created_at), COUNT(*) FROM user_requests GROUP BY 1;
+    INSERT OR IGNORE INTO stats_daily (bucket, requests)
+    SELECT date(created_at), COUNT(*) FROM user_requests GROUP BY 1;
+    """,
+    # 10: локальная копия медиафайлов (media_mirror.py). media_blobs —
+    # содержимое в хранилище по sha256, одно на все file_unique_id с
+    # одинаковыми байтами; last_access с миллисекундами задаёт порядок
+    # вытеснения. mirror_status в media_files: NULL — файл ещё не скачан,
+    # 'stored', 'evicted' (вытеснен по объёму) или 'failed'.
+    """
+    CREATE TABLE IF NOT EXISTS media_blobs (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        stored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_access TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%f', 'now'))
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_media_blobs_access ON media_blobs (last_access);
+
+    ALTER TABLE media_files ADD COLUMN mirror_status TEXT;
+    ALTER TABLE media_files ADD COLUMN mirror_attempts INTEGER NOT NULL DEFAULT 0;
+    ALTER TABLE media_files ADD COLUMN sha256 TEXT;
+    CREATE INDEX IF NOT EXISTS idx_media_files_unmirrored
+        ON media_files (first_seen) WHERE mirror_status IS NULL;
+    CREATE INDEX IF NOT EXISTS idx_media_files_sha256
+        ON media_files (sha256) WHERE sha256 IS NOT NULL;
+    """,
+    # 11: специалист, которому пришло уведомление о запросе; до начала
+    # сессии медиа пользователя пересылаются ему
+    """
+    ALTER TABLE user_requests ADD COLUMN specialist_id INTEGER;
+    """,
+    # 12: записи журнала медиа-групп удаляются вместе с запросом
+    """
+    CREATE INDEX IF NOT EXISTS idx_media_group_journal_request
+        ON media_group_journal (request_id);
+    """,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Результат записи элемента медиа-группы в журнал
+MEDIA_NEW = 'new'
+MEDIA_REDELIVERED = 'redelivered'
+MEDIA_DUPLICATE = 'duplicate'
+
+# Таблицы сводной статистики и формат ключа периода (время UTC, как CURRENT_TIMESTAMP)
+STATS_TABLES = (("stats_hourly", "%Y-%m-%d %H:00"), ("stats_daily", "%Y-%m-%d"))
+# Границы времени первого ответа (секунды) и поля stats_*, где они считаются
+FIRST_REPLY_BOUNDS = ((300, 'first_reply_5m'), (900, 'first_reply_15m'),
+                      (3600, 'first_reply_1h'), (14400, 'first_reply_4h'))
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Возвращает версию схемы, записанную в базе"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db() -> bool:
+    """Инициализация структуры базы данных: применяет недостающие миграции.
+
+    Если схема уже актуальна, ограничивается чтением её версии. Возвращает
+    True, если миграции применялись.
+    """
+    with get_db_connection() as conn:
+        version = get_schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return False
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            # Миграция и новая версия фиксируются одной транзакцией
+            conn.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;"
+            )
+        enable_incremental_vacuum(conn)
+        return True
+
+def ping() -> bool:
+    """Проверка, что база отвечает на запросы"""
+    with get_db_connection() as conn:
+        return conn.execute("SELECT 1").fetchone()[0] == 1
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Включает auto_vacuum=INCREMENTAL, чтобы освобождать место после архивации.
+
+    Для уже существующей базы режим вступает в силу только после VACUUM,
+    поэтому он выполняется один раз.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    conn.commit()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+def _bump_stats(conn: sqlite3.Connection, **values: float):
+    """Прибавляет значения к строкам текущего часа и дня в stats_hourly и stats_daily.
+
+    Поля *_max не суммируются, а принимают наибольшее значение.
+    Вызывается внутри транзакции события и не фиксирует её сама.
+    """
+    columns = list(values)
+    updates = ", ".join(
+        f"{column} = MAX({column}, excluded.{column})" if column.endswith("_max")
+        else f"{column} = {column} + excluded.{column}"
+        for column in columns
+    )
+    for table, bucket_format in STATS_TABLES:
+        conn.execute(
+            f"""INSERT INTO {table} (bucket, {", ".join(columns)})
+                VALUES (strftime('{bucket_format}', 'now'), {", ".join("?" * len(columns))})
+                ON CONFLICT (bucket) DO UPDATE SET {updates}""",
+            list(values.values())
+        )
+
+def _record_first_replies(conn: sqlite3.Connection, messages):
+    """Отмечает первый ответ специалиста в сессиях; messages — пары (session_id, sender_id).
+
+    Ответом специалиста считается любое сообщение сессии не от пользователя.
+    """
+    for session_id, sender_id in set(messages):
+        if session_id is None:
+            continue
+        cursor = conn.execute(
+            """UPDATE session_history SET first_reply_at = CURRENT_TIMESTAMP
+               WHERE session_id = ? AND first_reply_at IS NULL AND user_id <> ?""",
+            (session_id, sender_id)
+        )
+        if not cursor.rowcount:
+            continue
+        seconds = conn.execute(
+            """SELECT (julianday(first_reply_at) - julianday(request_created_at)) * 86400
+               FROM session_history WHERE session_id = ?""",
+            (session_id,)
+        ).fetchone()[0]
+        if seconds is None:
+            continue
+        within = {column: 1 for bound, column in FIRST_REPLY_BOUNDS if seconds <= bound}
+        _bump_stats(conn, first_replies=1, first_reply_seconds=seconds, first_reply_max=seconds, **within)
+
+def _close_session_history(conn: sqlite3.Connection, session_id: int):
+    """Записывает завершение сессии в историю и сводную статистику"""
+    cursor = conn.execute(
+        """UPDATE session_history SET ended_at = CURRENT_TIMESTAMP, outcome = 'completed'
+           WHERE session_id = ? AND ended_at IS NULL""",
+        (session_id,)
+    )
+    if not cursor.rowcount:
+        return
+    seconds = conn.execute(
+        """SELECT (julianday(ended_at) - julianday(started_at)) * 86400
+           FROM session_history WHERE session_id = ?""",
+        (session_id,)
+    ).fetchone()[0]
+    _bump_stats(conn, sessions_ended=1, session_seconds=seconds, session_max=seconds)
+
+def _close_open_session_history(conn: sqlite3.Connection):
+    """Закрывает в истории сессии, сброшенные без завершения; в статистику они не попадают"""
+    conn.execute(
+        "UPDATE session_history SET ended_at = CURRENT_TIMESTAMP, outcome = 'reset' WHERE ended_at IS NULL"
+    )
+
+def add_user_request(user_id: int, user_name: str, username: str, request_text: str,
+                     specialist_id: Optional[int] = None) -> int:
+    """Добавляет новый запрос пользователя, назначенный специалисту specialist_id"""
     with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO user_requests (user_id, user_name, username, request_text) VALUES (?, ?, ?, ?)",
-            (user_id, user_name, username, request_text)
+            """INSERT INTO user_requests (user_id, user_name, username, request_text, specialist_id)
+               VALUES (?, ?, ?, ?, ?)""",
+            (user_id, user_name, username, request_text, specialist_id)
         )
+        _bump_stats(conn, requests=1)
         conn.commit()
         return cursor.lastrowid
 
@@ -74,6 +471,39 @@ def get_pending_requests() -> List[Dict]:
         )
         return [dict(row) for row in cursor.fetchall()]
 
+def get_pending_requests_page(after: Optional[tuple] = None, before: Optional[tuple] = None,
+                              limit: int = 10) -> List[Dict]:
+    """Возвращает страницу ожидающих запросов в порядке (created_at, request_id).
+
+    after — ключ (created_at, request_id) последней строки предыдущей страницы,
+    before — ключ первой строки следующей страницы (листание назад).
+    Возвращает до limit + 1 строк: лишняя строка означает, что в этом
+    направлении есть ещё страница.
+    """
+    with get_db_connection() as conn:
+        if before is not None:
+            cursor = conn.execute(
+                """SELECT request_id, user_id, user_name, username, created_at FROM user_requests
+                   WHERE status = 'pending' AND (created_at, request_id) < (?, ?)
+                   ORDER BY created_at DESC, request_id DESC LIMIT ?""",
+                (before[0], before[1], limit + 1)
+            )
+            return [dict(row) for row in cursor.fetchall()][::-1]
+        if after is not None:
+            cursor = conn.execute(
+                """SELECT request_id, user_id, user_name, username, created_at FROM user_requests
+                   WHERE status = 'pending' AND (created_at, request_id) > (?, ?)
+                   ORDER BY created_at, request_id LIMIT ?""",
+                (after[0], after[1], limit + 1)
+            )
+        else:
+            cursor = conn.execute(
+                """SELECT request_id, user_id, user_name, username, created_at FROM user_requests
+                   WHERE status = 'pending' ORDER BY created_at, request_id LIMIT ?""",
+                (limit + 1,)
+            )
+        return [dict(row) for row in cursor.fetchall()]
+
 def get_user_active_request(user_id: int) -> Optional[Dict]:
     """Возвращает активный запрос пользователя"""
     with get_db_connection() as conn:
@@ -95,16 +525,65 @@ def start_request_processing(request_id: int) -> bool:
         conn.commit()
         return cursor.rowcount > 0
 
-def create_session(request_id: int, user_id: int) -> int:
-    """Создает новую сессию для запроса"""
+def _insert_session(conn: sqlite3.Connection, request_id: int, user_id: int, admin_id: Optional[int]) -> int:
+    """Добавляет сессию, её запись в истории и статистику ожидания (без commit)"""
+    cursor = conn.execute(
+        "INSERT INTO active_sessions (request_id, user_id, admin_id) VALUES (?, ?, ?)",
+        (request_id, user_id, admin_id)
+    )
+    session_id = cursor.lastrowid
+    if admin_id is not None:
+        conn.execute(
+            "INSERT OR REPLACE INTO specialist_state (admin_id, current_session_id) VALUES (?, ?)",
+            (admin_id, session_id)
+        )
+    conn.execute(
+        """INSERT INTO session_history (session_id, request_id, user_id, admin_id, request_created_at, started_at)
+           SELECT s.session_id, s.request_id, s.user_id, s.admin_id, r.created_at, s.started_at
+           FROM active_sessions s LEFT JOIN user_requests r ON r.request_id = s.request_id
+           WHERE s.session_id = ?""",
+        (session_id,)
+    )
+    waited = conn.execute(
+        """SELECT (julianday(started_at) - julianday(request_created_at)) * 86400
+           FROM session_history WHERE session_id = ?""",
+        (session_id,)
+    ).fetchone()[0]
+    if waited is not None:
+        _bump_stats(conn, accepted=1, wait_seconds=waited, wait_max=waited)
+    return session_id
+
+def create_session(request_id: int, user_id: int, admin_id: int = None) -> int:
+    """Создает новую сессию для запроса и делает её текущей у специалиста"""
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO active_sessions (request_id, user_id) VALUES (?, ?)",
-            (request_id, user_id)
+        session_id = _insert_session(conn, request_id, user_id, admin_id)
+        conn.commit()
+        return session_id
+
+def accept_request(request_id: int, admin_id: int) -> Optional[tuple]:
+    """Принимает ожидающий запрос и создаёт по нему сессию одной транзакцией:
+    (запрос, session_id) или None, если запрос уже приняли или удалили.
+
+    BEGIN IMMEDIATE сразу берёт блокировку записи, поэтому другие процессы
+    (shards.py) не увидят запрос в обработке без сессии.
+    """
+    with get_db_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.execute(
+            "UPDATE user_requests SET status = 'in_progress' WHERE request_id = ? AND status = 'pending'",
+            (request_id,)
         )
+        if cursor.rowcount == 0:
+            conn.rollback()
+            return None
+        request = dict(conn.execute(
+            """SELECT request_id, user_id, user_name, username, status, specialist_id
+               FROM user_requests WHERE request_id = ?""",
+            (request_id,)
+        ).fetchone())
+        session_id = _insert_session(conn, request_id, request['user_id'], admin_id)
         conn.commit()
-        return cursor.lastrowid
+        return request, session_id
 
 def end_session(session_id: int):
     """Завершает сессию и помечает запрос как выполненный"""
@@ -116,21 +595,32 @@ def end_session(session_id: int):
         request_id = cursor.fetchone()['request_id']
         
         conn.execute(
-            "UPDATE user_requests SET status = 'completed' WHERE request_id = ?",
+            "UPDATE user_requests SET status = 'completed', completed_at = CURRENT_TIMESTAMP WHERE request_id = ?",
             (request_id,)
         )
+        _close_session_history(conn, session_id)
         
+        conn.execute(
+            """UPDATE specialist_state SET current_session_id = NULL
+               WHERE admin_id = (SELECT admin_id FROM active_sessions WHERE session_id = ?)
+                 AND current_session_id = ?""",
+            (session_id, session_id)
+        )
         conn.execute(
             "DELETE FROM active_sessions WHERE session_id = ?",
             (session_id,)
         )
+        conn.execute(
+            "DELETE FROM relayed_messages WHERE session_id = ?",
+            (session_id,)
+        )
         conn.commit()
 
 def get_active_session_by_user(user_id: int) -> Optional[Dict]:
     """Возвращает активную сессию пользователя"""
     with get_db_connection() as conn:
         cursor = conn.execute(
-            """SELECT s.session_id, s.request_id, r.user_id, r.user_name, r.username 
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
                FROM active_sessions s
                JOIN user_requests r ON s.request_id = r.request_id
                WHERE r.user_id = ?""",
@@ -139,14 +629,109 @@ def get_active_session_by_user(user_id: int) -> Optional[Dict]:
         row = cursor.fetchone()
         return dict(row) if row else None
 
-def get_active_admin_session() -> Optional[Dict]:
-    """Возвращает активную сессию администратора"""
+def get_active_sessions() -> List[Dict]:
+    """Возвращает все активные сессии с данными пользователей"""
     with get_db_connection() as conn:
         cursor = conn.execute(
-            """SELECT s.session_id, s.request_id, r.user_id, r.user_name, r.username 
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
                FROM active_sessions s
                JOIN user_requests r ON s.request_id = r.request_id
-               LIMIT 1"""
+               ORDER BY s.session_id"""
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_current_session(admin_id: int) -> Optional[Dict]:
+    """Возвращает текущую сессию специалиста.
+
+    Если текущая не выбрана, берётся последняя начатая им сессия.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
+               FROM specialist_state st
+               JOIN active_sessions s ON s.session_id = st.current_session_id
+               JOIN user_requests r ON s.request_id = r.request_id
+               WHERE st.admin_id = ?""",
+            (admin_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            cursor = conn.execute(
+                """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
+                   FROM active_sessions s
+                   JOIN user_requests r ON s.request_id = r.request_id
+                   WHERE s.admin_id = ?
+                   ORDER BY s.session_id DESC LIMIT 1""",
+                (admin_id,)
+            )
+            row = cursor.fetchone()
+        return dict(row) if row else None
+
+def set_current_session(admin_id: int, session_id: int):
+    """Делает сессию текущей для специалиста"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO specialist_state (admin_id, current_session_id) VALUES (?, ?)",
+            (admin_id, session_id)
+        )
+        conn.commit()
+
+def get_specialist_sessions(admin_id: int) -> List[Dict]:
+    """Возвращает активные сессии специалиста"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
+               FROM active_sessions s
+               JOIN user_requests r ON s.request_id = r.request_id
+               WHERE s.admin_id = ?
+               ORDER BY s.session_id""",
+            (admin_id,)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_specialist_loads() -> Dict[int, int]:
+    """Возвращает число активных сессий у каждого специалиста"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            "SELECT admin_id, COUNT(*) AS sessions FROM active_sessions GROUP BY admin_id"
+        )
+        return {row['admin_id']: row['sessions'] for row in cursor.fetchall()}
+
+def assign_orphan_sessions(admin_id: int) -> int:
+    """Назначает специалиста сессиям, созданным до поддержки нескольких специалистов.
+
+    Вызывается при каждом запуске; обычно таких сессий нет, и тогда
+    ограничивается чтением без транзакции записи. Возвращает число сессий.
+    """
+    with get_db_connection() as conn:
+        if conn.execute("SELECT 1 FROM active_sessions WHERE admin_id IS NULL LIMIT 1").fetchone() is None:
+            return 0
+        cursor = conn.execute(
+            "UPDATE active_sessions SET admin_id = ? WHERE admin_id IS NULL",
+            (admin_id,)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+def add_relayed_messages(admin_id: int, chat_message_ids: List[int], session_id: int):
+    """Запоминает сообщения в чате специалиста, относящиеся к сессии"""
+    with get_db_connection() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO relayed_messages (admin_id, chat_message_id, session_id) VALUES (?, ?, ?)",
+            [(admin_id, message_id, session_id) for message_id in chat_message_ids]
+        )
+        conn.commit()
+
+def get_session_by_reply(admin_id: int, chat_message_id: int) -> Optional[Dict]:
+    """Возвращает сессию по сообщению, на которое ответил специалист"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
+               FROM relayed_messages m
+               JOIN active_sessions s ON s.session_id = m.session_id
+               JOIN user_requests r ON s.request_id = r.request_id
+               WHERE m.admin_id = ? AND m.chat_message_id = ?""",
+            (admin_id, chat_message_id)
         )
         row = cursor.fetchone()
         return dict(row) if row else None
@@ -180,8 +765,299 @@ def add_session_message(session_id: int, sender_id: int, message_text: str = Non
                VALUES (?, ?, ?, ?, ?, ?)""",
             (session_id, request_id, sender_id, message_text, media_type, media_id)
         )
+        _record_first_replies(conn, [(session_id, sender_id)])
+        conn.commit()
+
+def add_messages(rows: List[tuple]):
+    """Сохраняет пачку сообщений одной транзакцией.
+
+    Каждая строка: (session_id, request_id, sender_id, message_text, media_type, media_id).
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            """INSERT INTO session_messages 
+               (session_id, request_id, sender_id, message_text, media_type, media_id) 
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        _record_first_replies(conn, [(row[0], row[2]) for row in rows])
+        conn.commit()
+
+def journal_media_item(group: Dict, chat_id: int, message_id: int, media_type: str,
+                       file_id: str, caption: Optional[str] = None, file_unique_id: Optional[str] = None,
+                       file_size: Optional[int] = None, dedupe: bool = True) -> str:
+    """Записывает элемент медиа-группы в журнал и в реестр медиафайлов.
+
+    group — поля строки media_group_journal (journal_id, media_group_id,
+    request_id, session_id, user_id, user_name, username).
+    Возвращает MEDIA_NEW, MEDIA_REDELIVERED, если это сообщение уже есть в
+    журнале (повторная доставка), или MEDIA_DUPLICATE, если тот же файл уже
+    присылали в рамках запроса: такой элемент в журнал не записывается.
+    При dedupe=False (медиа специалиста) повторы не отбрасываются.
+    """
+    with get_db_connection() as conn:
+        if conn.execute(
+            "SELECT 1 FROM media_group_items WHERE chat_id = ? AND message_id = ?",
+            (chat_id, message_id)
+        ).fetchone():
+            return MEDIA_REDELIVERED
+        if file_unique_id:
+            duplicate = dedupe and is_duplicate_media(conn, group['request_id'], group['user_id'], file_unique_id)
+            conn.execute(
+                """INSERT INTO media_files (file_unique_id, media_type, file_id, file_size, received, duplicates)
+                   VALUES (?, ?, ?, ?, 1, ?)
+                   ON CONFLICT (file_unique_id) DO UPDATE SET
+                       received = received + 1,
+                       duplicates = duplicates + excluded.duplicates,
+                       file_size = COALESCE(file_size, excluded.file_size)""",
+                (file_unique_id, media_type, file_id, file_size, int(duplicate))
+            )
+            if duplicate:
+                conn.commit()
+                return MEDIA_DUPLICATE
+        conn.execute(
+            """INSERT OR IGNORE INTO media_group_journal
+               (journal_id, media_group_id, request_id, session_id, user_id, user_name, username)
+               VALUES (:journal_id, :media_group_id, :request_id, :session_id, :user_id, :user_name, :username)""",
+            group
+        )
+        if caption:
+            conn.execute(
+                "UPDATE media_group_journal SET caption = COALESCE(caption, ?) WHERE journal_id = ?",
+                (caption, group['journal_id'])
+            )
+        conn.execute(
+            """INSERT INTO media_group_items (chat_id, message_id, journal_id, media_type, file_id, file_unique_id)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (chat_id, message_id, group['journal_id'], media_type, file_id, file_unique_id)
+        )
+        conn.commit()
+        return MEDIA_NEW
+
+def is_duplicate_media(conn: sqlite3.Connection, request_id: int, sender_id: int, file_unique_id: str) -> bool:
+    """Присылал ли отправитель этот файл в рамках запроса: в истории или в ещё не сохранённых группах.
+
+    Файлы сравниваются только у одного отправителя: специалист может
+    отправить пользователю ту же фотографию, что прислал пользователь.
+    """
+    if conn.execute(
+        """SELECT 1 FROM session_messages
+           WHERE request_id = ? AND file_unique_id = ? AND sender_id = ? LIMIT 1""",
+        (request_id, file_unique_id, sender_id)
+    ).fetchone():
+        return True
+    return conn.execute(
+        """SELECT 1 FROM media_group_items i
+           JOIN media_group_journal j ON j.journal_id = i.journal_id
+           WHERE i.file_unique_id = ? AND j.request_id = ? AND j.user_id = ? LIMIT 1""",
+        (file_unique_id, request_id, sender_id)
+    ).fetchone() is not None
+
+def get_media_group_items(journal_id: str) -> List[tuple]:
+    """Элементы группы из журнала: (message_id, media_type, file_id, file_unique_id)"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT message_id, media_type, file_id, file_unique_id FROM media_group_items
+               WHERE journal_id = ? ORDER BY message_id""",
+            (journal_id,)
+        )
+        return [tuple(row) for row in cursor.fetchall()]
+
+def get_stats(hourly_since: str, daily_since: str) -> Dict[str, List[Dict]]:
+    """Строки сводной статистики: по часам начиная с hourly_since и по дням с daily_since.
+
+    Ключи периодов — в формате STATS_TABLES, время UTC.
+    """
+    with get_db_connection() as conn:
+        return {
+            'hourly': [dict(row) for row in conn.execute(
+                "SELECT * FROM stats_hourly WHERE bucket >= ? ORDER BY bucket", (hourly_since,)
+            )],
+            'daily': [dict(row) for row in conn.execute(
+                "SELECT * FROM stats_daily WHERE bucket >= ? ORDER BY bucket", (daily_since,)
+            )],
+        }
+
+def get_media_stats() -> Dict:
+    """Сводка реестра медиафайлов: сколько файлов, копий и байт сэкономлено на повторах"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            """SELECT COUNT(*) AS files,
+                      COALESCE(SUM(received), 0) AS received,
+                      COALESCE(SUM(duplicates), 0) AS duplicates,
+                      COALESCE(SUM(file_size), 0) AS stored_bytes,
+                      COALESCE(SUM(file_size * duplicates), 0) AS saved_bytes,
+                      (SELECT COUNT(*) FROM media_blobs) AS mirrored_files,
+                      (SELECT COALESCE(SUM(size), 0) FROM media_blobs) AS mirrored_bytes,
+                      COALESCE(SUM(mirror_status IS NULL), 0) AS mirror_pending
+               FROM media_files"""
+        ).fetchone()
+        return dict(row)
+
+def get_unmirrored_media(limit: int = 50) -> List[Dict]:
+    """Файлы реестра, которых ещё нет в локальной копии, в порядке получения"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT file_unique_id, file_id, file_size, mirror_attempts FROM media_files
+               WHERE mirror_status IS NULL ORDER BY first_seen LIMIT ?""",
+            (limit,)
+        )
+        return [dict(row) for row in cursor]
+
+def store_media_blob(file_unique_id: str, sha256: str, size: int) -> bool:
+    """Отмечает файл скачанным в хранилище под именем sha256.
+
+    Возвращает True, если такое содержимое уже было в хранилище.
+    """
+    with get_db_connection() as conn:
+        existed = conn.execute(
+            "SELECT 1 FROM media_blobs WHERE sha256 = ?", (sha256,)
+        ).fetchone() is not None
+        conn.execute(
+            """INSERT INTO media_blobs (sha256, size) VALUES (?, ?)
+               ON CONFLICT (sha256) DO UPDATE SET last_access = excluded.last_access""",
+            (sha256, size)
+        )
+        conn.execute(
+            "UPDATE media_files SET mirror_status = 'stored', sha256 = ? WHERE file_unique_id = ?",
+            (sha256, file_unique_id)
+        )
+        conn.commit()
+        return existed
+
+def fail_media_mirror(file_unique_id: str, max_attempts: int) -> bool:
+    """Учитывает неудачную попытку скачать файл; после max_attempts попыток
+    файл отмечается 'failed' и больше не скачивается. Возвращает True в этом случае.
+    """
+    with get_db_connection() as conn:
+        conn.execute(
+            """UPDATE media_files SET mirror_attempts = mirror_attempts + 1,
+                      mirror_status = CASE WHEN mirror_attempts + 1 >= ? THEN 'failed' END
+               WHERE file_unique_id = ?""",
+            (max_attempts, file_unique_id)
+        )
+        row = conn.execute(
+            "SELECT mirror_status FROM media_files WHERE file_unique_id = ?", (file_unique_id,)
+        ).fetchone()
+        conn.commit()
+        return row is not None and row['mirror_status'] == 'failed'
+
+def touch_media_blob(file_unique_id: str) -> Optional[str]:
+    """sha256 файла в локальной копии (None, если его там нет); отмечает обращение к нему"""
+    with get_db_connection() as conn:
+        row = conn.execute(
+            "SELECT sha256 FROM media_files WHERE file_unique_id = ? AND mirror_status = 'stored'",
+            (file_unique_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE media_blobs SET last_access = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE sha256 = ?",
+            (row['sha256'],)
+        )
+        conn.commit()
+        return row['sha256']
+
+def evict_media_blobs(max_bytes: int) -> tuple:
+    """Убирает из реестра файлы, к которым дольше всего не обращались, пока
+    объём хранилища больше max_bytes.
+
+    Возвращает (список sha256 вытесненных файлов, объём оставшихся); сами
+    файлы удаляет вызывающий код.
+    """
+    with get_db_connection() as conn:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media_blobs").fetchone()[0]
+        evicted = []
+        if total > max_bytes:
+            for row in conn.execute("SELECT sha256, size FROM media_blobs ORDER BY last_access"):
+                if total <= max_bytes:
+                    break
+                evicted.append((row['sha256'],))
+                total -= row['size']
+            conn.executemany("DELETE FROM media_blobs WHERE sha256 = ?", evicted)
+            conn.executemany(
+                """UPDATE media_files SET mirror_status = 'evicted'
+                   WHERE sha256 = ? AND mirror_status = 'stored'""",
+                evicted
+            )
+            conn.commit()
+        return [sha256 for sha256, in evicted], total
+
+def mark_media_group_sent(journal_id: str):
+    """Отмечает, что Bot API подтвердил отправку медиа-группы"""
+    with get_db_connection() as conn:
+        conn.execute(
+            "UPDATE media_group_journal SET state = 'sent' WHERE journal_id = ?",
+            (journal_id,)
+        )
         conn.commit()
 
+def complete_media_group(journal_id: str, rows: List[tuple]):
+    """Сохраняет медиа-группу в session_messages и закрывает её в журнале одной транзакцией.
+
+    Строки rows — как в add_messages и дополнительно file_unique_id.
+    """
+    with get_db_connection() as conn:
+        conn.executemany(
+            """INSERT INTO session_messages 
+               (session_id, request_id, sender_id, message_text, media_type, media_id, file_unique_id) 
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            rows
+        )
+        _record_first_replies(conn, [(row[0], row[2]) for row in rows])
+        conn.execute(
+            "UPDATE media_group_journal SET state = 'done' WHERE journal_id = ?",
+            (journal_id,)
+        )
+        conn.commit()
+
+def get_unfinished_media_groups() -> List[Dict]:
+    """Возвращает необработанные группы журнала (open и sent) с элементами"""
+    with get_db_connection() as conn:
+        groups: Dict[str, Dict] = {}
+        for state in ('open', 'sent'):
+            for row in conn.execute(
+                """SELECT j.*, i.chat_id, i.message_id, i.media_type, i.file_id, i.file_unique_id
+                   FROM media_group_journal j
+                   JOIN media_group_items i ON i.journal_id = j.journal_id
+                   WHERE j.state = ?
+                   ORDER BY j.created_at, j.journal_id, i.message_id""",
+                (state,)
+            ):
+                group = groups.get(row['journal_id'])
+                if group is None:
+                    group = groups[row['journal_id']] = {
+                        key: row[key] for key in (
+                            'journal_id', 'media_group_id', 'request_id', 'session_id', 'user_id',
+                            'user_name', 'username', 'caption', 'state', 'created_at'
+                        )
+                    }
+                    group['items'] = []
+                group['items'].append((row['message_id'], row['media_type'], row['file_id'], row['file_unique_id']))
+        return list(groups.values())
+
+def purge_media_journal(before: str) -> int:
+    """Удаляет из журнала группы, созданные раньше before: обработанные и
+    так и не отправленные. Возвращает число удалённых необработанных групп."""
+    with get_db_connection() as conn:
+        stale = conn.execute(
+            """SELECT COUNT(*) FROM media_group_journal
+               WHERE state IN ('open', 'sent') AND created_at < ?""",
+            (before,)
+        ).fetchone()[0]
+        for state in ('done', 'open', 'sent'):
+            conn.execute(
+                """DELETE FROM media_group_items WHERE journal_id IN (
+                       SELECT journal_id FROM media_group_journal WHERE state = ? AND created_at < ?)""",
+                (state, before)
+            )
+            conn.execute(
+                "DELETE FROM media_group_journal WHERE state = ? AND created_at < ?",
+                (state, before)
+            )
+        conn.commit()
+        return stale
+
 def get_messages_for_request(request_id: int) -> List[Dict]:
     """Возвращает все сообщения для запроса"""
     with get_db_connection() as conn:
@@ -189,4 +1065,283 @@ def get_messages_for_request(request_id: int) -> List[Dict]:
             "SELECT * FROM session_messages WHERE request_id = ? ORDER BY sent_at ASC",
             (request_id,)
         )
-        return [dict(row) for row in cursor.fetchall()]
\ No newline at end of file
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_messages_page(request_id: int, after: Optional[tuple] = None, limit: int = 200) -> List[Dict]:
+    """Возвращает следующую порцию сообщений запроса в хронологическом порядке.
+
+    after — (sent_at, message_id) последнего сообщения предыдущей порции.
+    """
+    with get_db_connection() as conn:
+        if after is None:
+            cursor = conn.execute(
+                """SELECT * FROM session_messages WHERE request_id = ?
+                   ORDER BY sent_at, message_id LIMIT ?""",
+                (request_id, limit)
+            )
+        else:
+            cursor = conn.execute(
+                """SELECT * FROM session_messages
+                   WHERE request_id = ? AND (sent_at, message_id) > (?, ?)
+                   ORDER BY sent_at, message_id LIMIT ?""",
+                (request_id, after[0], after[1], limit)
+            )
+        return [dict(row) for row in cursor.fetchall()]
+
+def get_export_page(after: Optional[tuple] = None, request_id: Optional[int] = None,
+                    since: Optional[str] = None, until: Optional[str] = None,
+                    limit: int = 500) -> List[Dict]:
+    """Возвращает порцию сообщений для выгрузки вместе с данными запроса.
+
+    Сообщения отбираются по запросу request_id или по периоду
+    since <= sent_at < until и идут в порядке (sent_at, message_id);
+    after — ключ последнего сообщения предыдущей порции.
+    """
+    conditions, params = [], []
+    if request_id is not None:
+        conditions.append("m.request_id = ?")
+        params.append(request_id)
+    if since is not None:
+        conditions.append("m.sent_at >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("m.sent_at < ?")
+        params.append(until)
+    if after is not None:
+        conditions.append("(m.sent_at, m.message_id) > (?, ?)")
+        params.extend(after)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            f"""SELECT m.message_id, m.request_id, m.session_id, m.sender_id, m.sent_at,
+                       m.message_text, m.media_type, m.media_id, f.sha256 AS media_sha256,
+                       r.user_id, r.user_name, r.username
+                FROM session_messages m
+                LEFT JOIN user_requests r ON r.request_id = m.request_id
+                LEFT JOIN media_files f ON f.file_unique_id = m.file_unique_id
+                {where}
+                ORDER BY m.sent_at, m.message_id LIMIT ?""",
+            params + [limit]
+        )
+        return [dict(row) for row in cursor]
+
+def fts_query(text: str) -> str:
+    """Превращает строку поиска в запрос FTS5.
+
+    Каждое слово берётся в кавычки (артикулы вроде 12.00R20 или 6CT-8.3
+    ищутся как фраза, а не разбираются как синтаксис FTS5) и ищется по
+    префиксу; все слова должны встретиться в сообщении.
+    """
+    terms = ['"' + term.replace('"', '""') + '"*' for term in text.split()]
+    return " ".join(terms)
+
+def search_messages(query: str, limit: int = 10, after: Optional[tuple] = None,
+                    before: Optional[tuple] = None) -> List[Dict]:
+    """Ищет сообщения по тексту, лучшие совпадения (bm25) первыми.
+
+    Страницы строятся по ключу (rank, message_id), как в
+    get_pending_requests_page: after — ключ последней строки предыдущей
+    страницы, before — первой строки следующей (листание назад), поэтому
+    дальние страницы не перебирают заново все предыдущие совпадения.
+    Возвращает до limit + 1 строк: лишняя строка означает, что в этом
+    направлении есть ещё страница. В snippet найденные слова обрамлены
+    символами \x02 и \x03.
+    """
+    match = fts_query(query)
+    if not match:
+        return []
+    if before is not None:
+        condition, order, key = "AND (f.rank, f.rowid) < (?, ?)", "DESC", before
+    elif after is not None:
+        condition, order, key = "AND (f.rank, f.rowid) > (?, ?)", "", after
+    else:
+        condition, order, key = "", "", ()
+    with get_db_connection() as conn:
+        # rank в FTS5 по умолчанию — bm25(); сортировка по нему выполняется внутри индекса
+        cursor = conn.execute(
+            f"""SELECT m.message_id, m.request_id, m.sender_id, m.sent_at, f.rank,
+                       snippet(session_messages_fts, 0, char(2), char(3), '…', 16) AS snippet,
+                       r.user_id, r.user_name, r.username, r.status
+                FROM session_messages_fts f
+                JOIN session_messages m ON m.message_id = f.rowid
+                LEFT JOIN user_requests r ON r.request_id = m.request_id
+                WHERE session_messages_fts MATCH ? {condition}
+                ORDER BY f.rank {order}, f.rowid {order} LIMIT ?""",
+            (match, *key, limit + 1)
+        )
+        rows = [dict(row) for row in cursor.fetchall()]
+        return rows[::-1] if before is not None else rows
+
+def get_request(request_id: int) -> Optional[Dict]:
+    """Возвращает запрос по идентификатору"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT request_id, user_id, user_name, username, status, specialist_id
+               FROM user_requests WHERE request_id = ?""",
+            (request_id,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def get_requests(request_ids: List[int]) -> Dict[int, Dict]:
+    """Возвращает запросы по идентификаторам: request_id -> запрос"""
+    if not request_ids:
+        return {}
+    placeholders = ",".join("?" * len(request_ids))
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            f"""SELECT request_id, user_id, user_name, username, status FROM user_requests
+                WHERE request_id IN ({placeholders})""",
+            list(request_ids)
+        )
+        return {row['request_id']: dict(row) for row in cursor.fetchall()}
+
+def get_session_info(session_id: int) -> Optional[Dict]:
+    """Возвращает сессию с данными пользователя по идентификатору сессии"""
+    with get_db_connection() as conn:
+        cursor = conn.execute(
+            """SELECT s.session_id, s.request_id, s.admin_id, r.user_id, r.user_name, r.username 
+               FROM active_sessions s
+               JOIN user_requests r ON s.request_id = r.request_id
+               WHERE s.session_id = ?""",
+            (session_id,)
+        )
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+def delete_request(request_id: int) -> bool:
+    """Удаляет (отклоняет) ожидающий запрос; False, если его уже приняли или удалили"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM user_requests WHERE request_id = ? AND status = 'pending'",
+            (request_id,)
+        )
+        deleted = cursor.rowcount > 0
+        if deleted:
+            _bump_stats(conn, rejected=1)
+            conn.execute(
+                """DELETE FROM media_group_items WHERE journal_id IN (
+                       SELECT journal_id FROM media_group_journal WHERE request_id = ?)""",
+                (request_id,)
+            )
+            conn.execute("DELETE FROM media_group_journal WHERE request_id = ?", (request_id,))
+        conn.commit()
+        return deleted
+
+def reset_active_sessions():
+    """Завершает все активные сессии и возвращает запросы в очередь"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM active_sessions")
+        conn.execute("DELETE FROM specialist_state")
+        conn.execute("DELETE FROM relayed_messages")
+        conn.execute("UPDATE user_requests SET status = 'pending' WHERE status = 'in_progress'")
+        _close_open_session_history(conn)
+        conn.commit()
+
+def clear_all_requests():
+    """Удаляет все запросы, сессии и сообщения"""
+    with get_db_connection() as conn:
+        conn.execute("DELETE FROM user_requests")
+        conn.execute("DELETE FROM active_sessions")
+        conn.execute("DELETE FROM specialist_state")
+        conn.execute("DELETE FROM relayed_messages")
+        conn.execute("DELETE FROM session_messages")
+        conn.execute("DELETE FROM media_group_items")
+        conn.execute("DELETE FROM media_group_journal")
+        _close_open_session_history(conn)
+        conn.commit()
+
+def _attach_archive(conn: sqlite3.Connection):
+    """Подключает архивную базу к соединению как схему archive"""
+    if any(row['name'] == 'archive' for row in conn.execute("PRAGMA database_list")):
+        return
+    path = ARCHIVE_DB_FILE or os.path.splitext(DB_FILE)[0] + "_archive.db"
+    conn.execute("ATTACH DATABASE ? AS archive", (path,))
+    conn.execute("PRAGMA archive.journal_mode=WAL")
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS archive.archived_requests (
+               request_id INTEGER PRIMARY KEY,
+               user_id INTEGER NOT NULL,
+               completed_at TIMESTAMP,
+               archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               payload BLOB NOT NULL  -- zlib(JSON запроса и его сообщений)
+           )"""
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS archive.idx_archived_requests_user ON archived_requests (user_id)"
+    )
+    conn.commit()
+
+def archive_completed_requests(cutoff: str, batch_size: int = 50) -> int:
+    """Переносит в архив одну порцию запросов, завершённых раньше cutoff.
+
+    Запрос и его сообщения сохраняются сжатым JSON в архивной базе. В
+    режиме WAL фиксация сразу двух подключённых баз не атомарна, поэтому
+    сначала фиксируется архив (INSERT OR REPLACE — повтор после сбоя
+    безопасен), а затем отдельной транзакцией из рабочих таблиц удаляются
+    только запросы, которые есть в архиве.
+    Возвращает число перенесённых запросов; 0 — переносить больше нечего.
+    """
+    with get_db_connection() as conn:
+        _attach_archive(conn)
+        requests = [dict(row) for row in conn.execute(
+            """SELECT * FROM user_requests
+               WHERE status = 'completed' AND completed_at < ?
+               ORDER BY completed_at, request_id LIMIT ?""",
+            (cutoff, batch_size)
+        )]
+        if not requests:
+            return 0
+
+        ids = [req['request_id'] for req in requests]
+        placeholders = ",".join("?" * len(ids))
+        messages: Dict[int, List[Dict]] = {request_id: [] for request_id in ids}
+        for row in conn.execute(
+            f"""SELECT * FROM session_messages WHERE request_id IN ({placeholders})
+                ORDER BY request_id, sent_at, message_id""",
+            ids
+        ):
+            messages[row['request_id']].append(dict(row))
+
+        conn.executemany(
+            """INSERT OR REPLACE INTO archive.archived_requests
+               (request_id, user_id, completed_at, payload) VALUES (?, ?, ?, ?)""",
+            [
+                (req['request_id'], req['user_id'], req['completed_at'],
+                 zlib.compress(json.dumps(
+                     {"request": req, "messages": messages[req['request_id']]},
+                     ensure_ascii=False
+                 ).encode("utf-8")))
+                for req in requests
+            ]
+        )
+        conn.commit()
+
+        archived = [row['request_id'] for row in conn.execute(
+            f"SELECT request_id FROM archive.archived_requests WHERE request_id IN ({placeholders})",
+            ids
+        )]
+        if not archived:
+            return 0
+        placeholders = ",".join("?" * len(archived))
+        conn.execute(f"DELETE FROM session_messages WHERE request_id IN ({placeholders})", archived)
+        conn.execute(f"DELETE FROM user_requests WHERE request_id IN ({placeholders})", archived)
+        conn.commit()
+        return len(archived)
+
+def get_archived_request(request_id: int) -> Optional[Dict]:
+    """Возвращает архивный запрос с сообщениями: {"request": ..., "messages": [...]}"""
+    with get_db_connection() as conn:
+        _attach_archive(conn)
+        row = conn.execute(
+            "SELECT payload FROM archive.archived_requests WHERE request_id = ?",
+            (request_id,)
+        ).fetchone()
+        return json.loads(zlib.decompress(row['payload'])) if row else None
+
+def incremental_vacuum(pages: int = 500) -> int:
+    """Возвращает системе до pages свободных страниц; возвращает остаток свободных страниц"""
+    with get_db_connection() as conn:
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
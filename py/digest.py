@@ -0,0 +1,198 @@
+"""Объединение уведомлений специалистам.
+
+Сводка новых запросов (RequestDigests): запросы, пришедшие в чат
+специалиста в течение DIGEST_WINDOW_SECONDS, собираются в одно сообщение,
+которое обновляется на месте через edit_message_text не чаще раза в
+DIGEST_EDIT_INTERVAL_SECONDS. Сводка показывает состояние запросов из БД,
+поэтому после принятия или отклонения запроса её может перерисовать любой
+процесс: список запросов восстанавливается по номерам в тексте сообщения.
+
+Объединение текстов (TextCoalescer): первый текст пользователя в
+активной сессии пересылается специалисту сразу, а тексты, пришедшие в
+следующие COALESCE_TEXT_SECONDS, — одним сообщением в конце этого
+окна. Каждый текст по-прежнему сохраняется в историю отдельно.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Callable, Dict, List, Optional
+
+from async_db import get_requests
+from keyboards import get_request_digest_keyboard
+from sender import outbound
+from config import (
+    DIGEST_WINDOW_SECONDS, DIGEST_EDIT_INTERVAL_SECONDS, DIGEST_MAX_ITEMS,
+    COALESCE_TEXT_SECONDS, COALESCE_MAX_CHARS
+)
+
+logger = logging.getLogger(__name__)
+
+# Номер запроса в строке сводки ("🕐 #42 ...") или в одиночном уведомлении ("... (#42) от ...")
+REQUEST_NUMBER = re.compile(r"(?:^\S+ |на связь \()#(\d+)", re.MULTILINE)
+
+STATUS_MARKS = {'pending': "🕐", 'in_progress': "✅", 'completed': "✅"}
+
+def render_digest(request_ids: List[int], requests: Dict[int, Dict]):
+    """Текст и клавиатура сводки; requests — запросы из БД по request_id"""
+    pending = [requests[i] for i in request_ids if requests.get(i, {}).get('status') == 'pending']
+    if len(request_ids) == 1 and pending:
+        # Один запрос выглядит как обычное уведомление
+        req = pending[0]
+        text = f"📩 Новый запрос на связь (#{req['request_id']}) от {req['user_name']} (@{req['username'] or 'нет'})"
+        return text, get_request_digest_keyboard(pending)
+
+    lines = [f"📩 Новые запросы: {len(request_ids)}, ожидают ответа: {len(pending)}", ""]
+    for request_id in request_ids:
+        req = requests.get(request_id)
+        if req is None:
+            lines.append(f"❌ #{request_id} отклонён")
+        else:
+            mark = STATUS_MARKS.get(req['status'], "✅")
+            lines.append(f"{mark} #{request_id} {req['user_name']} (@{req['username'] or 'нет'})")
+    return "\n".join(lines), get_request_digest_keyboard(pending)
+
+class _Digest:
+    def __init__(self, chat_id: int, message_id: Optional[int] = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.opened_at = time.monotonic()
+        self.request_ids: List[int] = []
+        # Текст, который сейчас показан в чате
+        self.text: Optional[str] = None
+        self.dirty = False
+        self.task: Optional[asyncio.Task] = None
+
+class RequestDigests:
+    def __init__(self, window: float = DIGEST_WINDOW_SECONDS,
+                 edit_interval: float = DIGEST_EDIT_INTERVAL_SECONDS, max_items: int = DIGEST_MAX_ITEMS):
+        self.window = window
+        self.edit_interval = edit_interval
+        self.max_items = max_items
+        # Открытая сводка каждого чата: к ней добавляются новые запросы
+        self._open: Dict[int, _Digest] = {}
+        # Ссылки на задачи обновления, чтобы их не собрал GC
+        self._tasks = set()
+        self.edits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def add(self, chat_id: int, request_id: int):
+        """Добавляет запрос в открытую сводку чата или начинает новую"""
+        digest = self._open.get(chat_id)
+        if (digest is None or time.monotonic() - digest.opened_at >= self.window
+                or len(digest.request_ids) >= self.max_items):
+            digest = self._open[chat_id] = _Digest(chat_id)
+        digest.request_ids.append(request_id)
+        self._schedule(digest)
+
+    def refresh(self, chat_id: int, message_id: int, text: str):
+        """Перерисовывает сводку после того, как из неё приняли или отклонили запрос"""
+        digest = self._open.get(chat_id)
+        if digest is None or digest.message_id != message_id:
+            # Сводка закрыта или её отправил другой процесс
+            digest = _Digest(chat_id, message_id)
+            digest.text = text
+            digest.request_ids = [int(number) for number in REQUEST_NUMBER.findall(text or "")]
+            if not digest.request_ids:
+                return
+        self._schedule(digest)
+
+    def _schedule(self, digest: _Digest):
+        digest.dirty = True
+        if digest.task is None:
+            digest.task = asyncio.create_task(self._render(digest))
+            self._tasks.add(digest.task)
+            digest.task.add_done_callback(self._tasks.discard)
+
+    async def _render(self, digest: _Digest):
+        try:
+            while digest.dirty:
+                digest.dirty = False
+                text, markup = render_digest(digest.request_ids, await get_requests(digest.request_ids))
+                if text != digest.text:
+                    if digest.message_id is None:
+                        message = await outbound.send_message(digest.chat_id, text, reply_markup=markup)
+                        digest.message_id = message.message_id
+                    else:
+                        await outbound.submit(digest.chat_id, 'edit_message_text', message_id=digest.message_id,
+                                              text=text, reply_markup=markup)
+                        self.edits += 1
+                    digest.text = text
+                if digest.dirty:
+                    # Запросы, пришедшие за это время, попадут в одно обновление
+                    await asyncio.sleep(self.edit_interval)
+        except Exception as e:
+            logger.error(f"Ошибка обновления сводки запросов в чате {digest.chat_id}: {e}")
+        finally:
+            digest.task = None
+
+class _TextBundle:
+    def __init__(self, session: Dict, user_name: str):
+        self.session = session
+        self.user_name = user_name
+        self.texts: List[str] = []
+        self.size = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class TextCoalescer:
+    """Передаёт тексты пользователя send(session, user_name, text): первый
+    сразу, а пришедшие после него в течение delay секунд — одним сообщением"""
+
+    # Сколько сессий помнить, прежде чем забыть те, чьё окно уже закрылось
+    MAX_TRACKED_SESSIONS = 1000
+
+    def __init__(self, send: Callable, delay: float = COALESCE_TEXT_SECONDS,
+                 max_chars: int = COALESCE_MAX_CHARS):
+        self.send = send
+        self.delay = delay
+        self.max_chars = max_chars
+        self._bundles: Dict[int, _TextBundle] = {}
+        # session_id -> момент (time.monotonic), до которого тексты объединяются
+        self._window_ends: Dict[int, float] = {}
+        self.merged = 0
+
+    def add(self, session: Dict, user_name: str, text: str):
+        if self.delay <= 0:
+            self.send(session, user_name, text)
+            return
+        session_id = session['session_id']
+        now = time.monotonic()
+        bundle = self._bundles.get(session_id)
+        if bundle is not None and bundle.size + len(text) + 1 > self.max_chars:
+            self.flush(session_id)
+            bundle = None
+        if bundle is None:
+            window_end = self._window_ends.get(session_id, 0)
+            if now >= window_end:
+                # Первый текст после паузы уходит без задержки
+                self._send(session, user_name, text, now)
+                return
+            bundle = self._bundles[session_id] = _TextBundle(session, user_name)
+            bundle.timer = asyncio.get_running_loop().call_later(window_end - now, self.flush, session_id)
+        self.merged += 1
+        bundle.texts.append(text)
+        bundle.size += len(text) + 1
+
+    def _send(self, session: Dict, user_name: str, text: str, now: float):
+        if len(self._window_ends) >= self.MAX_TRACKED_SESSIONS:
+            self._window_ends = {key: end for key, end in self._window_ends.items() if end > now}
+        self._window_ends[session['session_id']] = now + self.delay
+        self.send(session, user_name, text)
+
+    def flush(self, session_id: int):
+        """Отправляет накопленные тексты сессии сразу"""
+        bundle = self._bundles.pop(session_id, None)
+        if bundle is None:
+            return
+        if bundle.timer is not None:
+            bundle.timer.cancel()
+        self._send(bundle.session, bundle.user_name, "\n".join(bundle.texts), time.monotonic())
+
+    def flush_all(self):
+        for session_id in list(self._bundles):
+            self.flush(session_id)
+
+request_digests = RequestDigests()
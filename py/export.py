@@ -0,0 +1,122 @@
+"""Выгрузка переписки в файл.
+
+Сообщения читаются из БД порциями (async_db.iter_export_rows) и сразу
+пишутся во временный файл SpooledTemporaryFile: небольшая выгрузка
+остаётся в памяти, большая уходит на диск. Поддерживаются форматы
+JSONL, CSV и HTML (одна страница с перепиской).
+"""
+import csv
+import html
+import json
+import tempfile
+from typing import Dict, Optional
+
+from async_db import iter_export_rows
+from config import EXPORT_SPOOL_BYTES
+
+EXPORT_FORMATS = ('html', 'jsonl', 'csv')
+
+EXPORT_COLUMNS = (
+    'request_id', 'user_id', 'user_name', 'username', 'session_id', 'message_id',
+    'sender_id', 'sent_at', 'message_text', 'media_type', 'media_id', 'media_sha256'
+)
+
+HTML_HEAD = """<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 860px; margin: 2em auto; color: #222; }}
+h2 {{ border-bottom: 1px solid #ccc; padding-bottom: .3em; margin-top: 2em; }}
+.msg {{ margin: .4em 0; padding: .4em .7em; border-radius: 6px; background: #f1f1f1; }}
+.msg.specialist {{ background: #e3f0ff; }}
+.meta {{ font-size: .8em; color: #777; }}
+.text {{ white-space: pre-wrap; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+class _TextSink:
+    """Пишет строки в двоичный временный файл в UTF-8 (нужно для csv.writer)"""
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, text: str):
+        self.file.write(text.encode('utf-8'))
+
+class TranscriptWriter:
+    """Записывает строки выгрузки в выбранном формате"""
+
+    def __init__(self, file, fmt: str, title: str):
+        self.sink = _TextSink(file)
+        self.fmt = fmt
+        self.title = title
+        self.rows = 0
+        self._request_id = None
+        self._csv = None
+
+    def begin(self):
+        if self.fmt == 'csv':
+            # BOM, чтобы Excel открыл кириллицу без вопросов о кодировке
+            self.sink.write('\ufeff')
+            self._csv = csv.writer(self.sink)
+            self._csv.writerow(EXPORT_COLUMNS)
+        elif self.fmt == 'html':
+            self.sink.write(HTML_HEAD.format(title=html.escape(self.title)))
+
+    def write(self, row: Dict):
+        self.rows += 1
+        if self.fmt == 'jsonl':
+            self.sink.write(json.dumps({key: row[key] for key in EXPORT_COLUMNS}, ensure_ascii=False) + '\n')
+        elif self.fmt == 'csv':
+            self._csv.writerow([row[key] for key in EXPORT_COLUMNS])
+        else:
+            self._write_html(row)
+
+    def _write_html(self, row: Dict):
+        if row['request_id'] != self._request_id:
+            self._request_id = row['request_id']
+            user = html.escape(row['user_name'] or str(row['user_id']))
+            self.sink.write(
+                f"<h2>Запрос #{row['request_id']} — {user} (@{html.escape(row['username'] or 'нет')})</h2>\n"
+            )
+        from_user = row['sender_id'] == row['user_id']
+        author = html.escape(row['user_name'] or 'Пользователь') if from_user else 'Специалист'
+        text = html.escape(row['message_text'] or '')
+        if row['media_type']:
+            text = f"[{html.escape(row['media_type'])}] {text}"
+        self.sink.write(
+            f'<div class="msg{"" if from_user else " specialist"}">'
+            f'<div class="meta">{author} · {html.escape(str(row["sent_at"]))}</div>'
+            f'<div class="text">{text}</div></div>\n'
+        )
+
+    def end(self):
+        if self.fmt == 'html':
+            if not self.rows:
+                self.sink.write("<p>Сообщений нет.</p>\n")
+            self.sink.write("</body>\n</html>\n")
+
+async def export_transcript(fmt: str, title: str, request_id: Optional[int] = None,
+                            since: Optional[str] = None, until: Optional[str] = None):
+    """Выгружает сообщения во временный файл.
+
+    Возвращает (файл, число сообщений); файл открыт и перемотан в начало,
+    закрыть его должен вызывающий код.
+    """
+    file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode='w+b')
+    try:
+        writer = TranscriptWriter(file, fmt, title)
+        writer.begin()
+        async for row in iter_export_rows(request_id=request_id, since=since, until=until):
+            writer.write(row)
+        writer.end()
+        file.seek(0)
+    except Exception:
+        file.close()
+        raise
+    return file, writer.rows
@@ -0,0 +1,184 @@
+"""Ограничение частоты входящих сообщений пользователя.
+
+У каждого пользователя своё ведро токенов (sender.TokenBucket): текст
+обрабатывается сразу, если в ведре есть токен. Тексты сверх лимита не
+отбрасываются, а копятся и, когда ведро наполнится, обрабатываются одним
+сообщением — одна запись в БД и одна пересылка вместо сотни. Пока у
+пользователя есть задержанные тексты, новые встают за ними, поэтому
+порядок сообщений сохраняется. Пользователь получает короткое
+предупреждение не чаще раза в FLOOD_NOTICE_SECONDS.
+
+Счётчики bot_flood_* — общие по всем пользователям, чтобы не плодить
+временные ряды; кто упирается в лимит, видно по предупреждениям в логе.
+Обработчики одного пользователя работают в одном процессе
+(shards.py), поэтому ведра хранятся в памяти процесса.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import Counter, register
+from sender import outbound, TokenBucket
+from config import (
+    FLOOD_RATE, FLOOD_BURST, FLOOD_NOTICE_SECONDS, FLOOD_MAX_HELD_CHARS, COALESCE_MAX_CHARS
+)
+
+logger = logging.getLogger(__name__)
+
+NOTICE_TEXT = (
+    "⏳ Вы отправляете сообщения слишком часто. Они не потеряются: "
+    "следующие сообщения будут переданы вместе через несколько секунд."
+)
+# Сколько ведер хранить, прежде чем удалить полные (давно молчавших пользователей)
+MAX_TRACKED_USERS = 10_000
+
+flood_held = register(Counter(
+    "bot_flood_held_messages_total", "Сообщения сверх лимита частоты, задержанные для объединения"))
+flood_dropped = register(Counter(
+    "bot_flood_dropped_messages_total", "Сообщения, отброшенные сверх FLOOD_MAX_HELD_CHARS"))
+flood_batches = register(Counter(
+    "bot_flood_batches_total", "Пачки задержанных сообщений, обработанные одним текстом"))
+
+class _HeldBatch:
+    def __init__(self, user, chat_id: int):
+        self.user = user
+        self.chat_id = chat_id
+        self.texts: List[str] = []
+        self.size = 0
+        self.dropped = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class FloodControl:
+    """Пропускает тексты пользователя с ограничением частоты и передаёт
+    задержанные функции deliver(user, chat_id, text) одним текстом"""
+
+    def __init__(self, deliver: Callable[..., Awaitable], rate: float = FLOOD_RATE,
+                 burst: float = FLOOD_BURST, notice_interval: float = FLOOD_NOTICE_SECONDS,
+                 max_held_chars: int = FLOOD_MAX_HELD_CHARS, max_chars: int = COALESCE_MAX_CHARS):
+        self.deliver = deliver
+        self.rate = rate
+        self.burst = burst
+        self.notice_interval = notice_interval
+        self.max_held_chars = max_held_chars
+        self.max_chars = max_chars
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._held: Dict[int, _HeldBatch] = {}
+        # Пачки, которые обрабатываются сейчас: новые тексты ждут их окончания
+        self._delivering: Dict[int, asyncio.Task] = {}
+        self._noticed: Dict[int, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._forget_idle(time.monotonic())
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _forget_idle(self, now: float):
+        for user_id, bucket in list(self._buckets.items()):
+            if bucket.delay(now, bucket.capacity) == 0 and user_id not in self._held:
+                del self._buckets[user_id]
+                self._noticed.pop(user_id, None)
+
+    def admit(self, user, chat_id: int, text: str) -> bool:
+        """True — текст нужно обработать сейчас; False — он задержан и будет обработан позже"""
+        if not self.enabled:
+            return True
+        user_id = user.id
+        batch = self._held.get(user_id)
+        if batch is None:
+            bucket = self._bucket(user_id)
+            if user_id not in self._delivering and bucket.delay(time.monotonic()) == 0:
+                bucket.take()
+                return True
+            batch = self._held[user_id] = _HeldBatch(user, chat_id)
+            if user_id not in self._delivering:
+                self._schedule(batch)
+            self._notify(user_id, chat_id)
+
+        if batch.size + len(text) > self.max_held_chars:
+            flood_dropped.inc()
+            # В лог — первое отброшенное сообщение пачки, итог — при её обработке
+            if not batch.dropped:
+                logger.warning(f"Пользователь {user_id}: задержано больше {self.max_held_chars} символов, "
+                               f"новые сообщения отбрасываются")
+            batch.dropped += 1
+            return False
+        batch.texts.append(text)
+        batch.size += len(text) + 1
+        flood_held.inc()
+        return False
+
+    def _notify(self, user_id: int, chat_id: int):
+        now = time.monotonic()
+        if now - self._noticed.get(user_id, float('-inf')) < self.notice_interval:
+            return
+        self._noticed[user_id] = now
+        logger.warning(f"Пользователь {user_id} превысил лимит частоты сообщений")
+        outbound.send_message(chat_id, NOTICE_TEXT)
+
+    def _schedule(self, batch: _HeldBatch):
+        delay = self._bucket(batch.user.id).delay(time.monotonic())
+        batch.timer = asyncio.get_running_loop().call_later(delay, self._release, batch.user.id)
+
+    def _release(self, user_id: int):
+        batch = self._held.pop(user_id, None)
+        if batch is None:
+            return
+        self._bucket(user_id).take()
+        task = self._delivering[user_id] = asyncio.create_task(self._deliver(batch))
+        task.add_done_callback(lambda _: self._delivered(user_id, task))
+
+    def _delivered(self, user_id: int, task: asyncio.Task):
+        if self._delivering.get(user_id) is task:
+            del self._delivering[user_id]
+        # Тексты, пришедшие во время обработки, ждут следующего токена
+        batch = self._held.get(user_id)
+        if batch is not None and batch.timer is None:
+            self._schedule(batch)
+
+    async def _deliver(self, batch: _HeldBatch):
+        """Обрабатывает пачку частями не длиннее max_chars"""
+        flood_batches.inc()
+        if batch.dropped:
+            logger.warning(f"Пользователь {batch.user.id}: отброшено сообщений сверх лимита: {batch.dropped}")
+        parts, part, size = [], [], 0
+        for text in batch.texts:
+            if part and size + len(text) + 1 > self.max_chars:
+                parts.append(part)
+                part, size = [], 0
+            part.append(text)
+            size += len(text) + 1
+        parts.append(part)
+        for part in parts:
+            try:
+                await self.deliver(batch.user, batch.chat_id, "\n".join(part))
+            except Exception as e:
+                logger.error(f"Ошибка обработки задержанных сообщений пользователя {batch.user.id}: {e}")
+
+    async def flush(self, user_id: int):
+        """Сразу обрабатывает задержанные тексты пользователя (перед его медиа)"""
+        running = self._delivering.get(user_id)
+        if running is not None:
+            await asyncio.shield(running)
+        batch = self._held.pop(user_id, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        # Токен списывается в долг: следующий текст снова подождёт
+        self._bucket(user_id).take()
+        await self._deliver(batch)
+
+    async def flush_all(self):
+        for user_id in list(self._held):
+            await self.flush(user_id)
+
+    def limited_users(self) -> int:
+        return len(self._held)
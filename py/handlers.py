@@ -1,5 +1,8 @@
+import asyncio
+import html
 import logging
-from db import get_db_connection
+import secrets
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import Dict, Optional, List
 from telegram import (
@@ -10,47 +13,225 @@ from telegram import (
     Message,
     User,
     InlineKeyboardMarkup,
-    InlineKeyboardButton
+    InlineKeyboardButton,
+    InputFile
 )
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, CommandHandler, filters
-from db import (
-    add_user_request, get_pending_requests, get_user_active_request,
-    start_request_processing, create_session, end_session,
-    get_active_session_by_user, get_active_admin_session,
-    add_message_to_request, add_session_message, get_messages_for_request
+from async_db import (
+    add_user_request, get_pending_requests_page, get_user_active_request,
+    accept_request, end_session,
+    get_active_session_by_user, get_current_session, set_current_session,
+    get_specialist_loads, add_relayed_messages, get_session_by_reply,
+    get_request, get_session_info, delete_request, reset_active_sessions, search_messages,
+    clear_all_requests, message_buffer, journal_media_item, mark_media_group_sent,
+    complete_media_group, get_unfinished_media_groups, purge_media_journal,
+    get_media_group_items, get_media_stats
 )
+from db import MEDIA_REDELIVERED, MEDIA_DUPLICATE
 from keyboards import (
     get_main_menu_keyboard, 
     get_admin_request_keyboard,
     get_admin_session_keyboard,
-    get_admin_main_keyboard
+    get_admin_main_keyboard,
+    get_pending_requests_keyboard,
+    get_search_keyboard
+)
+from callbacks import CallbackRouter
+from sender import outbound, PRIORITY_HIGH
+from metrics import Gauge, register, instrument, media_duplicates, media_bytes_saved, media_sends_saved
+from state_cache import user_state
+from shards import shard_of
+from concurrency import update_processor
+from replay import replay_history
+from digest import TextCoalescer, request_digests
+from flood import FloodControl
+from media_mirror import media_mirror
+from analytics import build_stats_report
+from config import (
+    ADMIN_ID, SPECIALIST_IDS, WORKING_HOURS_TEXT, ALBUM_THRESHOLD_SECONDS, PENDING_PAGE_SIZE,
+    SEARCH_PAGE_SIZE, EXPORT_MAX_BYTES, EXPORT_DEFAULT_DAYS, MEDIA_JOURNAL_KEEP_HOURS,
+    SHARD_INDEX, SHARD_COUNT
 )
-from config import ADMIN_ID, WORKING_HOURS_TEXT, ALBUM_THRESHOLD_SECONDS
 
 logger = logging.getLogger(__name__)
 
-# Глобальные переменные для обработки медиа-групп
-user_media_groups = {}
+# Ссылки на фоновые задачи, чтобы их не собрал GC
+_background_tasks = set()
+
+def run_in_background(coro):
+    """Запускает корутину в фоне, не задерживая обработчик"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
 
 class MediaGroup:
-    def __init__(self, request_id: int, user_id: int, user_name: str, username: str, 
-                 caption: str = None, session_id: int = None):
+    def __init__(self, media_group_id: str, request_id: int, user_id: int, user_name: str, username: str, 
+                 caption: str = None, session_id: int = None, journal_id: str = None):
+        self.media_group_id = media_group_id
         self.request_id = request_id
         self.user_id = user_id
         self.user_name = user_name
         self.username = username
         self.caption = caption
         self.session_id = session_id
-        self.messages = []
-        self.created_at = datetime.now()
+        # Ключ группы в журнале; у каждого собранного альбома свой
+        self.journal_id = journal_id or secrets.token_hex(8)
+        # Элементы в компактном виде: (message_id, media_type, file_id, file_unique_id)
+        self.items: List[tuple] = []
+        # Сколько элементов отброшено как повторы уже присланных файлов
+        self.duplicates = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+    
+    def add_item(self, message_id: int, media_type: str, file_id: str, file_unique_id: Optional[str],
+                 caption: str = None):
+        self.items.append((message_id, media_type, file_id, file_unique_id))
+        if caption and not self.caption:
+            self.caption = caption
+    
+    def has_item(self, message_id: int) -> bool:
+        return any(item[0] == message_id for item in self.items)
     
-    def is_expired(self) -> bool:
-        return (datetime.now() - self.created_at).total_seconds() > ALBUM_THRESHOLD_SECONDS
+    def remove_item(self, message_id: int):
+        self.items = [item for item in self.items if item[0] != message_id]
+    
+    def journal_row(self) -> Dict:
+        """Поля группы для media_group_journal"""
+        return {
+            'journal_id': self.journal_id,
+            'media_group_id': self.media_group_id,
+            'request_id': self.request_id,
+            'session_id': self.session_id,
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'username': self.username,
+        }
+    
+    def schedule_flush(self, callback):
+        """Перезапускает таймер тишины: альбом отправится через
+        ALBUM_THRESHOLD_SECONDS после последнего полученного элемента"""
+        if self._timer is not None:
+            self._timer.cancel()
+        # call_later использует монотонные часы цикла событий
+        self._timer = asyncio.get_running_loop().call_later(ALBUM_THRESHOLD_SECONDS, callback)
+
+def media_item(message: Message) -> Optional[tuple]:
+    """(media_type, файл) медиа из сообщения"""
+    if message.photo:
+        return 'photo', message.photo[-1]
+    if message.video:
+        return 'video', message.video
+    if message.document:
+        return 'document', message.document
+    return None
+
+async def collect_media(message: Message, request_id: int, user_id: int, user_name: str,
+                        username: Optional[str], session_id: Optional[int] = None):
+    """Добавляет медиа в группу (одиночное медиа — группа из одного элемента)
+    и записывает его в журнал, чтобы альбом пережил перезапуск бота"""
+    media_group_id = message.media_group_id or f"single_{message.message_id}"
+    media_type, media_file = media_item(message)
+    
+    group = user_state.get_media_group(media_group_id)
+    if group is None:
+        group = MediaGroup(media_group_id, request_id, user_id, user_name, username, session_id=session_id)
+        user_state.put_media_group(media_group_id, group)
+    elif group.has_item(message.message_id):
+        # Повторная доставка элемента группы, восстановленной из журнала
+        return
+    # Элемент добавляется до записи в журнал: поток БД выполняет задачи по
+    # очереди, поэтому запись успеет раньше, чем обработка группы отметит её отправку
+    group.add_item(message.message_id, media_type, media_file.file_id, media_file.file_unique_id, message.caption)
+    schedule_media_group(media_group_id)
+    
+    try:
+        result = await journal_media_item(
+            group.journal_row(), message.chat_id, message.message_id, media_type, media_file.file_id,
+            message.caption, media_file.file_unique_id, media_file.file_size,
+            # Специалист может намеренно прислать файл ещё раз (например, по просьбе клиента)
+            dedupe=not is_specialist(user_id)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка записи медиа в журнал: {e}")
+        return
+    if result == MEDIA_REDELIVERED:
+        # Telegram повторно доставил уже обработанное сообщение
+        group.remove_item(message.message_id)
+    elif result == MEDIA_DUPLICATE:
+        # Этот файл уже присылали в рамках запроса: второй раз не пересылаем
+        group.remove_item(message.message_id)
+        group.duplicates += 1
+        media_duplicates.inc(media_type)
+        media_bytes_saved.inc(amount=media_file.file_size or 0)
+    else:
+        media_mirror.notify()
+
+def schedule_media_group(media_group_id: str):
+    """Запускает (или сдвигает) отправку медиа-группы по окончании паузы"""
+    user_state.get_media_group(media_group_id).schedule_flush(
+        lambda: run_in_background(process_media_group(media_group_id))
+    )
+
+def track_relayed(admin_id: int, session_id: int, deliveries: list):
+    """Запоминает сообщения, доставленные специалисту, когда их отправит планировщик"""
+    async def record():
+        message_ids = []
+        for delivery in deliveries:
+            try:
+                result = await delivery
+            except Exception:
+                continue
+            sent = result if isinstance(result, (list, tuple)) else [result]
+            message_ids.extend(m.message_id for m in sent)
+        if message_ids:
+            await add_relayed_messages(admin_id, message_ids, session_id)
     
-    def add_message(self, message):
-        self.messages.append(message)
-        if message.caption and not self.caption:
-            self.caption = message.caption
+    run_in_background(record())
+
+def forward_text(session: Dict, user_name: str, text: str):
+    """Пересылает специалисту текст пользователя (или несколько текстов подряд)"""
+    admin_id = session['admin_id'] or ADMIN_ID
+    delivery = outbound.send_message(
+        chat_id=admin_id,
+        text=f"👤 {user_name}:\n{text}",
+        reply_markup=get_admin_session_keyboard(session['session_id']),
+        priority=PRIORITY_HIGH
+    )
+    track_relayed(admin_id, session['session_id'], [delivery])
+
+# Тексты, пришедшие подряд, уходят специалисту одним сообщением
+text_bundles = TextCoalescer(forward_text)
+
+@asynccontextmanager
+async def start_session(admin_id: int, request_id: int):
+    """Начинает сессию по запросу и отдаёт (запрос, session_id) или None, если
+    его уже приняли.
+
+    Пока блок with не завершён, сообщения пользователя ждут: внутри него
+    специалисту отправляется подтверждение и история запроса, и новые
+    сообщения встанут в очередь отправки только после них.
+    """
+    request = await get_request(request_id)
+    if not request:
+        yield None
+        return
+    async with update_processor.hold(('user', request['user_id'])):
+        yield await accept_request(request_id, admin_id)
+
+def accepted_text(request: Dict) -> str:
+    return (
+        f"✅ Вы приняли запрос #{request['request_id']}\n"
+        f"Пользователь: {request['user_name']} (@{request['username'] or 'нет'})\n"
+        f"Теперь вы можете общаться с пользователем."
+    )
+
+async def notify_session_started(request: Dict, session_id: int, admin_id: int):
+    """Ставит в очередь историю запроса для специалиста и сообщает пользователю о начале сессии"""
+    track_relayed(admin_id, session_id, await replay_history(request, session_id, admin_id))
+    outbound.send_message(
+        chat_id=request['user_id'],
+        text="👨‍💼 Специалист готов вам помочь. Пожалуйста, опишите ваш вопрос."
+    )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -71,27 +252,235 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • 📢 Наш канал - акции, новости, поставки
 """
     
-    await update.message.reply_text(
+    outbound.send_message(
+        update.effective_chat.id,
         welcome_text,
         reply_markup=get_main_menu_keyboard(),
         parse_mode='HTML'
     )
 
+def is_specialist(user_id: int) -> bool:
+    """Проверяет, является ли пользователь специалистом"""
+    return user_id in SPECIALIST_IDS
+
+async def pick_specialist() -> int:
+    """Возвращает специалиста с наименьшим числом активных сессий"""
+    loads = await get_specialist_loads()
+    return min(SPECIALIST_IDS, key=lambda admin_id: loads.get(admin_id, 0))
+
+async def show_pending_requests(query, after: Optional[tuple] = None, before: Optional[tuple] = None):
+    """Показывает страницу ожидающих запросов вместо сообщения с кнопкой"""
+    requests = await get_pending_requests_page(after=after, before=before, limit=PENDING_PAGE_SIZE)
+    more = len(requests) > PENDING_PAGE_SIZE
+    if before is not None:
+        # Лишняя строка при листании назад — в начале списка
+        requests = requests[1:] if more else requests
+        has_prev, has_next = more, True
+    else:
+        requests = requests[:PENDING_PAGE_SIZE]
+        has_prev, has_next = after is not None, more
+
+    if not requests:
+        if after is None and before is None:
+            await query.edit_message_text(
+                "В настоящее время нет ожидающих запросов.",
+                reply_markup=get_admin_main_keyboard()
+            )
+            return
+        # Запросы этой страницы уже разобраны — начинаем с первой
+        await show_pending_requests(query)
+        return
+
+    text = "📋 Ожидающие запросы:\n"
+    for req in requests:
+        text += f"\n#{req['request_id']} от {req['user_name']} (@{req['username'] or 'нет'})"
+    await query.edit_message_text(
+        text,
+        reply_markup=get_pending_requests_keyboard(requests, has_prev, has_next)
+    )
+
+async def render_search_page(search: str, page: int = 0, after: Optional[tuple] = None,
+                             before: Optional[tuple] = None) -> tuple:
+    """Текст (HTML) и кнопки страницы результатов поиска"""
+    hits = await search_messages(search, limit=SEARCH_PAGE_SIZE, after=after, before=before)
+    more = len(hits) > SEARCH_PAGE_SIZE
+    if before is not None:
+        # Лишняя строка при листании назад — в начале списка
+        hits = hits[1:] if more else hits
+        has_prev, has_next = more, True
+    else:
+        hits = hits[:SEARCH_PAGE_SIZE]
+        has_prev, has_next = after is not None, more
+    if not hits:
+        return f"🔍 По запросу «{html.escape(search)}» ничего не найдено.", None
+
+    text = f"🔍 Результаты по запросу «{html.escape(search)}», страница {page + 1}:\n"
+    for hit in hits:
+        user = html.escape(hit['user_name'] or str(hit['user_id']))
+        if hit['user_id']:
+            user = f'<a href="tg://user?id={hit["user_id"]}">{user}</a>'
+        snippet = html.escape(hit['snippet']).replace('\x02', '<b>').replace('\x03', '</b>')
+        text += (
+            f"\n#{hit['request_id']} {user} (@{html.escape(hit['username'] or 'нет')}) · {hit['sent_at']}\n"
+            f"{snippet}\n"
+        )
+    return text, get_search_keyboard(hits, page, has_prev, has_next)
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search <текст> — поиск по истории переписки"""
+    if not is_specialist(update.effective_user.id):
+        outbound.send_message(update.effective_chat.id, "Доступ запрещен")
+        return
+
+    search = " ".join(context.args or [])
+    if not search:
+        outbound.send_message(
+            update.effective_chat.id,
+            "Использование: /search <текст>, например /search 12.00R20"
+        )
+        return
+
+    # Запрос нужен кнопкам листания: в callback_data он может не поместиться
+    context.user_data['search_query'] = search
+    text, keyboard = await render_search_page(search)
+    outbound.send_message(update.effective_chat.id, text, reply_markup=keyboard, parse_mode='HTML')
+
+EXPORT_USAGE = (
+    "Использование: /export [html|jsonl|csv] [номер запроса | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]]\n"
+    f"Без номера и дат выгружаются сообщения за последние {EXPORT_DEFAULT_DAYS} дней."
+)
+
+def parse_export_args(args: List[str]) -> Optional[Dict]:
+    """Разбирает аргументы /export; None — если они некорректны"""
+    # Выгрузка нужна редко, поэтому модуль загружается при первом обращении
+    from export import EXPORT_FORMATS
+    args = list(args)
+    options = {'fmt': 'html', 'request_id': None, 'since': None, 'until': None, 'last_day': None}
+    if args and args[0].lower() in EXPORT_FORMATS:
+        options['fmt'] = args.pop(0).lower()
+    if len(args) > 2:
+        return None
+    if len(args) == 1 and args[0].lstrip('#').isdigit():
+        options['request_id'] = int(args[0].lstrip('#'))
+        return options
+    try:
+        dates = [datetime.strptime(arg, "%Y-%m-%d") for arg in args]
+    except ValueError:
+        return None
+    if not dates:
+        dates = [datetime.utcnow() - timedelta(days=EXPORT_DEFAULT_DAYS), datetime.utcnow()]
+    # Обе даты включительно: sent_at < начала следующего дня
+    options['since'] = dates[0].strftime("%Y-%m-%d")
+    options['last_day'] = dates[-1].strftime("%Y-%m-%d")
+    options['until'] = (dates[-1] + timedelta(days=1)).strftime("%Y-%m-%d")
+    return options
+
+async def send_export(chat_id: int, options: Dict):
+    """Формирует выгрузку и отправляет её документом"""
+    from export import export_transcript
+    if options['request_id'] is not None:
+        title = f"Переписка по запросу #{options['request_id']}"
+        filename = f"request_{options['request_id']}.{options['fmt']}"
+    else:
+        title = f"Переписка с {options['since']} по {options['last_day']}"
+        filename = f"messages_{options['since']}_{options['last_day']}.{options['fmt']}"
+
+    try:
+        file, count = await export_transcript(
+            options['fmt'], title, request_id=options['request_id'],
+            since=options['since'], until=options['until']
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки переписки: {e}")
+        outbound.send_message(chat_id, "Не удалось сформировать выгрузку.")
+        return
+
+    with file:
+        size = file.seek(0, 2)
+        file.seek(0)
+        if size > EXPORT_MAX_BYTES:
+            outbound.send_message(
+                chat_id,
+                f"Выгрузка занимает {size // (1024 * 1024)} МБ, Telegram принимает не больше "
+                f"{EXPORT_MAX_BYTES // (1024 * 1024)} МБ. Уменьшите период."
+            )
+            return
+        # Содержимое читается сразу: повторная отправка не зависит от позиции в файле
+        document = InputFile(file.read(), filename=filename)
+
+    outbound.submit(chat_id, 'send_document', document=document, caption=f"{title}\nСообщений: {count}")
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /export — выгрузка переписки файлом"""
+    if not is_specialist(update.effective_user.id):
+        outbound.send_message(update.effective_chat.id, "Доступ запрещен")
+        return
+
+    options = parse_export_args(context.args or [])
+    if options is None:
+        outbound.send_message(update.effective_chat.id, EXPORT_USAGE)
+        return
+
+    outbound.send_message(update.effective_chat.id, "⏳ Готовлю выгрузку…")
+    run_in_background(send_export(update.effective_chat.id, options))
+
+def format_size(size: int) -> str:
+    """Размер в байтах в удобном для чтения виде"""
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+async def media_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /mediastats — сколько повторов медиа не переслано"""
+    if not is_specialist(update.effective_user.id):
+        outbound.send_message(update.effective_chat.id, "Доступ запрещен")
+        return
+
+    stats = await get_media_stats()
+    text = (
+        f"📎 Уникальных файлов: {stats['files']}\n"
+        f"Получено медиа: {stats['received']}, из них повторов в запросах: {stats['duplicates']}\n"
+        f"Объём уникальных файлов: {format_size(stats['stored_bytes'])}\n"
+        f"Не переслано повторов: {format_size(stats['saved_bytes'])}"
+    )
+    if media_mirror.enabled:
+        text += (
+            f"\nЛокальная копия: {stats['mirrored_files']} файлов, {format_size(stats['mirrored_bytes'])}, "
+            f"ожидают скачивания: {stats['mirror_pending']}"
+        )
+    outbound.send_message(update.effective_chat.id, text)
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats — время ответа, сессии и запросы по дням"""
+    if not is_specialist(update.effective_user.id):
+        outbound.send_message(update.effective_chat.id, "Доступ запрещен")
+        return
+
+    outbound.send_message(update.effective_chat.id, await build_stats_report(), parse_mode='HTML')
+
 def is_forwarded_post(message: Message) -> bool:
     """Проверяет, является ли сообщение пересланным постом"""
     return (message.forward_from_chat is not None or 
             message.forward_from is not None or
             message.forward_sender_name is not None)
-async def end_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+router = CallbackRouter(denied_text="Вы не являетесь администратором")
+
+def is_main_admin(user_id: int) -> bool:
+    """Массовые операции доступны только главному администратору"""
+    return user_id == ADMIN_ID
+
+@router.action('end_session', access=is_specialist)
+async def end_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, session_id: int):
     query = update.callback_query
-    await query.answer()
-    
-    if query.from_user.id != ADMIN_ID:
-        await query.answer("Вы не являетесь администратором")
+    session = await get_session_info(session_id)
+    if not session or session['admin_id'] != query.from_user.id:
+        outbound.send_message(query.from_user.id, "Сессия уже завершена")
         return
-    
-    session_id = int(query.data.split('_')[2])
-    end_session(session_id)
+    # Накопленные тексты уходят специалисту до сообщения о завершении
+    text_bundles.flush(session_id)
+    await end_session(session_id)
     
     await query.edit_message_text(
         "Сессия успешно завершена",
@@ -99,270 +488,270 @@ async def end_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     )
     
     # Отправляем уведомление пользователю
-    session = get_active_session_by_user(session_id)
-    if session:
-        await context.bot.send_message(
-            chat_id=session['user_id'],
-            text="Сессия со специалистом завершена. Если у вас остались вопросы, создайте новый запрос."
-        )
-async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    outbound.send_message(
+        chat_id=session['user_id'],
+        text="Сессия со специалистом завершена. Если у вас остались вопросы, создайте новый запрос."
+    )
+
+@router.action('contact_specialist')
+async def contact_specialist_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    user = query.from_user
     
-    if query.data == 'contact_specialist':
-        user = query.from_user
-        
-        if get_active_session_by_user(user.id):
-            await query.edit_message_text(
-                "Вы уже находитесь в сессии со специалистом. Пожалуйста, дождитесь ответа.",
-                reply_markup=get_main_menu_keyboard()
-            )
-            return
-        
-        if get_user_active_request(user.id):
-            await query.edit_message_text(
-                "У вас уже есть активный запрос. Дождитесь ответа специалиста.",
-                reply_markup=get_main_menu_keyboard()
-            )
-            return
-        
-        request_id = add_user_request(
-            user_id=user.id,
-            user_name=user.full_name,
-            username=user.username,
-            request_text="Запрос на связь со специалистом"
-        )
-        
+    if await get_active_session_by_user(user.id):
         await query.edit_message_text(
-            "Отправьте ваш запрос в сообщении или перешлите пост из Telegram. Все сообщения будут сохранены и переданы специалисту.",
+            "Вы уже находитесь в сессии со специалистом. Пожалуйста, дождитесь ответа.",
             reply_markup=get_main_menu_keyboard()
         )
-        
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=f"📩 Новый запрос на связь (#{request_id}) от {user.full_name} (@{user.username or 'нет'})",
-            reply_markup=get_admin_request_keyboard(request_id)
+        return
+    
+    if await get_user_active_request(user.id):
+        await query.edit_message_text(
+            "У вас уже есть активный запрос. Дождитесь ответа специалиста.",
+            reply_markup=get_main_menu_keyboard()
         )
+        return
     
-    elif query.data.startswith('accept_request_'):
-        if query.from_user.id != ADMIN_ID:
-            await query.answer("Вы не являетесь администратором")
-            return
-        
-        if get_active_admin_session():
-            await query.answer("У вас уже есть активная сессия. Завершите её перед принятием нового запроса.")
-            return
-        
-        request_id = int(query.data.split('_')[2])
-        
-        if start_request_processing(request_id):
-            with get_db_connection() as conn:
-                cursor = conn.execute(
-                    "SELECT user_id, user_name, username FROM user_requests WHERE request_id = ?",
-                    (request_id,)
-                )
-                request = cursor.fetchone()
-            
-            if request:
-                session_id = create_session(request_id, request['user_id'])
-                messages = get_messages_for_request(request_id)
-                
-                media_group = []
-                for msg in messages:
-                    if msg['media_type'] == 'photo':
-                        media_group.append(InputMediaPhoto(
-                            media=msg['media_id'],
-                            caption=f"👤 {request['user_name']} (@{request['username'] or 'нет'}):\n{msg['message_text']}" if msg['message_text'] else None
-                        ))
-                    elif msg['media_type'] == 'video':
-                        media_group.append(InputMediaVideo(
-                            media=msg['media_id'],
-                            caption=f"👤 {request['user_name']} (@{request['username'] or 'нет'}):\n{msg['message_text']}" if msg['message_text'] else None
-                        ))
-                    elif msg['media_type'] == 'document':
-                        media_group.append(InputMediaDocument(
-                            media=msg['media_id'],
-                            caption=f"👤 {request['user_name']} (@{request['username'] or 'нет'}):\n{msg['message_text']}" if msg['message_text'] else None
-                        ))
-                    elif msg['message_text']:
-                        await context.bot.send_message(
-                            chat_id=ADMIN_ID,
-                            text=f"👤 {request['user_name']} (@{request['username'] or 'нет'}):\n{msg['message_text']}",
-                            reply_markup=get_admin_session_keyboard(session_id)
-                        )
-                
-                if media_group:
-                    await context.bot.send_media_group(
-                        chat_id=ADMIN_ID,
-                        media=media_group
-                    )
-                
-                await query.edit_message_text(
-                    f"✅ Вы приняли запрос #{request_id}\n"
-                    f"Пользователь: {request['user_name']} (@{request['username'] or 'нет'})\n"
-                    f"Теперь вы можете общаться с пользователем.",
-                    reply_markup=get_admin_session_keyboard(session_id)
-                )
-                
-                await context.bot.send_message(
-                    chat_id=request['user_id'],
-                    text="👨‍💼 Специалист готов вам помочь. Пожалуйста, опишите ваш вопрос."
-                )
+    # Запрос закрепляется за специалистом, которому придёт уведомление:
+    # медиа до начала сессии пересылаются ему же
+    specialist_id = await pick_specialist()
+    request_id = await add_user_request(
+        user_id=user.id,
+        user_name=user.full_name,
+        username=user.username,
+        request_text="Запрос на связь со специалистом",
+        specialist_id=specialist_id
+    )
     
-    elif query.data.startswith('reject_request_'):
-        if query.from_user.id != ADMIN_ID:
-            await query.answer("Вы не являетесь администратором")
-            return
-        
-        request_id = int(query.data.split('_')[2])
-        
-        with get_db_connection() as conn:
-            conn.execute(
-                "DELETE FROM user_requests WHERE request_id = ?",
-                (request_id,)
-            )
-            conn.commit()
-        
-        await query.edit_message_text(f"❌ Запрос #{request_id} отклонен")
+    await query.edit_message_text(
+        "Отправьте ваш запрос в сообщении или перешлите пост из Telegram. Все сообщения будут сохранены и переданы специалисту.",
+        reply_markup=get_main_menu_keyboard()
+    )
     
-    elif query.data == 'show_all_requests':
-        if query.from_user.id != ADMIN_ID:
-            await query.answer("Вы не являетесь администратором")
-            return
-            
-        pending_requests = get_pending_requests()
-        if pending_requests:
-            text = "📋 Ожидающие запросы:\n"
-            for req in pending_requests:
-                text += f"\n#{req['request_id']} от {req['user_name']} (@{req['username'] or 'нет'})"
-            
-            await query.edit_message_text(
-                text,
-                reply_markup=get_admin_main_keyboard()
-            )
-        else:
-            await query.edit_message_text(
-                "В настоящее время нет ожидающих запросов.",
-                reply_markup=get_admin_main_keyboard()
+    if request_digests.enabled:
+        request_digests.add(specialist_id, request_id)
+        return
+    outbound.send_message(
+        chat_id=specialist_id,
+        text=f"📩 Новый запрос на связь (#{request_id}) от {user.full_name} (@{user.username or 'нет'})",
+        reply_markup=get_admin_request_keyboard(request_id)
+    )
+
+@router.action('accept_request', access=is_specialist)
+async def accept_request_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int):
+    query = update.callback_query
+    admin_id = query.from_user.id
+    
+    async with start_session(admin_id, request_id) as accepted:
+        if accepted:
+            request, session_id = accepted
+            await query.edit_message_text(accepted_text(request), reply_markup=get_admin_session_keyboard(session_id))
+            await add_relayed_messages(admin_id, [query.message.message_id], session_id)
+            await notify_session_started(request, session_id, admin_id)
+
+@router.action('digest_accept', access=is_specialist)
+async def digest_accept_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int):
+    query = update.callback_query
+    admin_id = query.from_user.id
+    
+    # Сводка остаётся на месте, подтверждение приходит отдельным сообщением
+    async with start_session(admin_id, request_id) as accepted:
+        if accepted:
+            request, session_id = accepted
+            delivery = outbound.send_message(
+                admin_id, accepted_text(request), reply_markup=get_admin_session_keyboard(session_id)
             )
+            track_relayed(admin_id, session_id, [delivery])
+            await notify_session_started(request, session_id, admin_id)
+    request_digests.refresh(query.message.chat_id, query.message.message_id, query.message.text)
+
+@router.action('select_session', access=is_specialist)
+async def select_session_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, session_id: int):
+    admin_id = update.callback_query.from_user.id
+    session = await get_session_info(session_id)
+    if not session or session['admin_id'] != admin_id:
+        outbound.send_message(admin_id, "Сессия уже завершена")
+        return
     
-    elif query.data == 'end_all_sessions':
-        if query.from_user.id != ADMIN_ID:
-            await query.answer("Вы не являетесь администратором")
-            return
-            
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM active_sessions")
-            conn.execute("UPDATE user_requests SET status = 'pending' WHERE status = 'in_progress'")
-            conn.commit()
-            
-        await query.edit_message_text(
-            "✅ Все активные сессии завершены, запросы возвращены в очередь.",
-            reply_markup=get_admin_main_keyboard()
-        )
+    await set_current_session(admin_id, session_id)
+    outbound.send_message(
+        admin_id,
+        f"💬 Текущий диалог: {session['user_name']} (@{session['username'] or 'нет'})"
+    )
+
+@router.action('reject_request', access=is_specialist)
+async def reject_request_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int):
+    if await delete_request(request_id):
+        await update.callback_query.edit_message_text(f"❌ Запрос #{request_id} отклонен")
+    else:
+        await update.callback_query.edit_message_text(f"⚠️ Запрос #{request_id} уже принят")
+
+@router.action('digest_reject', access=is_specialist)
+async def digest_reject_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, request_id: int):
+    query = update.callback_query
+    if not await delete_request(request_id):
+        outbound.send_message(query.from_user.id, f"⚠️ Запрос #{request_id} уже принят")
+    request_digests.refresh(query.message.chat_id, query.message.message_id, query.message.text)
+
+@router.action('show_all_requests', access=is_specialist)
+async def show_all_requests_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await show_pending_requests(update.callback_query)
+
+@router.action('requests_after', access=is_specialist)
+async def requests_after_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                 created_at: str, request_id: int):
+    await show_pending_requests(update.callback_query, after=(created_at, request_id))
+
+@router.action('requests_before', access=is_specialist)
+async def requests_before_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                  created_at: str, request_id: int):
+    await show_pending_requests(update.callback_query, before=(created_at, request_id))
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0,
+                           after: Optional[tuple] = None, before: Optional[tuple] = None):
+    query = update.callback_query
+    search = context.user_data.get('search_query')
+    if not search:
+        await query.edit_message_text("Результаты поиска устарели, повторите /search.")
+        return
     
-    elif query.data == 'clear_all_requests':
-        if query.from_user.id != ADMIN_ID:
-            await query.answer("Вы не являетесь администратором")
-            return
-            
-        with get_db_connection() as conn:
-            conn.execute("DELETE FROM user_requests")
-            conn.execute("DELETE FROM active_sessions")
-            conn.execute("DELETE FROM session_messages")
-            conn.commit()
-            
-        await query.edit_message_text(
-            "✅ Все запросы, сессии и сообщения очищены.",
-            reply_markup=get_admin_main_keyboard()
+    text, keyboard = await render_search_page(search, page, after=after, before=before)
+    await query.edit_message_text(text, reply_markup=keyboard, parse_mode='HTML')
+
+@router.action('search_after', access=is_specialist)
+async def search_after_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                               page: int, rank: float, message_id: int):
+    await show_search_page(update, context, page, after=(rank, message_id))
+
+@router.action('search_before', access=is_specialist)
+async def search_before_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                                page: int, rank: float, message_id: int):
+    await show_search_page(update, context, page, before=(rank, message_id))
+
+@router.action('search_page', access=is_specialist)
+async def search_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
+    await show_search_page(update, context)
+
+@router.action('admin_menu', access=is_specialist)
+async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.edit_message_text(
+        "Панель администратора",
+        reply_markup=get_admin_main_keyboard()
+    )
+
+@router.action('end_all_sessions', access=is_main_admin)
+async def end_all_sessions_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text_bundles.flush_all()
+    await reset_active_sessions()
+    await update.callback_query.edit_message_text(
+        "✅ Все активные сессии завершены, запросы возвращены в очередь.",
+        reply_markup=get_admin_main_keyboard()
+    )
+
+@router.action('clear_all_requests', access=is_main_admin)
+async def clear_all_requests_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await clear_all_requests()
+    await update.callback_query.edit_message_text(
+        "✅ Все запросы, сессии и сообщения очищены.",
+        reply_markup=get_admin_main_keyboard()
+    )
+
+async def handle_user_text(user, chat_id: int, text: str):
+    """Обрабатывает текст пользователя (или пачку задержанных текстов)"""
+    if session := await get_active_session_by_user(user.id):
+        message_buffer.add(
+            session['session_id'],
+            session['request_id'],
+            user.id,
+            message_text=text
+        )
+        text_bundles.add(session, user.full_name, text)
+        return
+
+    if not (request := await get_user_active_request(user.id)):
+        outbound.send_message(
+            chat_id,
+            "Пожалуйста, используйте кнопки меню для взаимодействия с ботом.",
+            reply_markup=get_main_menu_keyboard()
         )
+        return
+
+    message_buffer.add(
+        None,
+        request['request_id'], 
+        user.id, 
+        message_text=text
+    )
+    outbound.send_message(
+        chat_id,
+        "Ваш запрос сохранён. Специалист свяжется с вами в рабочее время.",
+        reply_markup=get_main_menu_keyboard()
+    )
 
+# Тексты сверх лимита частоты обрабатываются позже одним сообщением
+flood_control = FloodControl(handle_user_text)
+register(Gauge("bot_flood_limited_users", "Пользователи с задержанными сообщениями",
+               flood_control.limited_users))
 
 async def handle_user_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message = update.effective_message
+
+    media = message.photo or message.video or message.document
+
+    if message.text and not media:
+        if flood_control.admit(user, message.chat_id, message.text):
+            await handle_user_text(user, message.chat_id, message.text)
+        return
+
+    # Задержанные тексты обрабатываются раньше медиа, отправленного после них
+    await flood_control.flush(user.id)
     
-    if session := get_active_session_by_user(user.id):
-        await forward_message_to_admin(update, context, session)
+    if session := await get_active_session_by_user(user.id):
+        if media:
+            await forward_message_to_admin(update, context, session)
         return
 
-    if not (request := get_user_active_request(user.id)):
-        await message.reply_text(
+    if not (request := await get_user_active_request(user.id)):
+        outbound.send_message(
+            message.chat_id,
             "Пожалуйста, используйте кнопки меню для взаимодействия с ботом.",
             reply_markup=get_main_menu_keyboard()
         )
         return
     
     # Обработка медиагрупп (включая одиночные медиа)
-    if message.photo or message.video or message.document:
-        media_group_id = message.media_group_id or f"single_{message.message_id}"
-        
-        if media_group_id not in user_media_groups:
-            user_media_groups[media_group_id] = MediaGroup(
-                request['request_id'], 
-                user.id, 
-                user.full_name, 
-                user.username
-            )
-        
-        user_media_groups[media_group_id].add_message(message)
-    
-        return
-    
-    # Обработка текстовых сообщений
-    if message.text:
-        add_message_to_request(
-            request['request_id'], 
-            user.id, 
-            message_text=message.text
-        )
-        await message.reply_text(
-            "Ваш запрос сохранён. Специалист свяжется с вами в рабочее время.",
-            reply_markup=get_main_menu_keyboard()
-        )
+    if media:
+        await collect_media(message, request['request_id'], user.id, user.full_name, user.username)
 
 async def forward_message_to_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Dict):
     user = update.effective_user
     message = update.effective_message
     
-    # Обработка медиагрупп (включая одиночные медиа)
-    if message.photo or message.video or message.document:
-        media_group_id = message.media_group_id or f"single_{message.message_id}"
-        
-        if media_group_id not in user_media_groups:
-            user_media_groups[media_group_id] = MediaGroup(
-                session['request_id'],
-                user.id,
-                user.full_name,
-                user.username,
-                session_id=session['session_id']
-            )
-        
-        user_media_groups[media_group_id].add_message(message)
-        return
-    
-    # Обработка текстовых сообщений
-    if message.text:
-        add_session_message(
-            session['session_id'],
-            user.id,
-            message_text=message.text
-        )
-        await context.bot.send_message(
-            chat_id=ADMIN_ID,
-            text=f"👤 {user.full_name}:\n{message.text}",
-            reply_markup=get_admin_session_keyboard(session['session_id'])
-        )
+    # Тексты, отправленные до медиа, уходят специалисту раньше него
+    text_bundles.flush(session['session_id'])
+    await collect_media(
+        message, session['request_id'], user.id, user.full_name, user.username,
+        session_id=session['session_id']
+    )
 
 async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != ADMIN_ID:
+    admin_id = update.effective_user.id
+    if not is_specialist(admin_id):
         return
     
     message = update.effective_message
-    session = get_active_admin_session()
+    session = None
+    # Ответ (reply) на пересланное сообщение уходит в его сессию,
+    # остальные сообщения — в текущую сессию специалиста
+    if message.reply_to_message:
+        session = await get_session_by_reply(admin_id, message.reply_to_message.message_id)
+    if session is None:
+        session = await get_current_session(admin_id)
     
     if not session:
-        await message.reply_text(
+        outbound.send_message(
+            message.chat_id,
             "Панель администратора",
             reply_markup=get_admin_main_keyboard()
         )
@@ -372,157 +761,159 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     
     # Обработка медиагрупп (включая одиночные медиа)
     if message.photo or message.video or message.document:
-        media_group_id = message.media_group_id or f"single_{message.message_id}"
-        
-        if media_group_id not in user_media_groups:
-            user_media_groups[media_group_id] = MediaGroup(
-                session['request_id'],
-                ADMIN_ID,
-                "Специалист",
-                None,
-                session_id=session['session_id']
-            )
-        
-        user_media_groups[media_group_id].add_message(message)
+        await collect_media(
+            message, session['request_id'], admin_id, "Специалист", None,
+            session_id=session['session_id']
+        )
         return
     
     # Обработка текстовых сообщений
     if message.text:
-        add_session_message(
+        message_buffer.add(
             session['session_id'],
-            ADMIN_ID,
+            session['request_id'],
+            admin_id,
             message_text=message.text
         )
-        await context.bot.send_message(
+        outbound.send_message(
             chat_id=user_id,
-            text=f"{message.text}"
+            text=f"{message.text}",
+            priority=PRIORITY_HIGH
         )
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /admin для панели управления администратора"""
-    if update.effective_user.id != ADMIN_ID:
-        await update.message.reply_text("Доступ запрещен")
+    if not is_specialist(update.effective_user.id):
+        outbound.send_message(update.effective_chat.id, "Доступ запрещен")
         return
         
-    await update.message.reply_text(
+    outbound.send_message(
+        update.effective_chat.id,
         "Панель администратора",
         reply_markup=get_admin_main_keyboard()  # Кнопки из keyboards.py
     )
-async def check_media_groups(context: ContextTypes.DEFAULT_TYPE):
-    now = datetime.now()
+
+def media_rows(group: MediaGroup, session_id: Optional[int]) -> List[tuple]:
+    """Строки для пакетного сохранения медиа группы в session_messages"""
+    rows = []
+    for i, (message_id, media_type, file_id, file_unique_id) in enumerate(sorted(group.items)):
+        caption = group.caption if i == 0 else None
+        rows.append((session_id, group.request_id, group.user_id, caption, media_type, file_id, file_unique_id))
+    return rows
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+}
+
+@instrument
+async def process_media_group(media_group_id: str):
+    """Отправляет и сохраняет медиа-группу после паузы между элементами.
+
+    Состояние группы в журнале меняется open -> sent -> done: после
+    перезапуска отправленная группа только сохраняется, а не уходит повторно.
+    """
+    group = user_state.pop_media_group(media_group_id)
+    if group is None:
+        return
+    if group.duplicates:
+        outbound.send_message(
+            group.user_id,
+            f"ℹ️ Файлов, уже отправленных по этому запросу: {group.duplicates}. Повторно они не пересылаются."
+        )
     
-    for media_group_id, group in list(user_media_groups.items()):
-        if group.is_expired():
-            try:
-                media = []
-                for i, msg in enumerate(sorted(group.messages, key=lambda m: m.message_id)):
-                    caption = group.caption if i == 0 else None
-                    
-                    if msg.photo:
-                        media.append(InputMediaPhoto(
-                            media=msg.photo[-1].file_id,
-                            caption=caption
-                        ))
-                    elif msg.video:
-                        media.append(InputMediaVideo(
-                            media=msg.video.file_id,
-                            caption=caption
-                        ))
-                    elif msg.document:
-                        media.append(InputMediaDocument(
-                            media=msg.document.file_id,
-                            caption=caption
-                        ))
-                
-                if media:
-                    if group.session_id:
-                        # Получаем информацию о сессии из базы данных
-                        with get_db_connection() as conn:
-                            cursor = conn.execute(
-                                """SELECT s.session_id, s.request_id, r.user_id, r.user_name, r.username 
-                                   FROM active_sessions s
-                                   JOIN user_requests r ON s.request_id = r.request_id
-                                   WHERE s.session_id = ?""",
-                                (group.session_id,)
-                            )
-                            session_info = cursor.fetchone()
-                        
-                        if session_info:
-                            session_info = dict(session_info)
-                            # Определяем направление отправки
-                            if group.user_id == ADMIN_ID:
-                                # Медиа от администратора - отправляем пользователю
-                                target_chat_id = session_info['user_id']
-                                sender_name = "Специалист"
-                            else:
-                                # Медиа от пользователя - отправляем администратору
-                                target_chat_id = ADMIN_ID
-                                sender_name = f"{group.user_name} (@{group.username or 'нет'})"
-                            
-                            # Отправка медиа
-                            await context.bot.send_media_group(
-                                chat_id=target_chat_id,
-                                media=media
-                            )
-                            
-                            # Сохранение в базу данных
-                            for msg in group.messages:
-                                if msg.photo:
-                                    add_session_message(
-                                        group.session_id,
-                                        group.user_id,
-                                        media_type='photo',
-                                        media_id=msg.photo[-1].file_id,
-                                        message_text=group.caption if msg == group.messages[0] else None
-                                    )
-                                elif msg.video:
-                                    add_session_message(
-                                        group.session_id,
-                                        group.user_id,
-                                        media_type='video',
-                                        media_id=msg.video.file_id,
-                                        message_text=group.caption if msg == group.messages[0] else None
-                                    )
-                                elif msg.document:
-                                    add_session_message(
-                                        group.session_id,group.user_id,
-                                        media_type='document',
-                                        media_id=msg.document.file_id,
-                                        message_text=group.caption if msg == group.messages[0] else None
-                                    )
-                    else:
-                        # Отправка нового запроса (только от пользователя к администратору)
-                        await context.bot.send_media_group(
-                            chat_id=ADMIN_ID,
-                            media=media
-                        )
-                        
-                        for msg in group.messages:
-                            if msg.photo:
-                                add_message_to_request(
-                                    group.request_id,
-                                    group.user_id,
-                                    media_type='photo',
-                                    media_id=msg.photo[-1].file_id,
-                                    message_text=group.caption if msg == group.messages[0] else None
-                                )
-                            elif msg.video:
-                                add_message_to_request(
-                                    group.request_id,
-                                    group.user_id,
-                                    media_type='video',
-                                    media_id=msg.video.file_id,
-                                    message_text=group.caption if msg == group.messages[0] else None
-                                )
-                            elif msg.document:
-                                add_message_to_request(
-                                    group.request_id,
-                                    group.user_id,
-                                    media_type='document',
-                                    media_id=msg.document.file_id,
-                                    message_text=group.caption if msg == group.messages[0] else None
-                                )
-                
-                del user_media_groups[media_group_id]
-            except Exception as e:
-                logger.error(f"Ошибка обработки медиагруппы: {e}")
\ No newline at end of file
+    try:
+        # Журнал — итоговый состав группы: запись последнего элемента могла
+        # закончиться уже после срабатывания таймера и отбросить его как повтор
+        if group.items:
+            group.items = await get_media_group_items(group.journal_id)
+        if not group.items:
+            if group.duplicates:
+                media_sends_saved.inc()
+            return
+        
+        media = [
+            INPUT_MEDIA[media_type](media=file_id, caption=group.caption if i == 0 else None)
+            for i, (message_id, media_type, file_id, file_unique_id) in enumerate(sorted(group.items))
+        ]
+        
+        if group.session_id:
+            # Получаем информацию о сессии из базы данных
+            session_info = await get_session_info(group.session_id)
+            
+            if not session_info:
+                # Сессия уже завершена: отправлять некуда
+                await complete_media_group(group.journal_id, [])
+                return
+            
+            # Определяем направление отправки
+            to_specialist = not is_specialist(group.user_id)
+            if not to_specialist:
+                # Медиа от специалиста - отправляем пользователю
+                target_chat_id = session_info['user_id']
+            else:
+                # Медиа от пользователя - отправляем специалисту сессии
+                target_chat_id = session_info['admin_id'] or ADMIN_ID
+            
+            # Отправка медиа
+            delivery = outbound.send_media_group(
+                chat_id=target_chat_id,
+                media=media,
+                priority=PRIORITY_HIGH
+            )
+            if to_specialist:
+                track_relayed(target_chat_id, group.session_id, [delivery])
+        else:
+            # Медиа к ещё не принятому запросу (только от пользователя) —
+            # специалисту, получившему уведомление о запросе
+            request = await get_request(group.request_id)
+            if not request:
+                # Запрос уже отклонён: отправлять некуда
+                await complete_media_group(group.journal_id, [])
+                return
+            delivery = outbound.send_media_group(
+                chat_id=request['specialist_id'] or await pick_specialist(),
+                media=media
+            )
+        
+        await delivery
+        await mark_media_group_sent(group.journal_id)
+        # Сохранение в базу данных одной транзакцией с закрытием группы в журнале
+        await complete_media_group(group.journal_id, media_rows(group, group.session_id))
+    except Exception as e:
+        # Группа остаётся в журнале и будет отправлена после перезапуска
+        logger.error(f"Ошибка обработки медиагруппы: {e}")
+
+async def recover_media_groups():
+    """Восстанавливает медиа-группы из журнала после перезапуска.
+
+    Неотправленные группы снова попадают в хранилище состояния и уходят по
+    обычному таймеру (к ним успеют присоединиться повторно доставленные
+    элементы), отправленные — только сохраняются в историю. Если бот
+    работает в нескольких процессах, каждый восстанавливает группы своих
+    пользователей.
+    """
+    cutoff = (datetime.utcnow() - timedelta(hours=MEDIA_JOURNAL_KEEP_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+    stale = await purge_media_journal(cutoff)
+    if stale:
+        logger.warning(f"Удалены необработанные медиа-группы старше {MEDIA_JOURNAL_KEEP_HOURS} ч: {stale}")
+    
+    resent = saved = 0
+    for row in await get_unfinished_media_groups():
+        if shard_of(row['user_id'], SHARD_COUNT) != SHARD_INDEX:
+            continue
+        group = MediaGroup(
+            row['media_group_id'], row['request_id'], row['user_id'], row['user_name'], row['username'],
+            caption=row['caption'], session_id=row['session_id'], journal_id=row['journal_id']
+        )
+        group.items = row['items']
+        if row['state'] == 'sent':
+            await complete_media_group(group.journal_id, media_rows(group, group.session_id))
+            saved += 1
+        else:
+            user_state.put_media_group(group.media_group_id, group)
+            schedule_media_group(group.media_group_id)
+            resent += 1
+    if resent or saved:
+        logger.info(f"Медиа-группы из журнала: к отправке {resent}, сохранено {saved}")
@@ -1,25 +1,96 @@
+import functools
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from callbacks import encode
 from config import WEBSITE_URL, CHANNEL_URL
 
+# Неизменяемые клавиатуры собираются один раз при импорте
+MAIN_MENU_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📝 Связаться со специалистом", callback_data=encode('contact_specialist'))],
+    [InlineKeyboardButton("📂 Каталог", url=WEBSITE_URL)],
+    [InlineKeyboardButton("📢 Наш канал", url=CHANNEL_URL)]
+])
+
+ADMIN_MAIN_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("📋 Посмотреть все запросы", callback_data=encode('show_all_requests'))],
+    [InlineKeyboardButton("🔚 Завершить все сессии", callback_data=encode('end_all_sessions'))],
+    [InlineKeyboardButton("❌ Очистить все запросы", callback_data=encode('clear_all_requests'))]
+])
+
 def get_main_menu_keyboard():
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📝 Связаться со специалистом", callback_data='contact_specialist')],
-        [InlineKeyboardButton("📂 Каталог", url=WEBSITE_URL)],
-        [InlineKeyboardButton("📢 Наш канал", url=CHANNEL_URL)]
-    ])
+    return MAIN_MENU_KEYBOARD
+
 def get_admin_main_keyboard():
+    return ADMIN_MAIN_KEYBOARD
+
+def get_pending_requests_keyboard(requests: list, has_prev: bool, has_next: bool):
+    """Кнопки страницы ожидающих запросов: принять каждый запрос и листание.
+
+    В callback_data передаётся ключ (created_at, request_id) крайней строки
+    страницы, от которого строится следующая страница.
+    """
+    rows = [
+        [InlineKeyboardButton(f"✅ #{req['request_id']} {req['user_name']}",
+                              callback_data=encode('accept_request', req['request_id']))]
+        for req in requests
+    ]
+    navigation = []
+    if has_prev:
+        first = requests[0]
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Назад", callback_data=encode('requests_before', first['created_at'], first['request_id'])))
+    if has_next:
+        last = requests[-1]
+        navigation.append(InlineKeyboardButton(
+            "Далее ➡️", callback_data=encode('requests_after', last['created_at'], last['request_id'])))
+    if navigation:
+        rows.append(navigation)
+    rows.append([InlineKeyboardButton("↩️ В меню", callback_data=encode('admin_menu'))])
+    return InlineKeyboardMarkup(rows)
+
+def get_search_keyboard(hits: list, page: int, has_prev: bool, has_next: bool):
+    """Кнопки листания результатов /search: номер страницы и ключ
+    (rank, message_id) крайней строки, от которого строится соседняя"""
+    navigation = []
+    if has_prev:
+        first = hits[0]
+        navigation.append(InlineKeyboardButton(
+            "⬅️ Назад", callback_data=encode('search_before', page - 1, first['rank'], first['message_id'])))
+    if has_next:
+        last = hits[-1]
+        navigation.append(InlineKeyboardButton(
+            "Далее ➡️", callback_data=encode('search_after', page + 1, last['rank'], last['message_id'])))
+    return InlineKeyboardMarkup([navigation]) if navigation else None
+
+def get_request_digest_keyboard(requests: list):
+    """Кнопки сводки новых запросов: принять или отклонить каждый ожидающий запрос"""
+    if not requests:
+        return None
+    if len(requests) == 1:
+        request_id = requests[0]['request_id']
+        return InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Принять запрос", callback_data=encode('digest_accept', request_id))],
+            [InlineKeyboardButton("❌ Отклонить запрос", callback_data=encode('digest_reject', request_id))]
+        ])
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("📋 Посмотреть все запросы", callback_data='show_all_requests')],
-        [InlineKeyboardButton("🔚 Завершить все сессии", callback_data='end_all_sessions')],
-        [InlineKeyboardButton("❌ Очистить все запросы", callback_data='clear_all_requests')]
+        [InlineKeyboardButton(f"✅ #{req['request_id']} {req['user_name']}",
+                              callback_data=encode('digest_accept', req['request_id'])),
+         InlineKeyboardButton("❌", callback_data=encode('digest_reject', req['request_id']))]
+        for req in requests
     ])
+
+# Клавиатуры запроса и сессии зависят только от идентификатора:
+# для недавних идентификаторов возвращается уже собранный объект
+@functools.lru_cache(maxsize=1024)
 def get_admin_request_keyboard(request_id: int):
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("✅ Принять запрос", callback_data=f'accept_request_{request_id}')],
-        [InlineKeyboardButton("❌ Отклонить запрос", callback_data=f'reject_request_{request_id}')]
+        [InlineKeyboardButton("✅ Принять запрос", callback_data=encode('accept_request', request_id))],
+        [InlineKeyboardButton("❌ Отклонить запрос", callback_data=encode('reject_request', request_id))]
     ])
 
+@functools.lru_cache(maxsize=1024)
 def get_admin_session_keyboard(session_id: int):
     return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔚 Завершить сессию", callback_data=f'end_session_{session_id}')]
-    ])
\ No newline at end of file
+        [InlineKeyboardButton("💬 Писать в этот диалог", callback_data=encode('select_session', session_id))],
+        [InlineKeyboardButton("🔚 Завершить сессию", callback_data=encode('end_session', session_id))]
+    ])
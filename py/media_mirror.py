@@ -0,0 +1,218 @@
+"""Локальная копия медиафайлов.
+
+В session_messages медиа хранится только как file_id Telegram: если он
+перестанет действовать, файлы из истории пропадут. Фоновая задача
+скачивает файлы реестра media_files (getFile) в каталог MEDIA_MIRROR_DIR.
+
+Файл читается порциями по MEDIA_MIRROR_CHUNK_BYTES: каждая порция сразу
+добавляется в sha256 и пишется во временный файл, целиком в памяти файл
+не бывает. Готовый файл переименовывается в <каталог>/ab/cd/<sha256>, так
+что одинаковое содержимое хранится один раз, даже если его прислали как
+разные файлы. Одновременно скачивается не больше MEDIA_MIRROR_CONCURRENCY
+файлов.
+
+Когда объём хранилища превышает MEDIA_MIRROR_MAX_BYTES, удаляются файлы,
+к которым дольше всего не обращались: обращением считается сохранение и
+чтение через locate(). Реестр общий для всей базы, поэтому задача
+работает в одном процессе; о новых файлах других процессов она узнаёт
+при очередном проходе.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Optional
+
+from telegram.error import BadRequest
+
+from async_db import (
+    get_unmirrored_media, store_media_blob, fail_media_mirror, touch_media_blob, evict_media_blobs
+)
+from metrics import Counter, Gauge, register
+from config import (
+    MEDIA_MIRROR_DIR, MEDIA_MIRROR_MAX_BYTES, MEDIA_MIRROR_CONCURRENCY, MEDIA_MIRROR_CHUNK_BYTES,
+    MEDIA_MIRROR_MAX_FILE_BYTES, MEDIA_MIRROR_INTERVAL_SECONDS, MEDIA_MIRROR_BATCH_SIZE,
+    MEDIA_MIRROR_MAX_ATTEMPTS
+)
+
+logger = logging.getLogger(__name__)
+
+mirror_files = register(Counter(
+    "bot_media_mirror_files_total", "Файлы локальной копии медиа по результату", ("result",)))
+mirror_bytes = register(Counter(
+    "bot_media_mirror_downloaded_bytes_total", "Байты, скачанные в локальную копию медиа"))
+
+class MediaMirror:
+    def __init__(self, root: str = MEDIA_MIRROR_DIR, max_bytes: int = MEDIA_MIRROR_MAX_BYTES,
+                 concurrency: int = MEDIA_MIRROR_CONCURRENCY, chunk_size: int = MEDIA_MIRROR_CHUNK_BYTES,
+                 max_file_bytes: int = MEDIA_MIRROR_MAX_FILE_BYTES,
+                 interval: float = MEDIA_MIRROR_INTERVAL_SECONDS, batch_size: int = MEDIA_MIRROR_BATCH_SIZE,
+                 max_attempts: int = MEDIA_MIRROR_MAX_ATTEMPTS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_file_bytes = max_file_bytes
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Объём хранилища по реестру после последней проверки
+        self.stored_bytes = 0
+        self._bot = None
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def start(self, bot):
+        """Запускает фоновое копирование; вызывается из post_init"""
+        if self.enabled and self._task is None:
+            self._bot = bot
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def notify(self):
+        """Сообщает о новом файле: проход начнётся, не дожидаясь интервала"""
+        if self._task is not None:
+            self._wake.set()
+
+    async def locate(self, file_unique_id: str) -> Optional[str]:
+        """Путь к локальной копии файла или None; обращение продлевает её хранение"""
+        if not self.enabled:
+            return None
+        sha256 = await touch_media_blob(file_unique_id)
+        return self.blob_path(sha256) if sha256 else None
+
+    async def run_once(self, bot=None) -> int:
+        """Скачивает все ещё не скопированные файлы и вытесняет лишнее; возвращает
+        число сохранённых файлов"""
+        import aiohttp
+
+        bot = bot or self._bot
+        if self._client is None:
+            self._client = aiohttp.ClientSession()
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def mirror(row: Dict) -> bool:
+            async with semaphore:
+                return await self._mirror(bot, row)
+
+        total = 0
+        while True:
+            rows = await get_unmirrored_media(self.batch_size)
+            results = await asyncio.gather(*(mirror(row) for row in rows))
+            total += sum(results)
+            # Неудачные файлы остаются в выборке: повторяем их в следующий проход
+            if len(rows) < self.batch_size or not any(results):
+                break
+        await self.evict()
+        return total
+
+    async def evict(self):
+        """Удаляет давно не использованные файлы сверх MEDIA_MIRROR_MAX_BYTES"""
+        evicted, self.stored_bytes = await evict_media_blobs(self.max_bytes)
+        for sha256 in evicted:
+            try:
+                os.remove(self.blob_path(sha256))
+            except FileNotFoundError:
+                pass
+        if evicted:
+            mirror_files.inc("evicted", amount=len(evicted))
+            logger.info(f"Из локальной копии медиа вытеснено файлов: {len(evicted)}")
+
+    async def _mirror(self, bot, row: Dict) -> bool:
+        file_unique_id = row['file_unique_id']
+        if row['file_size'] and row['file_size'] > self.max_file_bytes:
+            await fail_media_mirror(file_unique_id, 0)
+            mirror_files.inc("too_large")
+            return False
+        partial = os.path.join(self.root, "tmp", f"{file_unique_id}.part")
+        try:
+            file = await bot.get_file(row['file_id'])
+            if not file.file_path:
+                raise ValueError("Bot API не вернул file_path")
+            sha256, size = await self._download(file.file_path, partial)
+            path = self.blob_path(sha256)
+            if os.path.exists(path):
+                os.remove(partial)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(partial, path)
+            existed = await store_media_blob(file_unique_id, sha256, size)
+        except Exception as e:
+            if os.path.exists(partial):
+                os.remove(partial)
+            # Недействительный file_id или слишком большой файл не скачать и повторно
+            final = await fail_media_mirror(
+                file_unique_id, 0 if isinstance(e, BadRequest) else self.max_attempts
+            )
+            mirror_files.inc("failed")
+            log = logger.warning if final else logger.info
+            log(f"Не удалось скачать файл {file_unique_id} в локальную копию: {e}")
+            return False
+        mirror_files.inc("deduplicated" if existed else "stored")
+        mirror_bytes.inc(amount=size)
+        return True
+
+    async def _download(self, file_path: str, partial: str) -> tuple:
+        """Пишет файл в partial порциями, считая sha256; возвращает (sha256, размер)"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(partial, "wb") as out:
+            async for chunk in self._chunks(file_path):
+                size += len(chunk)
+                if size > self.max_file_bytes:
+                    raise ValueError(f"файл больше {self.max_file_bytes} байт")
+                digest.update(chunk)
+                out.write(chunk)
+        return digest.hexdigest(), size
+
+    async def _chunks(self, file_path: str):
+        # Локальный Bot API сервер (--local) возвращает путь к файлу на диске
+        if not file_path.startswith(("http://", "https://")):
+            with open(file_path, "rb") as source:
+                while chunk := source.read(self.chunk_size):
+                    yield chunk
+            return
+        async with self._client.get(file_path) as response:
+            # В адресе файла есть токен бота, поэтому в ошибку попадает только статус
+            if response.status != 200:
+                raise ValueError(f"HTTP {response.status}")
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                yield chunk
+
+    async def _run(self):
+        while True:
+            # Файлы, о которых сообщили во время прохода, запустят следующий сразу
+            self._wake.clear()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка копирования медиафайлов: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+media_mirror = MediaMirror()
+
+register(Gauge("bot_media_mirror_store_bytes", "Объём локальной копии медиа, байты",
+               lambda: media_mirror.stored_bytes))
@@ -0,0 +1,208 @@
+"""Метрики бота в формате Prometheus.
+
+Счётчики, гистограммы задержек и вычисляемые показатели хранятся в
+памяти процесса и отдаются по HTTP на /metrics. Обработчики приложения
+оборачиваются автоматически через instrument_application().
+"""
+import functools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(names: Tuple[str, ...], values: Tuple) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _counter_name(name: str) -> str:
+    # Соглашение Prometheus: имя счётчика оканчивается на _total
+    if not name.endswith("_total"):
+        raise ValueError(f"Имя счётчика {name} должно оканчиваться на _total")
+    return name
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = _counter_name(name)
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # Для каждого набора меток: счётчики корзин, сумма, количество
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels + ("le",), values + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class Gauge:
+    """Показатель, значение которого вычисляется в момент чтения метрик.
+
+    С метками read() возвращает словарь: кортеж значений меток -> значение.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float],
+                 labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.read = read
+        self.labels = labels
+
+    def render(self) -> List[str]:
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.error(f"Ошибка чтения метрики {self.name}: {e}")
+            return []
+        if value is None:
+            # Значение недоступно в текущем режиме работы
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if not self.labels:
+            return lines + [f"{self.name} {value}"]
+        for values, item in sorted(value.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {item}")
+        return lines
+
+class CounterReader(Gauge):
+    """Счётчик, значение которого ведёт другой объект и читает read()"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float],
+                 labels: Tuple[str, ...] = ()):
+        super().__init__(_counter_name(name), help_text, read, labels)
+
+_registry: List = []
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+handler_duration = register(Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика обновлений", ("handler",)))
+handler_errors = register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках обновлений", ("handler",)))
+db_duration = register(Histogram(
+    "bot_db_duration_seconds", "Время выполнения функций db.py в потоке БД", ("function",)))
+db_errors = register(Counter(
+    "bot_db_errors_total", "Исключения в функциях db.py", ("function",)))
+api_duration = register(Histogram(
+    "bot_api_call_duration_seconds", "Время вызовов Telegram Bot API", ("method",)))
+api_errors = register(Counter(
+    "bot_api_errors_total", "Ошибки вызовов Telegram Bot API", ("method", "error")))
+media_duplicates = register(Counter(
+    "bot_media_duplicates_total", "Повторно присланные в запросе файлы, которые не пересылались", ("media_type",)))
+media_bytes_saved = register(Counter(
+    "bot_media_bytes_saved_total", "Размер не пересланных повторов, байт"))
+media_sends_saved = register(Counter(
+    "bot_media_sends_saved_total", "Отправки медиа, не понадобившиеся из-за повторов"))
+
+def instrument(callback, name: Optional[str] = None):
+    """Оборачивает асинхронный обработчик замером времени и подсчётом ошибок"""
+    name = name or callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, name)
+    return wrapper
+
+def instrument_application(application):
+    """Оборачивает все зарегистрированные обработчики приложения"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback)
+
+class MetricsServer:
+    """HTTP-сервер, отдающий метрики на /metrics и готовность на /ready"""
+
+    def __init__(self, host: str, port: int, failing: Optional[Callable[[], Awaitable[List[str]]]] = None):
+        self.host = host
+        self.port = port
+        # failing() -> названия непрошедших проверок готовности
+        self.failing = failing
+        self._runner = None
+
+    async def start(self):
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+        async def handle_ready(request):
+            failed = await self.failing() if self.failing else []
+            if failed:
+                return web.Response(status=503, text="not ready: " + ", ".join(failed))
+            return web.Response(text="ready")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        app.router.add_get("/ready", handle_ready)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики и готовность доступны на http://{self.host}:{self.port}/metrics и /ready")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
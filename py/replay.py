@@ -0,0 +1,101 @@
+"""Пересылка истории запроса специалисту.
+
+Сообщения читаются из БД порциями и уходят в хронологическом порядке
+минимальным числом вызовов API: подряд идущие тексты склеиваются в
+сообщения до 4096 символов, медиа собираются в альбомы до 10 элементов
+(документы — отдельными альбомами, как требует Telegram).
+
+Планировщик отправляет сообщения одного чата строго в порядке постановки
+в очередь, поэтому вся история ставится в очередь сразу и с тем же
+приоритетом, что и живая переписка, до того как сообщения пользователя
+начнут пересылаться в сессию: новые сообщения не окажутся среди старых.
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from telegram import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+
+from async_db import iter_messages_for_request
+from keyboards import get_admin_session_keyboard
+from sender import outbound, PRIORITY_HIGH
+
+MAX_TEXT_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+MAX_ALBUM_SIZE = 10
+
+_MEDIA_CLASSES = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+}
+
+class HistoryPacker:
+    """Упаковывает сообщения в отправки ('text', str) и ('album', [InputMedia])"""
+
+    def __init__(self, header: str):
+        self.header = header
+        self._text = ""
+        self._album: List = []
+        self._album_kind: Optional[str] = None
+
+    def add(self, row: Dict) -> List[Tuple[str, object]]:
+        """Добавляет сообщение и возвращает готовые к отправке пачки"""
+        ready = []
+        media_class = _MEDIA_CLASSES.get(row['media_type'])
+        if media_class is not None and row['media_id']:
+            ready += self._flush_text()
+            # Фото и видео можно смешивать в альбоме, документы — только с документами
+            kind = 'document' if row['media_type'] == 'document' else 'visual'
+            if self._album and (kind != self._album_kind or len(self._album) == MAX_ALBUM_SIZE):
+                ready += self._flush_album()
+            caption = f"{self.header}\n{row['message_text']}" if row['message_text'] else None
+            self._album.append(media_class(
+                media=row['media_id'],
+                caption=caption[:MAX_CAPTION_LENGTH] if caption else None
+            ))
+            self._album_kind = kind
+        elif row['message_text']:
+            ready += self._flush_album()
+            if self._text and len(self._text) + 2 + len(row['message_text']) <= MAX_TEXT_LENGTH:
+                self._text += f"\n\n{row['message_text']}"
+            else:
+                ready += self._flush_text()
+                self._text = f"{self.header}\n{row['message_text']}"
+        return ready
+
+    def finish(self) -> List[Tuple[str, object]]:
+        """Возвращает оставшиеся пачки"""
+        return self._flush_text() + self._flush_album()
+
+    def _flush_text(self) -> List[Tuple[str, object]]:
+        text, self._text = self._text, ""
+        return [('text', text[i:i + MAX_TEXT_LENGTH]) for i in range(0, len(text), MAX_TEXT_LENGTH)]
+
+    def _flush_album(self) -> List[Tuple[str, object]]:
+        if not self._album:
+            return []
+        album, self._album, self._album_kind = self._album, [], None
+        return [('album', album)]
+
+async def replay_history(request: Dict, session_id: int, admin_id: int) -> List[asyncio.Future]:
+    """Ставит историю запроса в очередь отправки специалисту целиком и
+    возвращает Future отправок (результат — отправленные сообщения)"""
+    packer = HistoryPacker(f"👤 {request['user_name']} (@{request['username'] or 'нет'}):")
+    keyboard = get_admin_session_keyboard(session_id)
+    deliveries: List[asyncio.Future] = []
+
+    def send(batches):
+        for kind, payload in batches:
+            if kind == 'text':
+                deliveries.append(outbound.send_message(
+                    chat_id=admin_id, text=payload, reply_markup=keyboard, priority=PRIORITY_HIGH
+                ))
+            else:
+                deliveries.append(outbound.send_media_group(
+                    chat_id=admin_id, media=payload, priority=PRIORITY_HIGH
+                ))
+
+    async for row in iter_messages_for_request(request['request_id']):
+        send(packer.add(row))
+    send(packer.finish())
+    return deliveries
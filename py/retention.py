@@ -0,0 +1,76 @@
+"""Архивация завершённых диалогов.
+
+Фоновая задача периодически переносит завершённые запросы старше
+RETENTION_DAYS вместе с сообщениями в архивную базу (сжатый JSON) и
+удаляет их из рабочих таблиц небольшими порциями. Между порциями поток
+БД свободен для обработчиков. После переноса место возвращается
+системе через PRAGMA incremental_vacuum.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from async_db import archive_completed_requests, incremental_vacuum
+from config import (
+    RETENTION_DAYS, RETENTION_INTERVAL_SECONDS, RETENTION_BATCH_SIZE,
+    RETENTION_BATCH_PAUSE_SECONDS, RETENTION_VACUUM_PAGES
+)
+
+logger = logging.getLogger(__name__)
+
+class RetentionJob:
+    def __init__(self, days: float = RETENTION_DAYS, interval: float = RETENTION_INTERVAL_SECONDS,
+                 batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_BATCH_PAUSE_SECONDS,
+                 vacuum_pages: int = RETENTION_VACUUM_PAGES):
+        self.days = days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+
+    def start(self):
+        """Запускает периодическую архивацию; вызывается из post_init"""
+        if self.days > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Переносит в архив все подходящие запросы; возвращает их число"""
+        # completed_at хранится в UTC в формате CURRENT_TIMESTAMP
+        cutoff = (datetime.utcnow() - timedelta(days=self.days)).strftime("%Y-%m-%d %H:%M:%S")
+        total = 0
+        while True:
+            moved = await archive_completed_requests(cutoff, self.batch_size)
+            total += moved
+            if moved < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+
+        if total:
+            # Освобождаем страницы такими же небольшими шагами
+            while await incremental_vacuum(self.vacuum_pages) > 0:
+                await asyncio.sleep(self.pause)
+            logger.info(f"В архив перенесено запросов: {total}")
+        self.archived += total
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка архивации завершённых запросов: {e}")
+            await asyncio.sleep(self.interval)
+
+retention = RetentionJob()
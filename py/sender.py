@@ -0,0 +1,298 @@
+"""Планировщик исходящих сообщений.
+
+Все отправки в Telegram проходят через одну очередь с приоритетами.
+Ограничения скорости соблюдаются двумя уровнями token bucket: общий на
+бота и отдельный на каждый чат. Сообщения одного чата уходят строго по
+порядку. На RetryAfter чат ставится на паузу и отправка повторяется.
+После TimedOut повторяются только идемпотентные вызовы (правка, удаление):
+запрос мог дойти до Telegram, и повторная отправка продублировала бы
+сообщение.
+Обработчики ставят сообщение в очередь и сразу продолжают работу, а
+результат доставки можно дождаться через возвращаемый Future.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Deque, Dict, List, Optional
+
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from metrics import Gauge, api_duration, api_errors, register
+from config import (
+    SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_CHAT_BURST,
+    SEND_MAX_CONCURRENCY, SEND_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — важнее
+PRIORITY_HIGH = 0     # переписка в активной сессии
+PRIORITY_NORMAL = 1   # уведомления и ответы меню
+PRIORITY_LOW = 2      # история запроса, массовые рассылки
+
+# Сколько ведер чатов хранится, прежде чем удалить ведра простаивающих чатов
+MAX_TRACKED_CHATS = 10_000
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float, cost: float = 1.0) -> float:
+        """Сколько секунд ждать, пока в ведре будет cost токенов"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        # Дорогие отправки (альбомы) не ждут больше, чем наполнение всего ведра
+        needed = min(cost, self.capacity)
+        if self.tokens < needed:
+            wait = max(wait, (needed - self.tokens) / self.rate)
+        return wait
+
+    def take(self, cost: float = 1.0):
+        self.tokens -= cost
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+@dataclass
+class _Job:
+    priority: int
+    seq: int
+    chat_id: int
+    method: str
+    kwargs: Dict
+    future: asyncio.Future
+    cost: float
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+def _consume_exception(future: asyncio.Future):
+    # Ошибка уже записана в лог; помечаем её полученной, чтобы asyncio
+    # не ругался на Future, который никто не ждёт
+    if not future.cancelled():
+        future.exception()
+
+class OutboundScheduler:
+    def __init__(self, global_rate: float = SEND_GLOBAL_RATE, chat_rate: float = SEND_CHAT_RATE,
+                 chat_burst: float = SEND_CHAT_BURST, max_concurrency: int = SEND_MAX_CONCURRENCY,
+                 max_retries: int = SEND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._chats: Dict[int, Deque[_Job]] = {}
+        # Чаты, чьё первое сообщение можно отправлять: (приоритет, seq, chat_id)
+        self._ready: List[tuple] = []
+        self._busy = set()
+        self._seq = itertools.count()
+        self._bot = None
+        self._worker: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+    def start(self, bot):
+        """Запускает обработку очереди; вызывается из post_init"""
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает планировщик"""
+        deadline = time.monotonic() + timeout
+        while (self._chats or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def submit(self, chat_id: int, method: str, priority: int = PRIORITY_NORMAL,
+               cost: float = 1.0, **kwargs) -> asyncio.Future:
+        """Ставит вызов метода Bot в очередь и возвращает Future с результатом"""
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        job = _Job(priority, next(self._seq), chat_id, method, kwargs, future, cost)
+        queue = self._chats.setdefault(chat_id, deque())
+        queue.append(job)
+        if len(queue) == 1 and chat_id not in self._busy:
+            self._push_ready(chat_id)
+        return future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL,
+                     **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, 'send_message', priority, text=text, **kwargs)
+
+    def send_media_group(self, chat_id: int, media: list, priority: int = PRIORITY_NORMAL,
+                         **kwargs) -> asyncio.Future:
+        if len(media) == 1:
+            # Альбом из одного элемента отправляется обычным сообщением с медиа
+            item = media[0]
+            return self.submit(chat_id, f'send_{item.type}', priority,
+                               caption=item.caption, **{item.type: item.media}, **kwargs)
+        # Альбом Telegram считает как несколько сообщений
+        return self.submit(chat_id, 'send_media_group', priority, cost=len(media),
+                           media=media, **kwargs)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_CHATS:
+                self._forget_idle(time.monotonic())
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _forget_idle(self, now: float):
+        # Полное ведро без паузы и очереди ничем не отличается от нового
+        for chat_id, bucket in list(self._buckets.items()):
+            if bucket.delay(now, bucket.capacity) == 0 and chat_id not in self._chats:
+                del self._buckets[chat_id]
+
+    def _push_ready(self, chat_id: int):
+        head = self._chats[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._ready:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            job = self._chats[chat_id][0]
+            now = time.monotonic()
+
+            chat_wait = self._bucket(chat_id).delay(now, job.cost)
+            if chat_wait > 0:
+                # Чат подождёт, остальные чаты продолжают отправку
+                asyncio.get_running_loop().call_later(chat_wait, self._push_ready, chat_id)
+                continue
+
+            global_wait = self._global.delay(now, job.cost)
+            if global_wait > 0:
+                heapq.heappush(self._ready, (priority, seq, chat_id))
+                await asyncio.sleep(global_wait)
+                continue
+
+            await self._slots.acquire()
+            self._global.take(job.cost)
+            self._bucket(chat_id).take(job.cost)
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, job: _Job):
+        retry_in = None
+        last_error = None
+        started = time.perf_counter()
+        try:
+            job.attempts += 1
+            try:
+                result = await getattr(self._bot, job.method)(chat_id=job.chat_id, **job.kwargs)
+            except Exception as e:
+                api_errors.inc(job.method, type(e).__name__)
+                raise
+            finally:
+                api_duration.observe(time.perf_counter() - started, job.method)
+        except RetryAfter as e:
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            retry_in = float(delay)
+            last_error = e
+            # Флуд-лимит: ставим чат на паузу на указанное Telegram время
+            self._bucket(job.chat_id).pause(time.monotonic(), retry_in)
+        except TimedOut as e:
+            if job.method.startswith('send_'):
+                # Неизвестно, дошло ли сообщение: повтор мог бы его продублировать
+                self._finish(job, error=e)
+            else:
+                retry_in = min(30.0, 0.5 * 2 ** job.attempts)
+                self._bucket(job.chat_id).pause(time.monotonic(), retry_in)
+                last_error = e
+        except NetworkError as e:
+            retry_in = min(30.0, 0.5 * 2 ** job.attempts)
+            self._bucket(job.chat_id).pause(time.monotonic(), retry_in)
+            last_error = e
+        except Exception as e:
+            self._finish(job, error=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self._slots.release()
+
+        if retry_in is not None:
+            if job.attempts > self.max_retries:
+                self._finish(job, error=RuntimeError(f"{job.method}: превышено число повторов ({last_error})"))
+            else:
+                self.retries += 1
+                self._busy.discard(job.chat_id)
+                self._push_ready(job.chat_id)
+
+    def _finish(self, job: _Job, result=None, error: Exception = None):
+        queue = self._chats[job.chat_id]
+        queue.popleft()
+        self._busy.discard(job.chat_id)
+        if queue:
+            self._push_ready(job.chat_id)
+        else:
+            del self._chats[job.chat_id]
+
+        if error is not None:
+            self.failed += 1
+            logger.error(f"Ошибка отправки {job.method} в чат {job.chat_id}: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.sent += 1
+            self._latencies.append(time.monotonic() - job.enqueued_at)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def queue_depth(self) -> int:
+        """Число сообщений, ожидающих отправки"""
+        return sum(len(queue) for queue in self._chats.values())
+
+    def stats(self) -> Dict[str, float]:
+        """Глубина очереди, счётчики и задержка отправки (сек) по последним сообщениям"""
+        latencies = sorted(self._latencies)
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+        return {
+            'queue_depth': self.queue_depth(),
+            'in_flight': len(self._busy),
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency_p50': percentile(0.5),
+            'latency_p99': percentile(0.99),
+        }
+
+outbound = OutboundScheduler()
+
+register(Gauge("bot_outbound_queue_depth", "Сообщения в очереди на отправку", outbound.queue_depth))
+register(Gauge("bot_outbound_in_flight", "Чаты, в которые сейчас идёт отправка", lambda: len(outbound._busy)))
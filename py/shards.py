@@ -0,0 +1,201 @@
+"""Работа бота в нескольких процессах.
+
+При BOT_WORKERS > 1 основной процесс только принимает обновления (long
+polling или webhook) и раскладывает их по процессам-обработчикам по
+user_id: обработчик = user_id % BOT_WORKERS. Все обновления одного
+пользователя попадают в один процесс и обрабатываются в порядке
+поступления. Обновления без пользователя уходят в процесс 0.
+
+Каждый обработчик — обычное приложение из bot.build_application со своим
+потоком БД и очередью исходящих сообщений. Состояние диалогов обработчики
+берут из общей базы (STATE_BACKEND=shared), общий лимит отправки
+SEND_GLOBAL_RATE делится между ними поровну, а фоновые задачи уровня всего
+бота (архивация) работают только в процессе 0.
+
+Модуль импортируется процессами-обработчиками и однопроцессным ботом
+(handlers.py использует shard_of), поэтому на верхнем уровне здесь только
+лёгкие импорты.
+"""
+import asyncio
+import logging
+import os
+import queue
+import signal
+from typing import Dict, List, Optional
+
+from config import TOKEN, BOT_API_URL, UPDATE_QUEUE_SIZE, SEND_GLOBAL_RATE
+
+logger = logging.getLogger(__name__)
+
+# Таймаут long polling основного процесса, секунды
+POLL_TIMEOUT = 10
+
+def user_id_of(data: Dict) -> Optional[int]:
+    """user_id автора обновления в формате Bot API (dict) или None"""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(value.get('from'), dict):
+            return value['from'].get('id')
+    return None
+
+def shard_of(user_id: Optional[int], count: int) -> int:
+    """Номер процесса-обработчика для пользователя"""
+    if user_id is None or count <= 1:
+        return 0
+    return user_id % count
+
+class ShardRouter:
+    """Процессы-обработчики и распределение обновлений между ними"""
+
+    def __init__(self, workers: int, queue_size: int = UPDATE_QUEUE_SIZE):
+        import multiprocessing
+
+        self.workers = workers
+        self._context = multiprocessing.get_context('spawn')
+        # У каждого обработчика своя ограниченная очередь
+        self._queues = [self._context.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._processes: List = []
+        self.dispatched = [0] * workers
+
+    def start(self, token: str = TOKEN, base_url: str = BOT_API_URL):
+        """Запускает процессы; настройки обработчика передаются через окружение"""
+        overrides = {
+            'STATE_BACKEND': 'shared',
+            'SHARD_COUNT': str(self.workers),
+            'SEND_GLOBAL_RATE': str(SEND_GLOBAL_RATE / self.workers),
+        }
+        saved = {key: os.environ.get(key) for key in list(overrides) + ['SHARD_INDEX']}
+        try:
+            os.environ.update(overrides)
+            for index, inbox in enumerate(self._queues):
+                os.environ['SHARD_INDEX'] = str(index)
+                process = self._context.Process(
+                    target=worker_main, args=(inbox, token, base_url),
+                    name=f"bot-worker-{index}", daemon=True
+                )
+                process.start()
+                self._processes.append(process)
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        logger.info(f"Запущено процессов-обработчиков: {self.workers}")
+
+    def _queue_for(self, data: Dict):
+        index = shard_of(user_id_of(data), self.workers)
+        self.dispatched[index] += 1
+        return self._queues[index]
+
+    def dispatch(self, data: Dict) -> bool:
+        """Передаёт обновление без ожидания; False, если очередь обработчика заполнена"""
+        try:
+            self._queue_for(data).put_nowait(data)
+        except queue.Full:
+            return False
+        return True
+
+    async def put(self, data: Dict):
+        """Передаёт обновление, дожидаясь места в очереди обработчика"""
+        inbox = self._queue_for(data)
+        await asyncio.get_running_loop().run_in_executor(None, inbox.put, data)
+
+    def stop(self, timeout: float = 30):
+        """Останавливает обработчики, дав им обработать уже полученные обновления"""
+        for inbox in self._queues:
+            inbox.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} не остановился за {timeout} с")
+                process.terminate()
+        self._processes.clear()
+
+def worker_main(inbox, token: str, base_url: str):
+    """Точка входа процесса-обработчика"""
+    # Остановка приходит от основного процесса через очередь, а не по Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_worker(inbox, token, base_url))
+
+async def _serve_worker(inbox, token: str, base_url: str):
+    from telegram import Update
+    from bot import build_application
+
+    application = build_application(token=token, base_url=base_url)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+async def _poll_updates(bot, router: ShardRouter):
+    from telegram import Update
+    from telegram.error import NetworkError
+
+    await bot.delete_webhook()
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT,
+                                                allowed_updates=Update.ALL_TYPES)
+            except NetworkError as e:
+                logger.warning(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await router.put(update.to_dict())
+                offset = update.update_id + 1
+    finally:
+        # Подтверждаем уже розданные обновления, чтобы не получить их повторно
+        if offset is not None:
+            await bot.get_updates(offset=offset, timeout=0, limit=1)
+
+async def run_sharded(workers: int, mode: str = "polling", token: str = TOKEN,
+                      base_url: str = BOT_API_URL, stop_event: Optional[asyncio.Event] = None):
+    """Запускает обработчики и приём обновлений до SIGINT/SIGTERM или stop_event"""
+    from telegram import Bot, Update
+
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    router = ShardRouter(workers)
+    router.start(token, base_url)
+    try:
+        async with Bot(token, base_url=base_url) as bot:
+            if mode == "webhook":
+                from webhook import WebhookServer
+                from config import WEBHOOK_URL
+                if not WEBHOOK_URL:
+                    raise RuntimeError("Для режима webhook нужно задать WEBHOOK_URL")
+                server = WebhookServer(dispatch=router.dispatch)
+                await server.start()
+                await bot.set_webhook(url=WEBHOOK_URL, secret_token=server.secret,
+                                      allowed_updates=Update.ALL_TYPES)
+                try:
+                    await stop_event.wait()
+                finally:
+                    await server.stop()
+            else:
+                polling = asyncio.create_task(_poll_updates(bot, router))
+                await stop_event.wait()
+                polling.cancel()
+                try:
+                    await polling
+                except asyncio.CancelledError:
+                    pass
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, router.stop)
+        logger.info(f"Обновлений по обработчикам: {router.dispatched}")
@@ -0,0 +1,89 @@
+"""Запуск бота: длительность этапов и готовность к работе.
+
+Этапы запуска отмечаются по порядку через startup.mark(phase): каждый
+этап длится от предыдущей отметки до своей, последний (start_updates) —
+до первой успешной проверки готовности. Длительности попадают в лог и в
+метрику bot_startup_phase_seconds.
+
+Готовность определяется проверками, которые регистрируют модули бота
+(база данных отвечает, приложение принимает обновления). Локальный
+эндпоинт /ready сервера метрик выполняет их при каждом запросе и отвечает
+200, только если все проверки прошли, иначе 503 со списком непрошедших.
+
+Модуль импортируется первым, поэтому отсчёт запуска начинается с его
+загрузки, а на верхнем уровне здесь только лёгкие импорты.
+"""
+import asyncio
+import inspect
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from metrics import Gauge, register
+
+logger = logging.getLogger(__name__)
+
+# Время ожидания одной проверки, секунды
+CHECK_TIMEOUT = 2.0
+# Как часто проверять готовность, пока бот запускается, секунды
+WATCH_INTERVAL = 0.05
+
+class Startup:
+    def __init__(self):
+        self.began = time.perf_counter()
+        self._last = self.began
+        self.phases: Dict[str, float] = {}
+        # Проверка возвращает bool или awaitable с bool
+        self._checks: Dict[str, Callable] = {}
+        self.ready = False
+        self.ready_after: Optional[float] = None
+        self._watch: Optional[asyncio.Task] = None
+
+    def mark(self, phase: str):
+        """Отмечает окончание этапа запуска"""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+
+    def add_check(self, name: str, check: Callable):
+        """Регистрирует проверку готовности; повторная регистрация заменяет прежнюю"""
+        self._checks[name] = check
+
+    async def failing(self) -> List[str]:
+        """Названия непрошедших проверок; пустой список — бот готов"""
+        failed = []
+        for name, check in self._checks.items():
+            try:
+                result = check()
+                if inspect.isawaitable(result):
+                    result = await asyncio.wait_for(result, CHECK_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Проверка готовности {name} не прошла: {e}")
+                result = False
+            if not result:
+                failed.append(name)
+        self.ready = not failed
+        if self.ready and self.ready_after is None:
+            self.mark("start_updates")
+            self.ready_after = self._last - self.began
+            breakdown = ", ".join(f"{phase} {seconds:.3f}" for phase, seconds in self.phases.items())
+            logger.info(f"Бот готов через {self.ready_after:.3f} с: {breakdown}")
+        return failed
+
+    def watch(self):
+        """Проверяет готовность в фоне, пока бот не станет готов впервые"""
+        if self._watch is None:
+            self._watch = asyncio.create_task(self._wait_ready())
+
+    async def _wait_ready(self):
+        while await self.failing():
+            await asyncio.sleep(WATCH_INTERVAL)
+
+startup = Startup()
+
+register(Gauge("bot_startup_phase_seconds", "Длительность этапов последнего запуска, секунды",
+               lambda: {(phase,): seconds for phase, seconds in startup.phases.items()}, ("phase",)))
+
+register(Gauge("bot_ready", "Бот готов принимать обновления (последняя проверка)",
+               lambda: int(startup.ready)))
@@ -0,0 +1,183 @@
+"""Состояние диалогов пользователей.
+
+Хранилище состояния подключаемое (STATE_BACKEND):
+- local — кэш в памяти процесса. Хранит для каждого user_id его ожидающий
+  запрос и активную сессию, чтобы маршрутизация входящих сообщений не
+  обращалась к SQLite. Кэш заполняется из БД при старте, а функции записи
+  в async_db.py сразу кладут в него актуальное состояние затронутых
+  пользователей. Подходит для одного процесса и для тестов.
+- shared — состояние берётся из общей базы SQLite при каждом обращении.
+  Нужен, когда бот работает в нескольких процессах (shards.py): запрос
+  пользователя может изменить процесс специалиста, и локальная копия
+  другого процесса устарела бы.
+
+Медиа-группы, которые ещё собираются, хранятся в процессе в обоих режимах:
+все элементы альбома приходят от одного пользователя и попадают в один
+процесс, а на случай перезапуска они записываются в журнал в SQLite.
+"""
+import abc
+from typing import Dict, Iterable, Optional
+
+from metrics import CounterReader, Gauge, register
+from config import STATE_BACKEND
+
+# Сколько пользователей без запроса и сессии кэш помнит до прогрева
+# (после прогрева отсутствие записи и так означает «нет»)
+MAX_NEGATIVE_ENTRIES = 10_000
+
+class StateBackend(abc.ABC):
+    """Общая часть хранилищ: медиа-группы, ожидающие отправки"""
+
+    def __init__(self):
+        self._media_groups: Dict[str, object] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_media_group(self, media_group_id: str):
+        return self._media_groups.get(media_group_id)
+
+    def put_media_group(self, media_group_id: str, group):
+        self._media_groups[media_group_id] = group
+
+    def pop_media_group(self, media_group_id: str):
+        return self._media_groups.pop(media_group_id, None)
+
+    def media_group_count(self) -> int:
+        return len(self._media_groups)
+
+    @abc.abstractmethod
+    def get_request(self, user_id: int):
+        """Возвращает (найдено, запрос) для пользователя"""
+
+    @abc.abstractmethod
+    def get_session(self, user_id: int):
+        """Возвращает (найдено, сессия) для пользователя"""
+
+    @abc.abstractmethod
+    def set_request(self, user_id: int, request: Optional[Dict]):
+        """Запоминает запрос пользователя; None — запроса нет"""
+
+    @abc.abstractmethod
+    def set_session(self, user_id: int, session: Optional[Dict]):
+        """Запоминает сессию пользователя; None — сессии нет"""
+
+    @abc.abstractmethod
+    def warm(self, pending_requests: Iterable[Dict], active_sessions: Iterable[Dict]):
+        """Заполняет хранилище снимком запросов и сессий из БД"""
+
+    def pending_count(self) -> Optional[int]:
+        """Число пользователей с ожидающим запросом; None — неизвестно"""
+        return None
+
+    def session_count(self) -> Optional[int]:
+        """Число активных сессий; None — неизвестно"""
+        return None
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses}
+
+class LocalStateBackend(StateBackend):
+    """Кэш состояния в памяти процесса"""
+
+    def __init__(self):
+        super().__init__()
+        self._requests: Dict[int, Optional[Dict]] = {}
+        self._sessions: Dict[int, Optional[Dict]] = {}
+        # После прогрева кэш содержит все запросы и сессии, и отсутствие
+        # записи означает, что у пользователя их нет
+        self._complete = False
+
+    def _lookup(self, storage: Dict[int, Optional[Dict]], user_id: int):
+        if user_id in storage:
+            self.hits += 1
+            return True, storage[user_id]
+        if self._complete:
+            self.hits += 1
+            return True, None
+        self.misses += 1
+        return False, None
+
+    def get_request(self, user_id: int):
+        return self._lookup(self._requests, user_id)
+
+    def get_session(self, user_id: int):
+        return self._lookup(self._sessions, user_id)
+
+    def _store(self, storage: Dict[int, Optional[Dict]], user_id: int, value: Optional[Dict]):
+        if value is not None:
+            storage[user_id] = value
+        elif self._complete or len(storage) >= MAX_NEGATIVE_ENTRIES:
+            # Записи None не копятся для каждого пользователя, который когда-либо писал боту
+            storage.pop(user_id, None)
+        else:
+            storage[user_id] = None
+
+    def set_request(self, user_id: int, request: Optional[Dict]):
+        self._store(self._requests, user_id, request)
+
+    def set_session(self, user_id: int, session: Optional[Dict]):
+        self._store(self._sessions, user_id, session)
+
+    def warm(self, pending_requests: Iterable[Dict], active_sessions: Iterable[Dict]):
+        """Заполняет кэш полным снимком запросов и сессий из БД"""
+        self._requests.clear()
+        self._sessions.clear()
+        for request in pending_requests:
+            # Как и get_user_active_request, берём самый ранний запрос
+            self._requests.setdefault(request['user_id'], request)
+        for session in active_sessions:
+            self._sessions.setdefault(session['user_id'], session)
+        self._complete = True
+
+    def pending_count(self) -> int:
+        return sum(1 for request in self._requests.values() if request is not None)
+
+    def session_count(self) -> int:
+        return sum(1 for session in self._sessions.values() if session is not None)
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'requests': len(self._requests),
+            'sessions': len(self._sessions),
+        }
+
+class SharedStateBackend(StateBackend):
+    """Состояние в общей базе: каждое чтение идёт в SQLite, копий в процессе нет"""
+
+    def get_request(self, user_id: int):
+        self.misses += 1
+        return False, None
+
+    def get_session(self, user_id: int):
+        self.misses += 1
+        return False, None
+
+    def set_request(self, user_id: int, request: Optional[Dict]):
+        pass
+
+    def set_session(self, user_id: int, session: Optional[Dict]):
+        pass
+
+    def warm(self, pending_requests: Iterable[Dict], active_sessions: Iterable[Dict]):
+        pass
+
+STATE_BACKENDS = {
+    'local': LocalStateBackend,
+    'shared': SharedStateBackend,
+}
+
+def create_state_backend(kind: str = STATE_BACKEND) -> StateBackend:
+    if kind not in STATE_BACKENDS:
+        raise ValueError(f"Неизвестное хранилище состояния: {kind}")
+    return STATE_BACKENDS[kind]()
+
+user_state = create_state_backend()
+
+register(Gauge("bot_pending_requests", "Ожидающие запросы пользователей", user_state.pending_count))
+register(Gauge("bot_active_sessions", "Активные сессии со специалистами", user_state.session_count))
+register(Gauge("bot_open_media_groups", "Медиа-группы, ожидающие отправки", user_state.media_group_count))
+register(CounterReader("bot_state_cache_hits_total", "Попадания в кэш состояния", lambda: user_state.hits))
+register(CounterReader("bot_state_cache_misses_total", "Промахи кэша состояния", lambda: user_state.misses))
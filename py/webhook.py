@@ -0,0 +1,119 @@
+"""Приём обновлений через webhook.
+
+Встроенный HTTP-сервер на aiohttp принимает POST-запросы от Telegram,
+проверяет секрет из заголовка X-Telegram-Bot-Api-Secret-Token и кладёт
+обновления в update_queue приложения (или передаёт их функции dispatch,
+когда бот работает в нескольких процессах, см. shards.py). Если очередь
+заполнена, сервер отвечает 503, и Telegram повторит доставку позже.
+"""
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    def __init__(self, application: Optional[Application] = None, listen: str = WEBHOOK_LISTEN,
+                 port: int = WEBHOOK_PORT, path: str = WEBHOOK_PATH,
+                 secret: Optional[str] = WEBHOOK_SECRET,
+                 dispatch: Optional[Callable[[Dict], bool]] = None):
+        self.application = application
+        # dispatch(data) -> False, если принять обновление сейчас некуда
+        self.dispatch = dispatch
+        self.listen = listen
+        self.port = port
+        self.path = path
+        # Без заданного секрета генерируем случайный на время работы процесса
+        self.secret = secret or secrets.token_urlsafe(32)
+        self._runner: Optional[web.AppRunner] = None
+
+    def _overloaded(self) -> bool:
+        # При параллельной обработке очередь сразу разбирается в задачи,
+        # и перегрузку показывает число обновлений, принятых в работу
+        processor = self.application.update_processor
+        return (processor.max_concurrent_updates > 1
+                and processor.current_concurrent_updates >= processor.max_concurrent_updates)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        if self.dispatch is not None:
+            if not self.dispatch(data):
+                logger.warning("Очередь обработчика заполнена, webhook отвечает 503")
+                return web.Response(status=503)
+            return web.Response()
+
+        if self._overloaded():
+            logger.warning("Обработчик обновлений перегружен, webhook отвечает 503")
+            return web.Response(status=503)
+        update = Update.de_json(data, self.application.bot)
+        try:
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь обновлений заполнена, webhook отвечает 503")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.listen, self.port)
+        await site.start()
+        # При port=0 система выбирает свободный порт
+        self.port = self._runner.addresses[0][1]
+        logger.info(f"Webhook слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+async def run_webhook(application: Application, url: str = WEBHOOK_URL):
+    """Запускает приложение в режиме webhook до SIGINT/SIGTERM"""
+    if not url:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_URL")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    server = WebhookServer(application)
+    # Тот же порядок запуска и остановки, что и в Application.run_polling
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await server.start()
+    await application.bot.set_webhook(
+        url=url,
+        secret_token=server.secret,
+        allowed_updates=Update.ALL_TYPES
+    )
+    await application.start()
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)